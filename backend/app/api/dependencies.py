@@ -3,6 +3,8 @@ from typing import Optional
 
 from app.core.database import get_db
 from app.db import models
+from app.services.identity_cache import Identity, identity_cache
+from app.services.utils import SettingsSnapshot
 from fastapi import Depends, Header, HTTPException
 from sqlalchemy.orm import Session
 
@@ -10,31 +12,54 @@ logger = logging.getLogger(__name__)
 
 
 # --- Dependency: Auth & Role Check ---
-def get_current_user_from_header(
+def get_current_identity(
     x_user_id: Optional[int] = Header(None), db: Session = Depends(get_db)
-):
+) -> Identity:
+    """Authenticated id/role/flags, served from the identity cache; the users
+    row is not loaded. Use this unless the endpoint reads or changes more."""
     if x_user_id is None:
         raise HTTPException(status_code=401, detail="Missing authentication header")
-    user = db.query(models.User).filter(models.User.id == x_user_id).first()
-    if not user:
+    identity = identity_cache.load(db, x_user_id)
+    if identity is None:
         raise HTTPException(status_code=401, detail="User not found")
-    if not user.is_active:
+    if not identity.is_active:
+        raise HTTPException(status_code=403, detail="User is inactive")
+    return identity
+
+
+def get_current_user_from_header(
+    identity: Identity = Depends(get_current_identity), db: Session = Depends(get_db)
+) -> models.User:
+    """The full users row, for endpoints that need more than get_current_identity.
+    Unknown and banned users are already rejected from the identity cache."""
+    user = db.get(models.User, identity.id)
+    if user is None or not user.is_active:
+        # Deleted or banned by another worker while the identity was cached
+        identity_cache.invalidate(identity.id)
+        if user is None:
+            raise HTTPException(status_code=401, detail="User not found")
         raise HTTPException(status_code=403, detail="User is inactive")
     return user
 
 
-def require_admin(user: models.User = Depends(get_current_user_from_header)):
+def require_admin(user: Identity = Depends(get_current_identity)):
     if user.role != "admin":
         logger.warning(f"Unauthorized admin access attempt by {user.username}")
         raise HTTPException(status_code=403, detail="Admin privileges required")
     return user
 
 
-def require_moderator_or_admin(
-    user: models.User = Depends(get_current_user_from_header),
-):
+def require_moderator_or_admin(user: Identity = Depends(get_current_identity)):
     if user.role not in ["admin", "moderator"]:
         raise HTTPException(
             status_code=403, detail="Moderator or Admin privileges required"
         )
     return user
+
+
+# --- Dependency: Settings ---
+
+
+def get_settings_snapshot(db: Session = Depends(get_db)) -> SettingsSnapshot:
+    """Typed settings for the current request, each key loaded at most once."""
+    return SettingsSnapshot(db)
@@ -4,19 +4,28 @@ import shutil
 import urllib.error
 import urllib.request
 from datetime import datetime, timedelta
-from typing import List
+from typing import List, Optional
 
 from app.api.dependencies import require_admin, require_moderator_or_admin
 from app.core.config import CURRENT_VERSION
 # Local modules
 from app.core.database import get_db
-from app.core.security import hash_password
+from app.core.security import hash_password, hashing_executor
 from app.db import models, schemas
+from app.services.identity_cache import Identity, identity_cache
+from app.services.message_crypto import (PRUNE_GRACE_SECONDS,
+                                         get_reencryption_status, keyring,
+                                         reencryption_job)
+from app.services.message_search import (SEARCH_SETTING, clear_search_index,
+                                         get_backfill_status,
+                                         is_search_enabled, search_backfill)
+from app.services.metrics import metrics
 from app.services.utils import (get_setting, save_setting,
                                 send_account_deactivated_notification)
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +35,7 @@ router = APIRouter(prefix="/admin")
 # --- Dynamic Roles Endpoint ---
 @router.get("/roles")
 def get_system_roles(
-    db: Session = Depends(get_db), current_admin: models.User = Depends(require_admin)
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
 ):
     """Returns a list of all available system roles with translation keys."""
     return [
@@ -40,18 +49,39 @@ def get_system_roles(
 
 @router.get("/users", response_model=List[schemas.UserDisplay])
 def admin_get_users(
-    db: Session = Depends(get_db), current_admin: models.User = Depends(require_admin)
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
 ):
     logger.info(f"Admin {current_admin.username} fetched users.")
-    return db.query(models.User).order_by(models.User.id).all()
+    return (
+        db.query(models.User)
+        .options(*models.USER_DISPLAY)
+        .order_by(models.User.id)
+        .all()
+    )
 
 
 @router.put("/users/{user_id}")
-def admin_update_user(
+async def admin_update_user(
     user_id: int,
     update: schemas.UserAdminUpdate,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
+):
+    # bcrypt runs on the hashing pool, the DB work in the threadpool
+    hashed_password = None
+    if update.password:
+        hashed_password = await hashing_executor.run(hash_password, update.password)
+    return await run_in_threadpool(
+        _apply_admin_update, user_id, update, hashed_password, db, current_admin
+    )
+
+
+def _apply_admin_update(
+    user_id: int,
+    update: schemas.UserAdminUpdate,
+    hashed_password: Optional[str],
+    db: Session,
+    current_admin: Identity,
 ):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
@@ -64,8 +94,8 @@ def admin_update_user(
         user.username = update.username
     if update.email and update.email != user.email:
         user.email = update.email
-    if update.password:
-        user.hashed_password = hash_password(update.password)
+    if hashed_password:
+        user.hashed_password = hashed_password
     if update.is_verified is not None:
         user.is_verified = update.is_verified
     if update.is_visible_in_matches is not None:
@@ -78,15 +108,28 @@ def admin_update_user(
         user.role = update.role
 
     db.commit()
+    identity_cache.invalidate(user_id)
     logger.info(f"Admin {current_admin.username} updated user {user_id}.")
     return {"status": "success"}
 
 
 @router.post("/users")
-def admin_create_user(
+async def admin_create_user(
     new_user: schemas.UserCreateAdmin,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
+):
+    hashed_password = await hashing_executor.run(hash_password, new_user.password)
+    return await run_in_threadpool(
+        _create_admin_user, new_user, hashed_password, db, current_admin
+    )
+
+
+def _create_admin_user(
+    new_user: schemas.UserCreateAdmin,
+    hashed_password: str,
+    db: Session,
+    current_admin: Identity,
 ):
     if db.query(models.User).filter(models.User.email == new_user.email).first():
         raise HTTPException(400, "Email already exists")
@@ -96,7 +139,7 @@ def admin_create_user(
     user = models.User(
         email=new_user.email,
         username=new_user.username,
-        hashed_password=hash_password(new_user.password),
+        hashed_password=hashed_password,
         role=new_user.role,
         is_active=True,
         is_verified=True,
@@ -116,7 +159,7 @@ def admin_punish_user(
     action: schemas.AdminPunishAction,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
 ):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
@@ -164,6 +207,7 @@ def admin_punish_user(
         user.is_verified = True
 
     db.commit()
+    identity_cache.invalidate(user_id)
 
     # Send deactivation notification email
     if send_deactivation_email and action.action != "delete":
@@ -178,7 +222,7 @@ def admin_punish_user(
 def admin_reset_2fa(
     user_id: int,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
 ):
     """Reset 2FA for a specific user (Admin only)."""
     user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -187,8 +231,7 @@ def admin_reset_2fa(
 
     user.two_factor_method = "none"
     user.totp_secret = None
-    user.webauthn_credentials = "[]"
-    user.webauthn_challenge = None
+    user.passkeys.clear()
 
     logger.info(
         f"Admin {current_admin.username} reset 2FA for User {user.username} (ID: {user.id})"
@@ -200,7 +243,7 @@ def admin_reset_2fa(
 
 @router.get("/settings", response_model=schemas.SystemSettings)
 def get_admin_settings(
-    db: Session = Depends(get_db), current_admin: models.User = Depends(require_admin)
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
 ):
     # Fetch Settings
     mail_conf = get_setting(db, "mail", schemas.MailConfig().dict())
@@ -211,6 +254,13 @@ def get_admin_settings(
     support_page_conf = get_setting(
         db, "support_page", schemas.SupportPageConfig().dict()
     )
+    websocket_conf = get_setting(db, "websocket", schemas.WebSocketConfig().dict())
+    archive_conf = get_setting(
+        db, "message_archive", schemas.MessageArchiveConfig().dict()
+    )
+    api_rate_limit_conf = get_setting(
+        db, "api_rate_limit", schemas.ApiRateLimitConfig().dict()
+    )
     reg_notify_conf = get_setting(
         db, "registration_notification", schemas.RegistrationNotificationConfig().dict()
     )
@@ -242,6 +292,9 @@ def get_admin_settings(
         "oauth": oauth_conf,
         "support_chat": support_conf,
         "support_page": support_page_conf,
+        "websocket": websocket_conf,
+        "message_archive": archive_conf,
+        "api_rate_limit": api_rate_limit_conf,
         "registration_notification": reg_notify_conf,
         "captcha": captcha_conf,
         "assetlinks": assetlinks,
@@ -254,7 +307,7 @@ def get_admin_settings(
 def update_admin_settings(
     settings: schemas.SystemSettings,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
 ):
     # Save Mail, Registration, Legal (Direct save)
     save_setting(db, "mail", settings.mail.dict())
@@ -262,6 +315,9 @@ def update_admin_settings(
     save_setting(db, "legal", settings.legal.dict())
     save_setting(db, "support_chat", settings.support_chat.dict())
     save_setting(db, "support_page", settings.support_page.dict())
+    save_setting(db, "websocket", settings.websocket.dict())
+    save_setting(db, "message_archive", settings.message_archive.dict())
+    save_setting(db, "api_rate_limit", settings.api_rate_limit.dict())
     save_setting(
         db, "registration_notification", settings.registration_notification.dict()
     )
@@ -299,7 +355,7 @@ class TestMailRequest(BaseModel):
 def send_test_mail(
     req: TestMailRequest,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
 ):
     from app.services.utils import create_html_email, send_mail_sync
 
@@ -318,7 +374,7 @@ def send_test_mail(
 
 @router.get("/diagnostics", response_model=schemas.SystemDiagnostics)
 def get_diagnostics(
-    db: Session = Depends(get_db), current_admin: models.User = Depends(require_admin)
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
 ):
     total, used, free = shutil.disk_usage(".")
 
@@ -428,11 +484,17 @@ def get_diagnostics(
     }
 
 
+@router.get("/metrics")
+def get_metrics(current_admin: Identity = Depends(require_admin)):
+    """Latency percentiles and counters of this worker (hashing, CAPTCHA, ...)."""
+    return metrics.snapshot()
+
+
 @router.post("/update/trigger")
 def trigger_update(
     version: str,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
 ):
     """
     Triggers the update process.
@@ -465,7 +527,7 @@ def trigger_update(
 
 @router.get("/changelog", response_model=List[schemas.ChangelogRelease])
 def get_changelog(
-    db: Session = Depends(get_db), current_admin: models.User = Depends(require_admin)
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
 ):
     try:
         url = "https://api.github.com/repos/FaserF/Solumati/releases"
@@ -490,10 +552,132 @@ def get_changelog(
     return []
 
 
+# --- Chat Encryption Keys ---
+def _chat_key_status(db: Session) -> dict:
+    return {
+        "primary_key": keyring.primary_fingerprint,
+        "keys": keyring.fingerprints,
+        "reencryption": get_reencryption_status(db),
+    }
+
+
+@router.get("/chat-keys", response_model=schemas.ChatKeyStatus)
+def get_chat_keys(
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
+):
+    """Returns key fingerprints and the progress of the re-encryption job."""
+    return _chat_key_status(db)
+
+
+@router.post("/chat-keys/rotate", response_model=schemas.ChatKeyStatus)
+def rotate_chat_key(
+    reencrypt: bool = True,
+    db: Session = Depends(get_db),
+    current_admin: Identity = Depends(require_admin),
+):
+    """Adds a new primary key. Existing messages stay readable with the old keys."""
+    if reencryption_job.is_running:
+        raise HTTPException(409, "Re-encryption is running. Pause it before rotating.")
+
+    fingerprint = keyring.rotate()
+    logger.info(f"Admin {current_admin.username} rotated chat key to {fingerprint}")
+    if reencrypt:
+        reencryption_job.start(restart=True)
+    return _chat_key_status(db)
+
+
+@router.post("/chat-keys/reencrypt", response_model=schemas.ChatKeyStatus)
+def start_chat_reencryption(
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
+):
+    """Starts or resumes re-encrypting stored messages with the primary key."""
+    if not reencryption_job.start():
+        raise HTTPException(409, "Re-encryption is already running.")
+    logger.info(f"Admin {current_admin.username} started chat re-encryption")
+    return _chat_key_status(db)
+
+
+@router.post("/chat-keys/reencrypt/pause", response_model=schemas.ChatKeyStatus)
+def pause_chat_reencryption(
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
+):
+    reencryption_job.pause()
+    return _chat_key_status(db)
+
+
+@router.post("/chat-keys/prune", response_model=schemas.ChatKeyStatus)
+def prune_chat_keys(
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
+):
+    """Removes retired keys once all messages were re-encrypted with the primary key."""
+    progress = get_reencryption_status(db)
+    if (
+        progress["status"] != "completed"
+        or progress["target_key"] != keyring.primary_fingerprint
+        or progress["failed"]
+    ):
+        raise HTTPException(
+            409, "Old keys are still needed. Run a complete re-encryption first."
+        )
+
+    # Workers that had not reloaded the key file yet may have written new
+    # messages with a retired key; wait until all of them use the new one
+    finished_at = datetime.fromisoformat(progress["finished_at"])
+    if datetime.utcnow() - finished_at < timedelta(seconds=PRUNE_GRACE_SECONDS):
+        raise HTTPException(
+            409, "Re-encryption finished just now. Retry in a few seconds."
+        )
+    if reencryption_job.is_running:
+        raise HTTPException(409, "Re-encryption is running.")
+    if reencryption_job.reencrypt_remaining(db)["failed"]:
+        raise HTTPException(
+            409, "Some new messages could not be re-encrypted. Old keys are kept."
+        )
+
+    removed = keyring.prune()
+    logger.info(f"Admin {current_admin.username} pruned {removed} retired chat keys")
+    return _chat_key_status(db)
+
+
+def _chat_search_status(db: Session) -> dict:
+    return {"enabled": is_search_enabled(db), "backfill": get_backfill_status(db)}
+
+
+@router.get("/chat-search", response_model=schemas.ChatSearchStatus)
+def get_chat_search_status(
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
+):
+    return _chat_search_status(db)
+
+
+@router.post("/chat-search/enable", response_model=schemas.ChatSearchStatus)
+def enable_chat_search(
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
+):
+    """Enables the search index. New messages are indexed on insert, old ones by a backfill."""
+    save_setting(db, SEARCH_SETTING, {"enabled": True})
+    if get_backfill_status(db)["status"] != "completed":
+        search_backfill.start()
+    logger.info(f"Admin {current_admin.username} enabled chat search")
+    return _chat_search_status(db)
+
+
+@router.post("/chat-search/disable", response_model=schemas.ChatSearchStatus)
+def disable_chat_search(
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
+):
+    """Disables search and drops the index."""
+    save_setting(db, SEARCH_SETTING, {"enabled": False})
+    search_backfill.pause(wait=10)
+    removed = clear_search_index(db)
+    logger.info(f"Admin {current_admin.username} disabled chat search ({removed} index rows removed)")
+    return _chat_search_status(db)
+
+
 @router.get("/reports", response_model=List[schemas.ReportDisplay])
 def get_reports(
     db: Session = Depends(get_db),
-    current_mod: models.User = Depends(require_moderator_or_admin),
+    current_mod: Identity = Depends(require_moderator_or_admin),
 ):
     reports = db.query(models.Report).all()
     res = []
@@ -528,7 +712,7 @@ def get_reports(
 def get_email_logs(
     limit: int = 100,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
 ):
     try:
         logs = (
@@ -547,7 +731,7 @@ def get_email_logs(
 def get_server_logs(
     lines: int = 200,
     level: str = "INFO",
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
 ):
     """
     Reads the last N lines from the server log file (if configured).
@@ -1,23 +1,29 @@
 import base64
 import json
 import logging
+import os
 import random
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # 2FA Libraries
 import pyotp
-from app.api.dependencies import get_current_user_from_header
+from app.api.dependencies import (get_current_user_from_header,
+                                  get_settings_snapshot)
 from app.core.config import PROJECT_NAME
 # Local modules
 from app.core.database import get_db
-from app.core.security import verify_password
+from app.core.security import (hash_password, hashing_executor, needs_rehash,
+                               verify_password)
 from app.db import models, schemas
-from app.services.captcha import verify_captcha_sync
+from app.services.captcha import verify_captcha_async
+from app.services.ephemeral_store import ephemeral_store
+from app.services.identity_cache import identity_cache
 from app.services.rate_limiter import rate_limiter
-from app.services.utils import get_setting, send_mail_sync
+from app.services.utils import SettingsSnapshot, send_mail_sync
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy import or_
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from webauthn import (base64url_to_bytes, generate_authentication_options,
                       generate_registration_options, options_to_json,
                       verify_authentication_response,
@@ -26,25 +32,39 @@ from webauthn.helpers.structs import (AuthenticatorAttachment,
                                       AuthenticatorSelectionCriteria,
                                       PublicKeyCredentialDescriptor,
                                       RegistrationCredential,
+                                      ResidentKeyRequirement,
                                       UserVerificationRequirement)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Lifetimes of ceremony state in the ephemeral store
+EMAIL_2FA_CODE_TTL_SECONDS = 600
+PASSKEY_CHALLENGE_TTL_SECONDS = float(os.getenv("PASSKEY_CHALLENGE_TTL_SECONDS", "300"))
+
+
+def _email_2fa_key(user_id: int) -> str:
+    return f"email_2fa:{user_id}"
+
+
+def _passkey_challenge_key(kind: str, value) -> str:
+    # kind: "register"/"auth" (value = user ID) or "discoverable" (value = challenge)
+    return f"webauthn:{kind}:{value}"
+
+
 # --- 2FA Helpers ---
 
 
-def generate_email_2fa_code(user: models.User, db: Session):
+def generate_email_2fa_code(
+    user: models.User, db: Session, settings: SettingsSnapshot = None
+):
     code = str(random.randint(100000, 999999))
-    user.email_2fa_code = code
-    user.email_2fa_expires = datetime.utcnow() + timedelta(minutes=10)
-    db.commit()
+    ephemeral_store.set(_email_2fa_key(user.id), code, EMAIL_2FA_CODE_TTL_SECONDS)
 
     # Send Mail
-    reg_config = schemas.RegistrationConfig(
-        **get_setting(db, "registration", schemas.RegistrationConfig())
-    )
+    settings = settings or SettingsSnapshot(db)
+    reg_config = settings.registration
 
     # Determine User Language
     # Default to 'en' if not set
@@ -89,9 +109,10 @@ def generate_email_2fa_code(user: models.User, db: Session):
         action_text=None,
         server_domain=server_url,
         db=db,
+        settings=settings,
     )
 
-    send_mail_sync(user.email, subject, html, db)
+    send_mail_sync(user.email, subject, html, db, settings)
     logger.info(f"Sent Email 2FA code to {user.email}")
 
 
@@ -100,19 +121,66 @@ from fastapi import BackgroundTasks
 
 
 @router.post("/login", response_model=schemas.TwoFactorLoginResponse)
-def login(
+async def login(
     creds: schemas.UserLogin,
     request: Request,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
+    settings: SettingsSnapshot = Depends(get_settings_snapshot),
 ):
+    # Async so that CAPTCHA requests and bcrypt are awaited (shared HTTP client,
+    # hashing pool) instead of blocking threadpool workers. DB work runs in the threadpool.
     logger.info(f"Login attempt for: {creds.login}")
 
     # Get client IP
     client_ip = request.client.host if request.client else "unknown"
 
+    captcha_config, captcha_required = await run_in_threadpool(
+        _check_login_rate_limit, creds, client_ip, settings
+    )
+    if captcha_required and not await verify_captcha_async(
+        creds.captcha_token,
+        captcha_config.provider,
+        captcha_config.secret_key,
+        client_ip,
+    ):
+        raise HTTPException(400, "CAPTCHA verification failed")
+
+    # Find user
+    user = await run_in_threadpool(_find_login_user, db, creds.login)
+
+    # Verify credentials (bcrypt runs on the bounded hashing pool)
+    if not user or not await hashing_executor.run(
+        verify_password, creds.password, user.hashed_password
+    ):
+        # Record failed attempt
+        new_count = await run_in_threadpool(rate_limiter.record_failed_attempt, client_ip)
+        raise HTTPException(
+            status_code=401,
+            detail={
+                "message": "Invalid credentials",
+                "attempt_count": new_count,
+                "captcha_required": captcha_config.enabled
+                and new_count >= captcha_config.failed_attempts_threshold,
+            },
+        )
+
+    # Upgrade hashes created with a different bcrypt cost while we have the plaintext
+    new_hash = None
+    if needs_rehash(user.hashed_password):
+        new_hash = await hashing_executor.run(hash_password, creds.password)
+
+    return await run_in_threadpool(
+        _complete_login, user, new_hash, client_ip, request, background_tasks, db, settings
+    )
+
+
+def _check_login_rate_limit(
+    creds: schemas.UserLogin, client_ip: str, settings: SettingsSnapshot
+):
+    """Rejects locked out IPs. Returns (captcha_config, captcha_required)."""
     # Load CAPTCHA config
-    captcha_config = schemas.CaptchaConfig(**get_setting(db, "captcha", {}))
+    captcha_config = settings.captcha
 
     # Check rate limit
     is_blocked, attempt_count, seconds_remaining = rate_limiter.check_rate_limit(
@@ -146,52 +214,46 @@ def login(
                     "attempt_count": attempt_count,
                 },
             )
-        # Verify CAPTCHA
-        if not verify_captcha_sync(
-            creds.captcha_token,
-            captcha_config.provider,
-            captcha_config.secret_key,
-            client_ip,
-        ):
-            raise HTTPException(400, "CAPTCHA verification failed")
+        return captcha_config, True
+    return captcha_config, False
 
-    # Find user
-    user = (
+
+def _find_login_user(db: Session, login: str):
+    return (
         db.query(models.User)
-        .filter(
-            or_(models.User.email == creds.login, models.User.username == creds.login)
-        )
+        .filter(or_(models.User.email == login, models.User.username == login))
         .first()
     )
 
-    # Verify credentials
-    if not user or not verify_password(creds.password, user.hashed_password):
-        # Record failed attempt
-        new_count = rate_limiter.record_failed_attempt(client_ip)
-        raise HTTPException(
-            status_code=401,
-            detail={
-                "message": "Invalid credentials",
-                "attempt_count": new_count,
-                "captcha_required": captcha_config.enabled
-                and new_count >= captcha_config.failed_attempts_threshold,
-            },
-        )
 
+def _complete_login(
+    user: models.User,
+    new_hash,
+    client_ip: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session,
+    settings: SettingsSnapshot,
+):
     # Clear rate limit on successful credentials
     rate_limiter.clear_attempts(client_ip)
 
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+
     # Check Ban Status
     if not user.is_active:
         if user.banned_until and user.banned_until <= datetime.utcnow():
             user.is_active = True
             user.banned_until = None
             db.commit()
+            identity_cache.invalidate(user.id)
         else:
             raise HTTPException(403, "Account deactivated or banned.")
 
     # Check Maintenance Mode (Admins allowed)
-    reg_config = schemas.RegistrationConfig(**get_setting(db, "registration", {}))
+    reg_config = settings.registration
     if reg_config.maintenance_mode and user.role != "admin":
         raise HTTPException(503, "Maintenance Mode Active. Please try again later.")
 
@@ -201,12 +263,8 @@ def login(
         available_methods.append("totp")
 
     # Check for Passkeys
-    try:
-        creds = json.loads(user.webauthn_credentials or "[]")
-        if creds:
-            available_methods.append("passkey")
-    except:
-        pass
+    if user.has_passkeys:
+        available_methods.append("passkey")
 
     # Check Email 2FA (Always available if config enabled, or if user specifically opted in?)
     # Logic: If user opted in OR if they have no other method but global email 2fa is enforced?
@@ -256,7 +314,7 @@ def login(
             # If multiple methods, frontend asks user. If only one, maybe frontend auto-selects.
             # If Current Method is Email, we should probably generate code just in case.
             if user.two_factor_method == "email":
-                generate_email_2fa_code(user, db)
+                generate_email_2fa_code(user, db, settings)
 
             return {
                 "require_2fa": True,
@@ -318,13 +376,12 @@ def verify_2fa_login(req: schemas.TwoFactorAuthRequest, db: Session = Depends(ge
             )
 
     elif user.two_factor_method == "email":
-        if not user.email_2fa_code:
-            raise HTTPException(400, "No code generated")
-        if user.email_2fa_expires and datetime.utcnow() > user.email_2fa_expires:
-            raise HTTPException(400, "Code expired")
-        if req.code == user.email_2fa_code:
+        code = ephemeral_store.get(_email_2fa_key(user.id))
+        if not code:
+            raise HTTPException(400, "No code generated or code expired")
+        # Consume code (pop: a code is accepted only once)
+        if req.code == code and ephemeral_store.pop(_email_2fa_key(user.id)) == code:
             valid = True
-            user.email_2fa_code = None  # Consume code
 
     elif user.two_factor_method == "passkey":
         # Passkey handled via specific endpoint, this is fallback or error
@@ -396,9 +453,10 @@ def verify_totp_setup(
 def setup_email_2fa(
     user: models.User = Depends(get_current_user_from_header),
     db: Session = Depends(get_db),
+    settings: SettingsSnapshot = Depends(get_settings_snapshot),
 ):
     """Enables Email 2FA if allowed globally."""
-    reg_config = schemas.RegistrationConfig(**get_setting(db, "registration", {}))
+    reg_config = settings.registration
     if not reg_config.email_2fa_enabled:
         raise HTTPException(403, "Email 2FA is currently disabled by administrator.")
 
@@ -420,7 +478,7 @@ def disable_2fa(
 ):
     user.two_factor_method = "none"
     user.totp_secret = None
-    user.webauthn_credentials = "[]"
+    user.passkeys.clear()
     db.commit()
     return {"status": "disabled"}
 
@@ -436,7 +494,7 @@ def remove_2fa_method(
     if method == "totp":
         user.totp_secret = None
     elif method == "passkey":
-        user.webauthn_credentials = "[]"
+        user.passkeys.clear()
     elif method == "email":
         # Nothing specific to clear for email, just ensures it's not active
         pass
@@ -467,8 +525,6 @@ def webauthn_register_options(
     db: Session = Depends(get_db),
 ):
     """Generate WebAuthn registration options."""
-    # Retrieve existing credentials to prevent re-registration
-    existing_creds = json.loads(user.webauthn_credentials or "[]")
 
     # Determine RP_ID dynamically from the request headers
     # This fixes the issue where config is homeassistant.local but user accesses via domain
@@ -483,14 +539,18 @@ def webauthn_register_options(
             rp_name=PROJECT_NAME,
             user_id=str(user.id).encode(),
             user_name=str(user.email),  # Ensure string
+            # Prevent re-registration of an existing passkey
             exclude_credentials=[
                 RegistrationCredential(
-                    id=base64url_to_bytes(cred["id"]), transports=cred.get("transports")
+                    id=base64url_to_bytes(passkey.credential_id),
+                    transports=passkey.get_transports(),
                 )
-                for cred in existing_creds
+                for passkey in user.passkeys
             ],
             authenticator_selection=AuthenticatorSelectionCriteria(
                 authenticator_attachment=AuthenticatorAttachment.CROSS_PLATFORM,
+                # Discoverable credentials allow usernameless login
+                resident_key=ResidentKeyRequirement.PREFERRED,
                 user_verification=UserVerificationRequirement.PREFERRED,
             ),
         )
@@ -498,14 +558,11 @@ def webauthn_register_options(
         logger.error(f"WebAuthn generation failed: {e}", exc_info=True)
         raise HTTPException(500, f"Internal Error generating passkey options: {str(e)}")
 
-    import base64
-
-    user.webauthn_challenge = (
-        base64.urlsafe_b64encode(options.challenge).decode("utf-8").rstrip("=")
-        if isinstance(options.challenge, bytes)
-        else options.challenge
+    ephemeral_store.set(
+        _passkey_challenge_key("register", user.id),
+        _b64url(options.challenge),
+        PASSKEY_CHALLENGE_TTL_SECONDS,
     )
-    db.commit()
 
     return json.loads(options_to_json(options))
 
@@ -518,7 +575,8 @@ def webauthn_register_verify(
     db: Session = Depends(get_db),
 ):
     """Verify WebAuthn registration response."""
-    if not user.webauthn_challenge:
+    challenge = ephemeral_store.pop(_passkey_challenge_key("register", user.id))
+    if not challenge:
         raise HTTPException(400, "No registration challenge found")
 
     try:
@@ -563,40 +621,24 @@ def webauthn_register_verify(
 
         verification = verify_registration_response(
             credential=req.credential,
-            expected_challenge=base64url_to_bytes(user.webauthn_challenge),
+            expected_challenge=base64url_to_bytes(challenge),
             expected_origin=origin_header,  # Trusting the header provided we checked RP ID consistency logic above implicitly
             expected_rp_id=rp_id,
             require_user_verification=False,  # Simplifying for dev
         )
 
-        # Save Credential
-        existing_creds = json.loads(user.webauthn_credentials or "[]")
-
-        # Convert credential to dict safe for JSON
-        # Need to base64url encode bytes
-        def b64_encode(b):
-            return base64.urlsafe_b64encode(b).decode("utf-8").rstrip("=")
-
-        new_cred = {
-            "id": b64_encode(verification.credential_id),
-            "public_key": b64_encode(verification.credential_public_key),
-            "sign_count": verification.sign_count,
-            "transports": req.credential.get("response", {}).get("transports", []),
-        }
-
-        new_cred["id"] = (
-            base64.urlsafe_b64encode(verification.credential_id).decode().rstrip("=")
-        )
-        new_cred["public_key"] = (
-            base64.urlsafe_b64encode(verification.credential_public_key)
-            .decode()
-            .rstrip("=")
+        # Save Credential (base64url encoded, like the IDs sent by browsers)
+        user.passkeys.append(
+            models.WebAuthnCredential(
+                credential_id=_b64url(verification.credential_id),
+                public_key=_b64url(verification.credential_public_key),
+                sign_count=verification.sign_count,
+                transports=json.dumps(
+                    req.credential.get("response", {}).get("transports", [])
+                ),
+            )
         )
-
-        existing_creds.append(new_cred)
-        user.webauthn_credentials = json.dumps(existing_creds)
         user.two_factor_method = "passkey"
-        user.webauthn_challenge = None
         db.commit()
         return {"status": "verified", "method": "passkey"}
 
@@ -608,12 +650,42 @@ def webauthn_register_verify(
 # --- WebAuthn Authentication ---
 
 
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("utf-8").rstrip("=")
+
+
+def _client_challenge(credential: dict):
+    """The challenge the authenticator signed, from the assertion's clientDataJSON."""
+    try:
+        client_data = base64url_to_bytes(credential["response"]["clientDataJSON"])
+        return json.loads(client_data).get("challenge")
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 @router.post("/auth/2fa/webauthn/options")
 def webauthn_auth_options(body: dict, request: Request, db: Session = Depends(get_db)):
-    """Get auth options for a user (Login Step 1)."""
+    """
+    Get auth options (Login Step 1). Without user_id/username the options
+    allow any discoverable passkey of this site (usernameless login).
+    """
     user_id = body.get("user_id")
     username = body.get("username")
 
+    # Dynamic RP ID
+    rp_id = request.url.hostname or "localhost"
+
+    if not user_id and not username:
+        options = generate_authentication_options(
+            rp_id=rp_id, user_verification=UserVerificationRequirement.REQUIRED
+        )
+        ephemeral_store.set(
+            _passkey_challenge_key("discoverable", _b64url(options.challenge)),
+            True,
+            PASSKEY_CHALLENGE_TTL_SECONDS,
+        )
+        return {"options": json.loads(options_to_json(options)), "user_id": None}
+
     user = None
     if user_id:
         user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -629,21 +701,16 @@ def webauthn_auth_options(body: dict, request: Request, db: Session = Depends(ge
     if not user:
         raise HTTPException(404, "User not found")
 
-    existing_creds = json.loads(user.webauthn_credentials or "[]")
-
     # If no credentials, cannot do passkey login
-    if not existing_creds:
+    if not user.passkeys:
         raise HTTPException(400, "No passkeys registered for this user.")
 
-    # Dynamic RP ID
-    rp_id = request.url.hostname or "localhost"
-
     try:
         options = generate_authentication_options(
             rp_id=rp_id,
             allow_credentials=[
-                PublicKeyCredentialDescriptor(id=base64url_to_bytes(cred["id"]))
-                for cred in existing_creds
+                PublicKeyCredentialDescriptor(id=base64url_to_bytes(passkey.credential_id))
+                for passkey in user.passkeys
             ],
         )
     except Exception as e:
@@ -651,14 +718,11 @@ def webauthn_auth_options(body: dict, request: Request, db: Session = Depends(ge
         # Check if it is a padding error, maybe credential ID is corrupted?
         raise HTTPException(500, f"Internal Error generating auth options: {str(e)}")
 
-    import base64
-
-    user.webauthn_challenge = (
-        base64.urlsafe_b64encode(options.challenge).decode("utf-8").rstrip("=")
-        if isinstance(options.challenge, bytes)
-        else options.challenge
+    ephemeral_store.set(
+        _passkey_challenge_key("auth", user.id),
+        _b64url(options.challenge),
+        PASSKEY_CHALLENGE_TTL_SECONDS,
     )
-    db.commit()
 
     return {"options": json.loads(options_to_json(options)), "user_id": user.id}
 
@@ -667,23 +731,35 @@ def webauthn_auth_options(body: dict, request: Request, db: Session = Depends(ge
 def webauthn_auth_verify(
     req: schemas.WebAuthnAuthResponse, request: Request, db: Session = Depends(get_db)
 ):
-    """Verify Passkey Assertion (Login Step 2)."""
-    user = db.query(models.User).filter(models.User.id == req.user_id).first()
-    if not user or not user.webauthn_challenge:
-        raise HTTPException(400, "Invalid challenge state")
-
-    try:
-        existing_creds = json.loads(user.webauthn_credentials or "[]")
-
-        # Find the credential used
-        cred_id_input = req.credential.get("id")
-        credential_data = next(
-            (c for c in existing_creds if c["id"] == cred_id_input), None
-        )
+    """Verify Passkey Assertion (Login Step 2). Without user_id: usernameless login."""
+    # Indexed lookup of the credential used
+    passkey = (
+        db.query(models.WebAuthnCredential)
+        .filter(models.WebAuthnCredential.credential_id == req.credential.get("id"))
+        .first()
+    )
 
-        if not credential_data:
+    if req.user_id is not None:
+        user = db.query(models.User).filter(models.User.id == req.user_id).first()
+        expected_challenge = ephemeral_store.pop(_passkey_challenge_key("auth", req.user_id))
+        if not user or not expected_challenge:
+            raise HTTPException(400, "Invalid challenge state")
+        if not passkey or passkey.user_id != user.id:
+            raise HTTPException(400, "Credential not known")
+    else:
+        expected_challenge = _client_challenge(req.credential)
+        if not expected_challenge or not ephemeral_store.pop(
+            _passkey_challenge_key("discoverable", expected_challenge)
+        ):
+            raise HTTPException(400, "Invalid challenge state")
+        if not passkey:
             raise HTTPException(400, "Credential not known")
+        user = passkey.user
+        # Passkey is the only factor here
+        if not user.is_active:
+            raise HTTPException(403, "Account deactivated or banned.")
 
+    try:
         # Dynamic RP ID & Origin
         rp_id = request.url.hostname or "localhost"
         origin_header = request.headers.get("origin")
@@ -692,19 +768,17 @@ def webauthn_auth_verify(
 
         verification = verify_authentication_response(
             credential=req.credential,
-            expected_challenge=base64url_to_bytes(user.webauthn_challenge),
+            expected_challenge=base64url_to_bytes(expected_challenge),
             expected_origin=origin_header,
             expected_rp_id=rp_id,
-            credential_public_key=base64.urlsafe_b64decode(
-                credential_data["public_key"] + "=="
-            ),
-            credential_current_sign_count=credential_data["sign_count"],
+            credential_public_key=base64url_to_bytes(passkey.public_key),
+            credential_current_sign_count=passkey.sign_count,
+            require_user_verification=req.user_id is None,
         )
 
-        # Update sign count
-        credential_data["sign_count"] = verification.new_sign_count
-        user.webauthn_credentials = json.dumps(existing_creds)
-        user.webauthn_challenge = None
+        # Update sign count in place
+        passkey.sign_count = verification.new_sign_count
+        passkey.last_used_at = datetime.utcnow()
         user.last_login = datetime.utcnow()
         db.commit()
 
@@ -725,7 +799,11 @@ def webauthn_auth_verify(
 
 
 @router.post("/auth/2fa/send-email-code")
-def send_email_2fa_code_endpoint(body: dict, db: Session = Depends(get_db)):
+def send_email_2fa_code_endpoint(
+    body: dict,
+    db: Session = Depends(get_db),
+    settings: SettingsSnapshot = Depends(get_settings_snapshot),
+):
     """Triggers sending of an Email 2FA code during login verification."""
     user_id = body.get("user_id")
     user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -733,12 +811,11 @@ def send_email_2fa_code_endpoint(body: dict, db: Session = Depends(get_db)):
         raise HTTPException(404, "User not found")
 
     # Check if Email 2FA is allowed
-    reg_config = schemas.RegistrationConfig(**get_setting(db, "registration", {}))
-    if not reg_config.email_2fa_enabled:
+    if not settings.registration.email_2fa_enabled:
         raise HTTPException(403, "Email 2FA disabled")
 
     try:
-        generate_email_2fa_code(user, db)
+        generate_email_2fa_code(user, db, settings)
     except Exception as e:
         logger.error(f"Failed to send 2FA email: {e}")
         # Return 500 but handled?
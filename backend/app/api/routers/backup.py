@@ -1,3 +1,4 @@
+import base64
 import json
 import logging
 from datetime import datetime
@@ -5,8 +6,10 @@ from datetime import datetime
 from app.api.dependencies import require_admin
 # Local modules
 from app.core.database import Base, get_db
-from app.db import models, schemas
-from app.services.utils import save_setting
+from app.db import models
+from app.scripts.init_data import migrate_webauthn_credentials
+from app.services.identity_cache import Identity, identity_cache
+from app.services.utils import invalidate_settings, save_setting
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
 from fastapi.responses import Response
 from sqlalchemy import text
@@ -26,6 +29,9 @@ def serialize_model(instance):
         val = getattr(instance, column.name)
         if isinstance(val, datetime):
             data[column.name] = val.isoformat()
+        elif isinstance(val, bytes):
+            # Binary columns (e.g. message_archives.payload) as base64 text
+            data[column.name] = base64.b64encode(val).decode("ascii")
         else:
             data[column.name] = val
     return data
@@ -44,7 +50,7 @@ def get_model_class(tablename):
 
 @router.get("/settings/export")
 def export_settings(
-    db: Session = Depends(get_db), current_admin: models.User = Depends(require_admin)
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
 ):
     """Exports all system settings as JSON."""
     settings = db.query(models.SystemSetting).all()
@@ -70,7 +76,7 @@ def export_settings(
 async def import_settings(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
 ):
     """Imports system settings from JSON."""
     try:
@@ -111,7 +117,7 @@ async def import_settings(
 
 @router.get("/database/export")
 def export_database(
-    db: Session = Depends(get_db), current_admin: models.User = Depends(require_admin)
+    db: Session = Depends(get_db), current_admin: Identity = Depends(require_admin)
 ):
     """
     Exports ALL database tables to a JSON structure.
@@ -155,7 +161,7 @@ def export_database(
 async def import_database(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(require_admin),
+    current_admin: Identity = Depends(require_admin),
 ):
     """
     Imports a full database backup.
@@ -222,9 +228,9 @@ async def import_database(
                 for row_data in rows:
                     # Fix DateTime strings back to objects
                     for col in model.__table__.columns:
-                        if isinstance(
-                            col.type, (schemas.DateTime, models.DateTime)
-                        ) and row_data.get(col.name):
+                        if isinstance(col.type, models.DateTime) and row_data.get(
+                            col.name
+                        ):
                             # Basic ISO parsing
                             try:
                                 row_data[col.name] = datetime.fromisoformat(
@@ -232,11 +238,19 @@ async def import_database(
                                 )
                             except:
                                 pass  # Keep as string if fail? SQLAlchemy might handle it.
+                        elif isinstance(col.type, models.LargeBinary) and isinstance(
+                            row_data.get(col.name), str
+                        ):
+                            row_data[col.name] = base64.b64decode(row_data[col.name])
 
                     obj = model(**row_data)
                     db.add(obj)
 
             db.commit()
+            # Restored settings (and version row) bypassed save_setting
+            invalidate_settings(db)
+            # Restored users may differ in role/ban state from the cached ones
+            identity_cache.clear()
 
             # Fix sequences in Postgres (Important for ID auto-increment)
             if is_postgres:
@@ -257,6 +271,9 @@ async def import_database(
             elif is_postgres:
                 db.execute(text("SET session_replication_role = 'origin';"))
 
+        # Backups from older versions still carry passkeys in users.webauthn_credentials
+        migrate_webauthn_credentials(db)
+
         logger.info(f"Admin {current_admin.username} restored database from backup.")
         return {"status": "success", "message": "Database restored successfully."}
 
@@ -1,51 +1,48 @@
 import json
-import os
+import logging
 import secrets
+import time
+from dataclasses import dataclass
 from datetime import datetime
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from app.api.dependencies import \
-    get_current_user_from_header  # We might need a query param version for WS
+from app.api.dependencies import (  # We might need a query param version for WS
+    get_current_identity, require_moderator_or_admin)
 from app.core.database import get_db
-from app.db import models
-from cryptography.fernet import Fernet
-from fastapi import (APIRouter, Depends, WebSocket,
+from app.db import models, schemas
+from app.services.identity_cache import Identity
+from app.services.message_archive import (find_archived_messages,
+                                          iter_archived_messages,
+                                          latest_archived_conversations,
+                                          load_archived_messages)
+from app.services.message_crypto import keyring
+from app.services.message_search import (SEARCH_SETTING, index_message,
+                                         is_search_enabled, search_message_ids)
+from app.services.presence import presence_tracker
+from app.services.rate_limiter import TokenBucket
+from app.services.support_mail import (DEFAULT_DIGEST_WINDOW_SECONDS,
+                                       support_mail_forwarder)
+from app.services.utils import get_setting, get_settings_version
+from fastapi import (APIRouter, Depends, HTTPException, Query, WebSocket,
                      WebSocketDisconnect)
+from fastapi.responses import StreamingResponse
 from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
 
-# --- ENCRYPTION SETUP ---
-# In a real app, this MUST be in environment variables.
-# We will generate/load a key. For MVP persistence, we will use a hardcoded fallback or load from file.
-# To keep it simple and consistent across restarts (unless file is deleted), we try to load/create a key file.
-KEY_FILE = "secret.key"
-
-
-def load_key():
-    if os.path.exists(KEY_FILE):
-        with open(KEY_FILE, "rb") as key_file:
-            return key_file.read()
-    else:
-        key = Fernet.generate_key()
-        with open(KEY_FILE, "wb") as key_file:
-            key_file.write(key)
-        return key
+logger = logging.getLogger(__name__)
 
-
-try:
-    cipher_suite = Fernet(load_key())
-except:
-    # Fallback if something fails (e.g. read permissions), though dangerous for data loss if it changes
-    cipher_suite = Fernet(Fernet.generate_key())
+# --- ENCRYPTION SETUP ---
+# Keys live in a keyring file (newest first), see services/message_crypto.py.
+# New messages always use the newest key, older keys remain readable.
 
 
 def encrypt_message(message: str) -> str:
-    return cipher_suite.encrypt(message.encode()).decode()
+    return keyring.encrypt(message)
 
 
 def decrypt_message(encrypted_message: str) -> str:
     try:
-        return cipher_suite.decrypt(encrypted_message.encode()).decode()
+        return keyring.decrypt(encrypted_message)
     except:
         return "[Decryption Error]"
 
@@ -53,7 +50,7 @@ def decrypt_message(encrypted_message: str) -> str:
 router = APIRouter()
 
 
-from app.services.websocket_manager import manager
+from app.services.websocket_manager import decode_frame, manager
 
 
 # --- WS DEPENDENCY HELPER ---
@@ -73,96 +70,271 @@ def get_current_user_ws(token: str, db: Session):
         return None
 
 
+# --- PER-CONNECTION PERMISSION CACHE ---
+RECEIVER_CACHE_TTL = 30  # Seconds a cached receiver decision stays valid
+
+
+@dataclass
+class ReceiverDecision:
+    exists: bool
+    role: Optional[str] = None
+    is_guest: bool = False
+    error: Optional[str] = None  # Set if the sender may not write to this receiver
+
+
+def check_chat_permission(
+    user: models.User, receiver_id: int, receiver_role: str, support_conf: dict
+) -> Optional[str]:
+    """Returns an error message if `user` may not message the receiver."""
+    # 0. Support Chat Logic (ID 3)
+    if receiver_id == 3 and user.id != 3:  # user.id == 3 is Support replying to user
+        if not support_conf.get("enabled", False) and user.role != "admin":
+            return "Support chat is currently read-only."
+
+    # 1. Guest Restriction (Guest -> Can only chat with 'test' users)
+    # UPDATED: Allow Guest -> Support (3) as well
+    if user.is_guest:
+        if receiver_role not in ("test", "admin") and receiver_id != 3:
+            return "Guests can only chat with Test users."
+
+    # 2. Test User Restriction (Test -> Test only)
+    # UPDATED: Allow Test -> Support (3) as well
+    if user.role == "test":
+        if receiver_role not in ("test", "admin") and receiver_id != 3:
+            return "Test users can only chat with other Test users."
+
+    return None
+
+
+class ConnectionPermissionCache:
+    """
+    Caches receiver role/is_guest and permission decisions for one WS connection,
+    so a fast chatter does not cost extra queries per message.
+    Entries expire after a short TTL and are dropped whenever settings change.
+    """
+
+    def __init__(self, user: models.User, ttl: int = RECEIVER_CACHE_TTL):
+        self.user = user
+        self.ttl = ttl
+        self._entries: Dict[Any, Tuple[float, Any]] = {}
+        self._settings_version = get_settings_version()
+
+    def _get(self, key):
+        # Subscribe to settings invalidation via the global settings version
+        version = get_settings_version()
+        if version != self._settings_version:
+            self._entries.clear()
+            self._settings_version = version
+            return None
+
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def _set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def support_config(self, db: Session) -> dict:
+        conf = self._get("support_chat")
+        if conf is None:
+            conf = self._set(
+                "support_chat",
+                get_setting(db, "support_chat", {"enabled": False, "email_target": ""}),
+            )
+        return conf
+
+    def search_enabled(self, db: Session) -> bool:
+        enabled = self._get(SEARCH_SETTING)
+        if enabled is None:
+            enabled = self._set(SEARCH_SETTING, is_search_enabled(db))
+        return enabled
+
+    def resolve(self, db: Session, receiver_id: int) -> ReceiverDecision:
+        decision = self._get(receiver_id)
+        if decision is not None:
+            return decision
+
+        receiver = (
+            db.query(models.User.id, models.User.role, models.User.is_guest)
+            .filter(models.User.id == receiver_id)
+            .first()
+        )
+        if not receiver:
+            return self._set(receiver_id, ReceiverDecision(exists=False))
+
+        support_conf = self.support_config(db) if receiver_id == 3 else {}
+        error = check_chat_permission(self.user, receiver_id, receiver.role, support_conf)
+        return self._set(
+            receiver_id,
+            ReceiverDecision(
+                exists=True, role=receiver.role, is_guest=bool(receiver.is_guest), error=error
+            ),
+        )
+
+
+# --- RECONNECT SYNC ---
+SYNC_BATCH_SIZE = 200
+
+
+def serialize_message(m: models.Message) -> dict:
+    return {
+        "id": m.id,
+        "sender_id": m.sender_id,
+        "receiver_id": m.receiver_id,
+        "content": decrypt_message(m.content),
+        "timestamp": m.timestamp.isoformat() if m.timestamp else None,
+        "is_read": m.is_read,
+        "is_transient": False,
+    }
+
+
+async def send_missed_messages(
+    websocket: WebSocket, db: Session, user_id: int, last_seen_message_id: int
+):
+    """
+    Streams all messages received after `last_seen_message_id` (across all
+    conversations) in batches. Uses the (receiver_id, id) index, so the cost
+    depends on the number of missed messages, not on the history size.
+    """
+    cursor = last_seen_message_id
+    while True:
+        batch = (
+            db.query(models.Message)
+            .filter(
+                models.Message.receiver_id == user_id,
+                models.Message.id > cursor,
+            )
+            .order_by(models.Message.id.asc())
+            .limit(SYNC_BATCH_SIZE)
+            .all()
+        )
+        if not batch:
+            break
+
+        cursor = batch[-1].id
+        has_more = len(batch) == SYNC_BATCH_SIZE
+        await manager.send(
+            websocket,
+            {
+                "type": "sync",
+                "messages": [serialize_message(m) for m in batch],
+                "has_more": has_more,
+            },
+        )
+        if not has_more:
+            break
+
+    await manager.send(websocket, {"type": "sync_complete", "last_message_id": cursor})
+
+
+def consume_message_budget(*buckets: TokenBucket) -> float:
+    """
+    Takes one token from every bucket if all have one. Otherwise nothing is
+    consumed and the seconds until the message would be allowed are returned.
+    """
+    wait = max(bucket.retry_after() for bucket in buckets)
+    if wait:
+        return wait
+    for bucket in buckets:
+        bucket.consume()
+    return 0.0
+
+
 @router.websocket("/ws/chat")
 async def websocket_endpoint(
-    websocket: WebSocket, token: str, db: Session = Depends(get_db)
+    websocket: WebSocket,
+    token: str,
+    last_seen_message_id: Optional[int] = None,
+    db: Session = Depends(get_db),
 ):
     user = get_current_user_ws(token, db)
     if not user:
         await websocket.close(code=4003)
         return
 
-    await manager.connect(websocket, user.id)
+    ws_conf = schemas.WebSocketConfig(
+        **get_setting(db, "websocket", schemas.WebSocketConfig().dict())
+    )
+    await manager.connect(websocket, user.id, max_connections=ws_conf.max_connections_per_user)
+    permissions = ConnectionPermissionCache(user)
+    connection_bucket = TokenBucket(
+        rate=ws_conf.messages_per_second_per_connection,
+        capacity=ws_conf.message_burst_per_connection,
+    )
     try:
+        # Reconnecting clients only receive what they missed
+        if last_seen_message_id is not None:
+            await send_missed_messages(websocket, db, user.id, last_seen_message_id)
+
         while True:
-            data = await websocket.receive_text()
-            # Expecting JSON: { "receiver_id": 123, "content": "Hello" }
+            # Return the pooled DB connection while idle; otherwise every open
+            # socket pins one and the pool size caps concurrent chat users.
+            # `user` stays usable detached (its columns are already loaded).
+            db.close()
+            data = await manager.receive(websocket)
+            # Expecting { "receiver_id": 123, "content": "Hello" } as JSON text
+            # or MessagePack binary frame (negotiated subprotocol)
             try:
-                msg_data = json.loads(data)
+                msg_data = decode_frame(data)
+
+                # Heartbeat frames only refresh liveness (done in manager.receive)
+                frame_type = msg_data.get("type")
+                if frame_type == "pong":
+                    continue
+                if frame_type == "ping":
+                    await manager.send(websocket, {"type": "pong"})
+                    continue
+
+                # --- RATE LIMIT ---
+                # Checked before any DB work, per connection and per user
+                user_bucket = manager.user_bucket(
+                    user.id,
+                    ws_conf.messages_per_second_per_user,
+                    ws_conf.message_burst_per_user,
+                )
+                retry_after = consume_message_budget(connection_bucket, user_bucket)
+                if retry_after:
+                    await manager.send(
+                        websocket,
+                        {
+                            "type": "rate_limited",
+                            "error": "You are sending messages too fast.",
+                            "retry_after": round(retry_after, 2),
+                        },
+                    )
+                    continue
+
                 receiver_id = int(msg_data["receiver_id"])
                 content = msg_data["content"]
 
                 # --- PERMISSION CHECK ---
-                receiver = (
-                    db.query(models.User).filter(models.User.id == receiver_id).first()
-                )
-                if not receiver:
+                # Receiver facts and decisions are cached per connection
+                receiver = permissions.resolve(db, receiver_id)
+                if not receiver.exists:
                     continue  # Or send error
 
-                # 0. Support Chat Logic (ID 3)
-                if receiver_id == 3:
-                    # Check Settings
-                    from app.services.utils import get_setting
-
-                    support_conf = get_setting(
-                        db, "support_chat", {"enabled": False, "email_target": ""}
-                    )
-                    support_enabled = support_conf.get("enabled", False)
-                    user_is_support = user.id == 3  # Support replying to user
-
-                    if not user_is_support:
-                        if not support_enabled and user.role != "admin":
-                            err = {"error": "Support chat is currently read-only."}
-                            await manager.send_personal_message(err, user.id)
-                            continue
-
-                        # Email Forwarding - BLOCKED FOR GUESTS
-                        # Guests can chat (sandbox) but we do not forward to email to prevent spam.
-                        if not user.is_guest:
-                            support_email = support_conf.get("email_target", "")
-                            if support_email:
-                                from app.services.utils import (
-                                    create_html_email, send_mail_sync)
-
-                                try:
-                                    subject = f"Support Request: {user.username}"
-                                    html_body = create_html_email(
-                                        title=f"New Message from {user.username}",
-                                        content=f"<p><b>User:</b> {user.username} (ID: {user.id})</p><p><b>Message:</b><br>{content}</p>",
-                                    )
-                                    # Send sync (might block slightly but acceptable for MVP support chat)
-                                    send_mail_sync(
-                                        support_email, subject, html_body, db
-                                    )
-                                except Exception as exc:
-                                    print(f"Error forwarding support email: {exc}")
-
-                # 1. Guest Restriction (Guest -> Can only chat with 'test' users)
-                if user.is_guest:
-                    # UPDATED: Allow Guest -> Support (3) as well
-                    if (
-                        receiver.role != "test"
-                        and receiver.role != "admin"
-                        and receiver.id != 3
-                    ):
-                        # Block
-                        err = {"error": "Guests can only chat with Test users."}
-                        await manager.send_personal_message(err, user.id)
-                        continue
-
-                # 2. Test User Restriction (Test -> Test only)
-                if user.role == "test":
-                    # UPDATED: Allow Test -> Support (3) as well
-                    if (
-                        receiver.role != "test"
-                        and receiver.role != "admin"
-                        and receiver.id != 3
-                    ):
-                        err = {
-                            "error": "Test users can only chat with other Test users."
-                        }
-                        await manager.send_personal_message(err, user.id)
-                        continue
+                if receiver.error:
+                    await manager.send_personal_message({"error": receiver.error}, user.id)
+                    continue
+
+                # Support Chat (ID 3): Email Forwarding - BLOCKED FOR GUESTS
+                # Guests can chat (sandbox) but we do not forward to email to prevent spam.
+                # Queued and coalesced into one digest per user and window (non-blocking).
+                if receiver_id == 3 and user.id != 3 and not user.is_guest:
+                    support_conf = permissions.support_config(db)
+                    support_email = support_conf.get("email_target", "")
+                    if support_email:
+                        support_mail_forwarder.enqueue(
+                            user.id,
+                            user.username,
+                            content,
+                            support_email,
+                            support_conf.get(
+                                "digest_window_seconds", DEFAULT_DIGEST_WINDOW_SECONDS
+                            ),
+                        )
 
                 # 3. Encrypt
                 encrypted_content = encrypt_message(content)
@@ -195,9 +367,11 @@ async def websocket_endpoint(
                         is_read=False,
                     )
                     db.add(new_msg)
-                    db.commit()
-                    db.refresh(new_msg)
+                    db.flush()  # Assigns the ID without a refresh query
                     new_msg_id = new_msg.id
+                    if permissions.search_enabled(db):
+                        index_message(db, new_msg_id, user.id, receiver_id, content)
+                    db.commit()
                 else:
                     # Fake ID for transient message (negative to indicate not saved?)
                     # Or just random number?
@@ -224,13 +398,165 @@ async def websocket_endpoint(
                 print(f"WS Error: {e}")
                 pass
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Also runs if the socket was reaped or the loop died unexpectedly
         manager.disconnect(websocket, user.id)
 
 
+def conversation_filter(user_a: int, user_b: int):
+    """Messages exchanged between two users (both directions)."""
+    return or_(
+        and_(models.Message.sender_id == user_a, models.Message.receiver_id == user_b),
+        and_(models.Message.sender_id == user_b, models.Message.receiver_id == user_a),
+    )
+
+
+# --- STREAMING HISTORY (NDJSON) ---
+HISTORY_STREAM_BATCH_SIZE = 500
+
+
+def stream_history_ndjson(
+    user_a: int, user_b: int, mark_read_for: Optional[int] = None
+) -> Iterator[str]:
+    """
+    Yields the conversation oldest first, one decrypted JSON message per line.
+    Archived months are unpacked one at a time, hot rows are fetched through
+    a server-side cursor in batches (yield_per), so memory stays constant
+    regardless of the history size. Uses its own
+    session because the response body is produced after the request scope.
+    If `mark_read_for` is set, that user's received messages are marked as
+    read with a single UPDATE once everything was sent.
+    """
+    from app.core.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        # Cold archive first (bounded per conversation and month), then hot rows
+        for m in iter_archived_messages(db, user_a, user_b):
+            yield json.dumps(
+                dict(
+                    m,
+                    content=decrypt_message(m["content"]),
+                    timestamp=m["timestamp"].isoformat() if m["timestamp"] else None,
+                )
+            ) + "\n"
+
+        rows = (
+            db.query(
+                models.Message.id,
+                models.Message.sender_id,
+                models.Message.receiver_id,
+                models.Message.content,
+                models.Message.timestamp,
+                models.Message.is_read,
+            )
+            .filter(conversation_filter(user_a, user_b))
+            .order_by(models.Message.id.asc())
+            .yield_per(HISTORY_STREAM_BATCH_SIZE)
+        )
+        last_id = None
+        for row in rows:
+            last_id = row.id
+            yield json.dumps(
+                {
+                    "id": row.id,
+                    "sender_id": row.sender_id,
+                    "receiver_id": row.receiver_id,
+                    "content": decrypt_message(row.content),
+                    "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+                    "is_read": row.is_read,
+                }
+            ) + "\n"
+
+        if mark_read_for is not None and last_id is not None:
+            partner_id = user_b if mark_read_for == user_a else user_a
+            db.query(models.Message).filter(
+                models.Message.receiver_id == mark_read_for,
+                models.Message.sender_id == partner_id,
+                models.Message.is_read == False,
+                models.Message.id <= last_id,
+            ).update({"is_read": True}, synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+
+
+@router.get("/chat/history/{other_user_id}/stream")
+def stream_chat_history(
+    other_user_id: int,
+    current_user: Identity = Depends(get_current_identity),
+):
+    """Full chat history as NDJSON stream (constant server memory)."""
+    return StreamingResponse(
+        stream_history_ndjson(current_user.id, other_user_id, mark_read_for=current_user.id),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.get("/chat/moderation/history/{user_a}/{user_b}/stream")
+def stream_conversation_for_moderation(
+    user_a: int,
+    user_b: int,
+    current_user: Identity = Depends(require_moderator_or_admin),
+):
+    """Read-only NDJSON export of any conversation for moderation (does not mark as read)."""
+    logger.info(
+        f"Moderator {current_user.username} exported conversation {user_a} <-> {user_b}"
+    )
+    return StreamingResponse(
+        stream_history_ndjson(user_a, user_b), media_type="application/x-ndjson"
+    )
+
+
+@router.get("/chat/search", response_model=List[schemas.ChatSearchResult])
+def search_chat_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(50, ge=1, le=200),
+    current_user: Identity = Depends(get_current_identity),
+    db: Session = Depends(get_db),
+):
+    """Searches the user's messages via the blind index (all words must match)."""
+    if not is_search_enabled(db):
+        raise HTTPException(status_code=403, detail="Chat search is disabled")
+
+    ids = search_message_ids(db, current_user.id, q, limit)
+    if not ids:
+        return []
+
+    messages = [
+        row._asdict()
+        for row in db.query(
+            models.Message.id,
+            models.Message.sender_id,
+            models.Message.receiver_id,
+            models.Message.content,
+            models.Message.timestamp,
+        ).filter(models.Message.id.in_(ids))
+    ]
+    # The other hits were moved to the archive (their index rows are kept)
+    hot_ids = {m["id"] for m in messages}
+    messages += find_archived_messages(
+        db, current_user.id, [i for i in ids if i not in hot_ids]
+    )
+    messages.sort(key=lambda m: m["id"], reverse=True)
+    return [
+        {
+            "id": m["id"],
+            "sender_id": m["sender_id"],
+            "receiver_id": m["receiver_id"],
+            "partner_id": m["receiver_id"] if m["sender_id"] == current_user.id else m["sender_id"],
+            "content": decrypt_message(m["content"]),
+            "timestamp": m["timestamp"],
+        }
+        for m in messages
+    ]
+
+
 @router.get("/chat/history/{other_user_id}", response_model=List[dict])
 def get_chat_history(
     other_user_id: int,
-    current_user: models.User = Depends(get_current_user_from_header),
+    current_user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     """Retrieve chat history with a specific user."""
@@ -239,24 +565,16 @@ def get_chat_history(
 
     messages = (
         db.query(models.Message)
-        .filter(
-            or_(
-                and_(
-                    models.Message.sender_id == current_user.id,
-                    models.Message.receiver_id == other_user_id,
-                ),
-                and_(
-                    models.Message.sender_id == other_user_id,
-                    models.Message.receiver_id == current_user.id,
-                ),
-            )
-        )
+        .filter(conversation_filter(current_user.id, other_user_id))
         .order_by(models.Message.timestamp.asc())
         .all()
     )
 
-    # Decrypt
-    results = []
+    # Decrypt (archived messages first, they are older than everything hot)
+    results = [
+        dict(m, content=decrypt_message(m["content"]))
+        for m in load_archived_messages(db, current_user.id, other_user_id)
+    ]
     for m in messages:
         decrypted = decrypt_message(m.content)
 
@@ -282,7 +600,7 @@ def get_chat_history(
 
 @router.get("/chat/conversations", response_model=List[dict])
 def get_conversations(
-    current_user: models.User = Depends(get_current_user_from_header),
+    current_user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     """
@@ -313,12 +631,28 @@ def get_conversations(
             # Need to fetch partner details if not already known?
             # We can fetch them in bulk later or one by one.
             # For MVP, let's just store the msg and ID, then fetch Users.
-            conversations[partner_id] = {"message": m, "unread_count": 0}
+            conversations[partner_id] = {
+                "content": m.content,
+                "timestamp": m.timestamp,
+                "unread_count": 0,
+            }
 
         # Count unread
         if m.receiver_id == current_user.id and not m.is_read:
             conversations[partner_id]["unread_count"] += 1
 
+    # Conversations whose messages were all archived (older than any hot message).
+    # Only read messages are archived, so these have nothing unread.
+    archived = latest_archived_conversations(db, current_user.id, exclude=conversations)
+    for pid, message in sorted(
+        archived.items(), key=lambda item: item[1]["timestamp"], reverse=True
+    ):
+        conversations[pid] = {
+            "content": message["content"],
+            "timestamp": message["timestamp"],
+            "unread_count": 0,
+        }
+
     # 2. Get User Objects for partners
     partner_ids = list(conversations.keys())
     if not partner_ids:
@@ -340,10 +674,9 @@ def get_conversations(
 
         user = partners_map[pid]
         data = conversations[pid]
-        msg = data["message"]
 
         # specific decryption
-        decrypted_content = decrypt_message(msg.content)
+        decrypted_content = decrypt_message(data["content"])
 
         result.append(
             {
@@ -351,8 +684,10 @@ def get_conversations(
                 "partner_username": user.username,
                 "partner_real_name": user.real_name,
                 "partner_image_url": user.image_url,
+                # From memory and the already loaded row, no extra query
+                "partner_presence": presence_tracker.get_presence(user),
                 "last_message": decrypted_content,
-                "timestamp": msg.timestamp,
+                "timestamp": data["timestamp"],
                 "unread_count": data["unread_count"],
             }
         )
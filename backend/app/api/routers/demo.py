@@ -3,9 +3,9 @@ from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 
-from app.api.dependencies import get_current_user_from_header
-from app.db import models
+from app.api.dependencies import get_current_identity
 from app.services.demo_service import demo_service
+from app.services.identity_cache import Identity
 
 router = APIRouter(prefix="/demo", tags=["demo"])
 
@@ -24,10 +24,10 @@ class DemoError(BaseModel):
 @router.post("/start")
 async def start_demo(
     mode: str = Query(..., pattern="^(local|persistent)$"),
-    current_user: models.User = Depends(get_current_user_from_header)
+    current_user: Identity = Depends(get_current_identity)
 ):
     try:
-        if not current_user.is_superuser and current_user.role != "admin":
+        if current_user.role != "admin":
              raise HTTPException(status_code=403, detail="Only Admins can start Demo Mode")
 
         logger.info(f"Admin {current_user.username} (ID {current_user.id}) attempting to start demo mode: {mode}")
@@ -39,9 +39,9 @@ async def start_demo(
 
 @router.post("/stop")
 async def stop_demo(
-    current_user: models.User = Depends(get_current_user_from_header)
+    current_user: Identity = Depends(get_current_identity)
 ):
-    if not current_user.is_superuser and current_user.role != "admin":
+    if current_user.role != "admin":
          raise HTTPException(status_code=403, detail="Only Admins can stop Demo Mode")
 
     demo_service.stop_demo()
@@ -56,13 +56,13 @@ async def get_demo_status():
 
 @router.get("/errors", response_model=List[DemoError])
 async def get_demo_errors(
-    current_user: models.User = Depends(get_current_user_from_header)
+    current_user: Identity = Depends(get_current_identity)
 ):
     return demo_service.get_errors()
 
 @router.delete("/errors")
 async def clear_errors(
-    current_user: models.User = Depends(get_current_user_from_header)
+    current_user: Identity = Depends(get_current_identity)
 ):
      demo_service.clear_errors()
      return {"status": "cleared"}
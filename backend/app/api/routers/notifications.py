@@ -3,9 +3,10 @@ import logging
 from datetime import datetime
 from typing import List
 
-from app.api.dependencies import get_current_user_from_header
+from app.api.dependencies import get_current_identity
 from app.core.database import get_db
 from app.db import models, schemas
+from app.services.identity_cache import Identity
 from app.services.utils import get_setting
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
@@ -30,7 +31,7 @@ router = APIRouter()
 
 @router.get("/notifications", response_model=List[schemas.NotificationDisplay])
 def get_notifications(
-    user: models.User = Depends(get_current_user_from_header),
+    user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     """Get all notifications for current user."""
@@ -46,7 +47,7 @@ def get_notifications(
 @router.put("/notifications/{notif_id}/read")
 def mark_notification_read(
     notif_id: int,
-    user: models.User = Depends(get_current_user_from_header),
+    user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     notif = (
@@ -65,7 +66,7 @@ def mark_notification_read(
 
 @router.delete("/notifications/clear")
 def clear_all_notifications(
-    user: models.User = Depends(get_current_user_from_header),
+    user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     db.query(models.Notification).filter(
@@ -101,14 +102,15 @@ def get_vapid_public_key(db: Session = Depends(get_db)):
 @router.post("/notifications/subscribe")
 def subscribe_push(
     sub: schemas.PushSubscription,
-    user: models.User = Depends(get_current_user_from_header),
+    user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     """Save the Web Push Subscription for the user."""
-    # We store it in user.push_subscription AND user.app_settings
-    # Actually models.User has 'push_subscription' column now (implied from earlier view, wait, I saw it in models.py view? Yes, line 95)
-
-    user.push_subscription = json.dumps(sub.dict())
+    # Single-column update; the users row is not loaded
+    db.query(models.User).filter(models.User.id == user.id).update(
+        {models.User.push_subscription: json.dumps(sub.dict())},
+        synchronize_session=False,
+    )
     db.commit()
     return {"status": "subscribed"}
 
@@ -3,11 +3,12 @@ import secrets
 from datetime import datetime
 from typing import List, Optional
 
-from app.api.dependencies import get_current_user_from_header
+from app.api.dependencies import get_current_identity
 from app.core.config import APP_BASE_URL
 from app.core.database import get_db
-from app.core.security import hash_password
+from app.core.security import hash_password, hashing_executor
 from app.db import models, schemas
+from app.services.identity_cache import Identity
 from app.services.utils import get_setting
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import RedirectResponse
@@ -159,7 +160,7 @@ async def process_oauth_login(
 
     # Custom Password Generation
     raw_pw = generate_oauth_password()
-    hashed_pw = hash_password(raw_pw)
+    hashed_pw = await hashing_executor.run(hash_password, raw_pw)
 
     user = models.User(
         email=email,
@@ -189,17 +190,21 @@ async def process_oauth_login(
 
 @router.get("/connections", response_model=List[schemas.LinkedAccountDisplay])
 def get_connections(
-    user: models.User = Depends(get_current_user_from_header),
+    user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     """List all Oauth connections for the current user."""
-    return user.linked_accounts
+    return (
+        db.query(models.LinkedAccount)
+        .filter(models.LinkedAccount.user_id == user.id)
+        .all()
+    )
 
 
 @router.delete("/connections/{provider}")
 def delete_connection(
     provider: str,
-    user: models.User = Depends(get_current_user_from_header),
+    user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     """Unlink a provider."""
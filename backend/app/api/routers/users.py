@@ -3,31 +3,36 @@ import logging
 import secrets
 import shutil
 import random
-from datetime import datetime, timedelta
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
 from fastapi import (APIRouter, BackgroundTasks, Depends, File, HTTPException,
                      Request, UploadFile)
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.api.dependencies import get_current_user_from_header
+from app.api.dependencies import (get_current_identity,
+                                  get_current_user_from_header, get_settings_snapshot)
 from app.core.config import PROJECT_NAME
 from app.core.database import get_db
-from app.core.security import hash_password
+from app.core.security import hash_password, hashing_executor
 from app.db import models, schemas
 
 # Services
 from app.services.user_service import user_service
 from app.services.match_service import match_service
 from app.services.email_service import email_service
+from app.services.identity_cache import Identity
+from app.services.ephemeral_store import ephemeral_store
 # LegacyUtils (to be deprecated/moved)
-from app.services.utils import (get_setting, is_profile_complete,
+from app.services.utils import (SettingsSnapshot, is_profile_complete,
                                 send_email_changed_notification,
                                 send_password_changed_notification,
                                 send_registration_notification)
-from app.services.captcha import verify_captcha_sync
-from app.services.password_validation import check_pwned_password, validate_password_complexity
+from app.services.captcha import verify_captcha_async
+from app.services.password_validation import (check_pwned_password_async,
+                                              validate_password_complexity)
 from app.services.export_service import collect_user_data, create_export_archive
 from app.services.i18n import get_translations
 from app.services.questions_content import QUESTIONS_SKELETON
@@ -38,41 +43,65 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.post("/users/", response_model=schemas.UserDisplay)
-def create_user(
+async def create_user(
     user_in: schemas.UserCreate,
     background_tasks: BackgroundTasks,
     request: Request,
     db: Session = Depends(get_db),
+    settings: SettingsSnapshot = Depends(get_settings_snapshot),
 ):
+    # Async so the CAPTCHA and breach lookups await the network without holding
+    # a worker thread; the settings/DB parts run in the threadpool.
     logger.info(f"Attempting to register new user: {user_in.email}")
-    reg_config = schemas.RegistrationConfig(**get_setting(db, "registration", schemas.RegistrationConfig()))
-
-    if not reg_config.enabled:
-        raise HTTPException(403, "Registration disabled.")
+    captcha_config = await run_in_threadpool(_check_registration_allowed, user_in, settings)
 
     # CAPTCHA verification
-    captcha_config = schemas.CaptchaConfig(**get_setting(db, "captcha", {}))
     if captcha_config.enabled:
-        if not user_in.captcha_token:
-            raise HTTPException(428, {"message": "CAPTCHA required", "captcha_required": True})
-
         client_ip = request.client.host if request.client else "unknown"
-        if not verify_captcha_sync(user_in.captcha_token, captcha_config.provider, captcha_config.secret_key, client_ip):
+        if not await verify_captcha_async(user_in.captcha_token, captcha_config.provider, captcha_config.secret_key, client_ip):
             raise HTTPException(400, "CAPTCHA verification failed")
 
     # Password Check
     try:
         validate_password_complexity(user_in.password)
-        check_pwned_password(user_in.password)
+        await check_pwned_password_async(user_in.password)
     except ValueError as e:
         raise HTTPException(400, str(e))
 
+    # bcrypt runs on the hashing pool, not on a threadpool worker
+    hashed_password = await hashing_executor.run(hash_password, user_in.password)
+    return await run_in_threadpool(
+        _register_user, user_in, hashed_password, background_tasks, db, settings
+    )
+
+
+def _check_registration_allowed(user_in: schemas.UserCreate, settings: SettingsSnapshot):
+    """Returns the CAPTCHA config to verify against."""
+    reg_config = settings.registration
+
+    if not reg_config.enabled:
+        raise HTTPException(403, "Registration disabled.")
+
+    captcha_config = settings.captcha
+    if captcha_config.enabled and not user_in.captcha_token:
+        raise HTTPException(428, {"message": "CAPTCHA required", "captcha_required": True})
+    return captcha_config
+
+
+def _register_user(
+    user_in: schemas.UserCreate,
+    hashed_password: str,
+    background_tasks: BackgroundTasks,
+    db: Session,
+    settings: SettingsSnapshot,
+):
+    reg_config = settings.registration
     if user_service.get_by_email(db, user_in.email):
         raise HTTPException(400, "Email already registered.")
 
     # Create User
     is_verified = not reg_config.require_verification
-    new_user = user_service.create_user(db, user_in, is_verified)
+    new_user = user_service.create_user(db, user_in, hashed_password, is_verified)
 
     logger.info(f"User created: ID {new_user.id}, Username {new_user.username}")
 
@@ -87,8 +116,8 @@ def create_user(
         content = t.get("email.verify.content", "Welcome to Solumati! Please verify your email address.")
         btn_text = t.get("email.verify.btn", "Verify Email")
 
-        html = email_service.create_html_email(title, content, link, btn_text, server_url, db)
-        background_tasks.add_task(email_service.send_mail_sync, new_user.email, subject, html, db)
+        html = email_service.create_html_email(title, content, link, btn_text, server_url, db, settings)
+        background_tasks.add_task(email_service.send_mail_sync, new_user.email, subject, html, db, settings)
 
     # Admin Notification
     background_tasks.add_task(send_registration_notification, new_user)
@@ -132,7 +161,7 @@ def get_questions(lang: str = "en"):
 
 @router.get("/users/discover", response_model=List[schemas.UserDisplay])
 def discover_users(
-    user: models.User = Depends(get_current_user_from_header),
+    user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     is_privileged = (user.id == 0 or user.role in ("admin", "moderator"))
@@ -248,7 +277,7 @@ def get_matches(user_id: int, db: Session = Depends(get_db)):
 @router.get("/users/{user_id}/public", response_model=schemas.UserPublicDisplay)
 def get_user_public_profile(
     user_id: int,
-    current_user: models.User = Depends(get_current_user_from_header),
+    current_user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     user = user_service.get(db, user_id)
@@ -274,7 +303,7 @@ def get_user_public_profile(
 def report_user(
     user_id: int,
     report: schemas.ReportCreate,
-    reporter: models.User = Depends(get_current_user_from_header),
+    reporter: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     reported_user = user_service.get(db, user_id)
@@ -334,18 +363,41 @@ def upload_image(
     return {"image_url": user.image_url}
 
 @router.put("/users/{user_id}/account")
-def update_account_settings(
+async def update_account_settings(
     user_id: int,
     update: schemas.UserAdminUpdate,
     background_tasks: BackgroundTasks,
     user: models.User = Depends(get_current_user_from_header),
     db: Session = Depends(get_db),
 ):
+    # Async so the breach lookup awaits the shared HTTP client and bcrypt runs
+    # on the hashing pool; the DB part runs in the threadpool.
     if user.id != user_id:
         raise HTTPException(403, "Forbidden")
     if user.role == "test":
         raise HTTPException(403, "Test users cannot change sensitive account settings.")
 
+    hashed_password = None
+    if update.password:
+        try:
+            validate_password_complexity(update.password)
+            await check_pwned_password_async(update.password)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        hashed_password = await hashing_executor.run(hash_password, update.password)
+
+    return await run_in_threadpool(
+        _apply_account_update, user, update, hashed_password, background_tasks, db
+    )
+
+
+def _apply_account_update(
+    user: models.User,
+    update: schemas.UserAdminUpdate,
+    hashed_password: Optional[str],
+    background_tasks: BackgroundTasks,
+    db: Session,
+):
     old_email = user.email
     email_changed = False
     password_changed = False
@@ -357,13 +409,8 @@ def update_account_settings(
         user.is_verified = False
         email_changed = True
 
-    if update.password:
-        try:
-            validate_password_complexity(update.password)
-            check_pwned_password(update.password)
-        except ValueError as e:
-            raise HTTPException(400, str(e))
-        user.hashed_password = hash_password(update.password)
+    if hashed_password:
+        user.hashed_password = hashed_password
         password_changed = True
 
     if update.is_visible_in_matches is not None:
@@ -416,7 +463,7 @@ def update_user_preferences(
 @router.delete("/users/{user_id}")
 def delete_own_account(
     user_id: int,
-    user: models.User = Depends(get_current_user_from_header),
+    user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
 ):
     if user.id != user_id:
@@ -429,15 +476,15 @@ async def export_user_data_endpoint(
     user_id: int,
     method: str = "download",
     background_tasks: BackgroundTasks = None,
-    user: models.User = Depends(get_current_user_from_header),
+    user: Identity = Depends(get_current_identity),
     db: Session = Depends(get_db),
+    settings: SettingsSnapshot = Depends(get_settings_snapshot),
 ):
     if user.id != user_id:
         raise HTTPException(403, "Forbidden")
 
     if method == "email":
-        mail_conf = get_setting(db, "mail", {})
-        if not mail_conf.get("enabled"):
+        if not settings.mail.enabled:
             raise HTTPException(400, "Email service is not enabled. Please use download.")
 
     data = collect_user_data(db, user_id)
@@ -470,11 +517,15 @@ async def export_user_data_endpoint(
     raise HTTPException(400, "Invalid method")
 
 # Password Reset endpoints (Keep logic mostly same but clean up)
+PASSWORD_RESET_TTL_SECONDS = 3600
+
+
 @router.post("/auth/password-reset/request")
 def request_password_reset(
     body: dict,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    settings: SettingsSnapshot = Depends(get_settings_snapshot),
 ):
     identifier = body.get("email")
     if not identifier:
@@ -484,12 +535,9 @@ def request_password_reset(
 
     if user and user.role not in ["test", "admin"] and user.email:
         token = secrets.token_urlsafe(32)
-        user.reset_token = token
-        user.reset_token_expires = datetime.utcnow() + timedelta(hours=1)
-        db.commit()
+        ephemeral_store.set(f"password_reset:{token}", user.id, PASSWORD_RESET_TTL_SECONDS)
 
-        reg_config = get_setting(db, "registration", {})
-        server_url = (reg_config.get("server_domain") or "").rstrip("/")
+        server_url = (settings.registration.server_domain or "").rstrip("/")
         link = f"{server_url}?reset_token={token}"
 
         t = get_translations("en") # TODO: User lang
@@ -500,32 +548,40 @@ def request_password_reset(
             link,
             t.get("email.reset.btn", "Reset Password"),
             server_url,
-            db
+            db,
+            settings,
         )
-        background_tasks.add_task(email_service.send_mail_sync, user.email, subject, html, db)
+        background_tasks.add_task(email_service.send_mail_sync, user.email, subject, html, db, settings)
 
     return {"status": "ok", "message": "If account exists, link sent."}
 
 @router.post("/auth/password-reset/confirm")
-def confirm_password_reset(body: dict, db: Session = Depends(get_db)):
+async def confirm_password_reset(body: dict, db: Session = Depends(get_db)):
     token = body.get("token")
     new_password = body.get("new_password")
 
-    user = db.query(models.User).filter(models.User.reset_token == token).first()
-    if not user:
+    key = f"password_reset:{token}"
+    user_id = await run_in_threadpool(ephemeral_store.get, key) if token else None
+    if user_id is None:
         raise HTTPException(400, "Invalid or expired token")
 
-    if not user.reset_token_expires or user.reset_token_expires < datetime.utcnow():
-        raise HTTPException(400, "Token expired")
-
     try:
         validate_password_complexity(new_password)
     except ValueError as e:
         raise HTTPException(400, str(e))
 
-    user.hashed_password = hash_password(new_password)
-    user.reset_token = None
-    user.reset_token_expires = None
+    hashed_password = await hashing_executor.run(hash_password, new_password)
+    return await run_in_threadpool(_reset_password, key, hashed_password, db)
+
+
+def _reset_password(key: str, hashed_password: str, db: Session):
+    # Consume the token; a concurrent confirm with the same token gets None
+    user_id = ephemeral_store.pop(key)
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if user_id is None or not user:
+        raise HTTPException(400, "Invalid or expired token")
+
+    user.hashed_password = hashed_password
     db.commit()
 
     return {"status": "success", "message": "Password updated."}
@@ -60,6 +60,13 @@ class RateLimitError(AppException):
         super().__init__(message, "RATE_LIMITED", status.HTTP_429_TOO_MANY_REQUESTS)
 
 
+class ServiceBusyError(AppException):
+    """Server is saturated; the client should retry after `retry_after` seconds."""
+    def __init__(self, message: str = "Service busy, please retry", retry_after: int = 1):
+        super().__init__(message, "SERVICE_BUSY", status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.retry_after = retry_after
+
+
 def _build_error_response(
     request_id: str,
     code: str,
@@ -95,11 +102,13 @@ def register_exception_handlers(app: FastAPI) -> None:
     async def app_exception_handler(request: Request, exc: AppException):
         request_id = getattr(request.state, "request_id", "unknown")
         logger.warning(f"[{request_id}] {exc.code}: {exc.message}")
+        retry_after = getattr(exc, "retry_after", None)
         return JSONResponse(
             status_code=exc.status_code,
             content=_build_error_response(
                 request_id, exc.code, exc.message, exc.status_code, exc.field
-            )
+            ),
+            headers={"Retry-After": str(retry_after)} if retry_after else None
         )
 
     @app.exception_handler(StarletteHTTPException)
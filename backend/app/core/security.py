@@ -1,15 +1,33 @@
+import asyncio
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
 
 import bcrypt
 
+from app.core.exceptions import ServiceBusyError
+from app.services.metrics import metrics
+
 logger = logging.getLogger(__name__)
 
+# bcrypt cost factor for new hashes. Existing hashes are upgraded on login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Dedicated hashing pool: worker threads and how many calls may wait for one
+PASSWORD_HASH_WORKERS = int(
+    os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "16"))
+
 
 # --- SECURITY HELPER FUNCTIONS ---
-def hash_password(password: str) -> str:
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
     """Hashes a password using bcrypt with a generated salt."""
     pwd_bytes = password.encode("utf-8")
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(pwd_bytes, salt)
     return hashed.decode("utf-8")
 
@@ -25,3 +43,73 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     except Exception as e:
         logger.error(f"Password verification error: {e}")
         return False
+
+
+def needs_rehash(hashed_password: str, rounds: Optional[int] = None) -> bool:
+    """True if a bcrypt hash ($2b$<cost>$...) uses a different cost than configured."""
+    try:
+        cost = int(hashed_password.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return False
+    return cost != (rounds or BCRYPT_ROUNDS)
+
+
+class HashingExecutor:
+    """
+    Bounded thread pool for bcrypt, separate from the shared AnyIO pool that
+    runs sync endpoints, so a login/registration flood cannot starve other
+    requests. Calls beyond `workers + queue_limit` in flight are rejected
+    with ServiceBusyError (503) instead of queueing up.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT,
+    ):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash"
+        )
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _admit(self):
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_limit:
+                metrics.increment("password_hash.rejected")
+                raise ServiceBusyError(
+                    "Too many sign-in requests right now. Please try again shortly."
+                )
+            self._in_flight += 1
+
+    def _call(self, fn: Callable, args: tuple, queued_at: float):
+        started = time.perf_counter()
+        metrics.observe("password_hash.queue_wait", started - queued_at)
+        try:
+            return fn(*args)
+        finally:
+            metrics.observe(f"password_hash.{fn.__name__}", time.perf_counter() - started)
+            with self._lock:
+                self._in_flight -= 1
+
+    async def run(self, fn: Callable, *args):
+        """Run fn on the hashing pool without blocking the event loop."""
+        self._admit()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._call, fn, args, time.perf_counter()
+        )
+
+    def run_sync(self, fn: Callable, *args):
+        """For code without an event loop (scripts, worker threads); endpoints await run()."""
+        self._admit()
+        return self._executor.submit(self._call, fn, args, time.perf_counter()).result()
+
+
+hashing_executor = HashingExecutor()
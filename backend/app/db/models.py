@@ -2,9 +2,10 @@ import json
 from datetime import datetime
 
 from app.core.database import Base
-from sqlalchemy import (Boolean, Column, DateTime, ForeignKey,
-                        Integer, String, Text)
-from sqlalchemy.orm import relationship
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey,
+                        Index, Integer, LargeBinary, String, Text)
+from sqlalchemy.orm import (deferred, load_only, relationship, selectinload,
+                            undefer, undefer_group)
 
 
 class Report(Base):
@@ -35,6 +36,13 @@ class LinkedAccount(Base):
 
 
 class User(Base):
+    """
+    Large text columns are deferred in two groups and only loaded when
+    accessed (one query per group) or requested by a loader profile below:
+    "profile" (about_me, answers) and "private" (app_settings,
+    webauthn_credentials, push_subscription).
+    """
+
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -43,7 +51,7 @@ class User(Base):
 
     real_name = Column(String)
     username = Column(String, unique=True, index=True)
-    about_me = Column(Text, default="Ich bin neu hier!")
+    about_me = deferred(Column(Text, default="Ich bin neu hier!"), group="profile")
     image_url = Column(String, nullable=True)
 
     # Roles: 'user', 'moderator', 'admin'
@@ -55,7 +63,7 @@ class User(Base):
     # Secure verification code (random string), cleared after successful verification
     verification_code = Column(String, nullable=True)
 
-    # Password Reset Token
+    # Password Reset Token (legacy: tokens live in the ephemeral store now)
     reset_token = Column(String, nullable=True)
     reset_token_expires = Column(DateTime, nullable=True)
 
@@ -64,11 +72,13 @@ class User(Base):
 
     intent = Column(String)
     # Stored as JSON string: {"1": 0, "2": 3, ...}
-    answers = Column(Text, default="{}")
+    answers = deferred(Column(Text, default="{}"), group="profile")
 
     is_guest = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_login = Column(DateTime, nullable=True)
+    # Last chat activity, written in batches by services/presence.py
+    last_seen = Column(DateTime, nullable=True)
 
     # Ban system extensions
     deactivation_reason = Column(String, nullable=True)
@@ -83,27 +93,34 @@ class User(Base):
     # TOTP Secret (Base32)
     totp_secret = Column(String, nullable=True)
 
-    # Email 2FA (Temporary code storage)
+    # Email 2FA (legacy: codes live in the ephemeral store now)
     email_2fa_code = Column(String, nullable=True)
     email_2fa_expires = Column(DateTime, nullable=True)
 
-    # WebAuthn / Passkey Credentials (Stored as JSON string)
-    webauthn_credentials = Column(Text, nullable=True, default="[]")
-    # Temporary challenge for WebAuthn ceremonies
+    # Legacy JSON list of passkeys, moved to the webauthn_credentials table on
+    # startup (see init_data.migrate_webauthn_credentials). Always "[]" afterwards.
+    webauthn_credentials = deferred(
+        Column(Text, nullable=True, default="[]"), group="private"
+    )
+    # Legacy: WebAuthn challenges live in the ephemeral store now
     webauthn_challenge = Column(String, nullable=True)
 
     # --- NEW: App Settings & Push ---
     # Stores generic app settings like theme, language pref, etc. as JSON string
-    app_settings = Column(
-        Text, default='{"notifications_enabled": false, "theme": "system"}'
+    app_settings = deferred(
+        Column(Text, default='{"notifications_enabled": false, "theme": "system"}'),
+        group="private",
     )
 
     # Stores the raw Web Push Subscription object (JSON)
-    push_subscription = Column(Text, nullable=True)
+    push_subscription = deferred(Column(Text, nullable=True), group="private")
 
     linked_accounts = relationship(
         "LinkedAccount", back_populates="user", cascade="all, delete-orphan"
     )
+    passkeys = relationship(
+        "WebAuthnCredential", back_populates="user", cascade="all, delete-orphan"
+    )
 
     @property
     def is_admin(self):
@@ -121,11 +138,65 @@ class User(Base):
 
     @property
     def has_passkeys(self):
+        return len(self.passkeys) > 0
+
+
+class WebAuthnCredential(Base):
+    """A registered passkey. Assertions look it up by credential_id, which also
+    identifies the user for usernameless login."""
+
+    __tablename__ = "webauthn_credentials"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    # base64url without padding, as sent by the browser
+    credential_id = Column(String, nullable=False, unique=True, index=True)
+    public_key = Column(String, nullable=False)
+    sign_count = Column(Integer, default=0, nullable=False)
+    # JSON list, e.g. ["internal", "hybrid"]
+    transports = Column(Text, default="[]")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, nullable=True)
+
+    user = relationship("User", back_populates="passkeys")
+
+    def get_transports(self):
         try:
-            creds = json.loads(self.webauthn_credentials or "[]")
-            return len(creds) > 0
-        except:
-            return False
+            return json.loads(self.transports or "[]")
+        except ValueError:
+            return []
+
+
+# --- User Loader Profiles ---
+# Plain User queries (auth, inbox partners) skip the deferred columns. List
+# queries use a profile that loads what their response needs in one SELECT.
+
+# Match cards (MatchService.get_matches_for_user)
+USER_MATCH_CARD = (
+    load_only(
+        User.id,
+        User.username,
+        User.role,
+        User.intent,
+        User.image_url,
+        User.about_me,
+        User.answers,
+    ),
+)
+
+# UserDisplay responses (admin user list, discover)
+USER_DISPLAY = (
+    undefer(User.about_me),
+    undefer(User.app_settings),
+    selectinload(User.passkeys).load_only(
+        WebAuthnCredential.id, WebAuthnCredential.user_id
+    ),
+)
+
+# All columns (exports, backups)
+USER_FULL = (undefer_group("profile"), undefer_group("private"))
 
 
 class Message(Base):
@@ -139,6 +210,57 @@ class Message(Base):
     is_final_contact = Column(Boolean, default=False)
     is_read = Column(Boolean, default=False)
 
+    __table_args__ = (
+        # Reconnect sync: "messages for me newer than X" is a pure index range scan
+        Index("ix_messages_receiver_id_id", "receiver_id", "id"),
+    )
+
+
+class MessageArchive(Base):
+    """
+    Cold storage: all messages of one conversation and month, moved out of the
+    hot messages table by services/message_archive.py. The payload is a
+    zlib-compressed JSON list; message contents stay Fernet-encrypted.
+    """
+
+    __tablename__ = "message_archives"
+
+    id = Column(Integer, primary_key=True)
+    # Conversation as ordered pair (user_low < user_high)
+    user_low = Column(Integer, nullable=False)
+    user_high = Column(Integer, nullable=False)
+    period = Column(String(7), nullable=False)  # YYYY-MM
+    message_count = Column(Integer, default=0)
+    first_message_id = Column(Integer)
+    last_message_id = Column(Integer)
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_message_archives_conversation", "user_low", "user_high", "period", unique=True),
+    )
+
+
+class MessageSearchToken(Base):
+    """
+    Blind index for chat search: keyed HMAC of each word of a message, stored
+    once per participant. Plaintext words never reach the database.
+    message_id is no foreign key: the rows stay when a message moves from
+    messages to message_archives, so archived messages remain searchable.
+    """
+
+    __tablename__ = "message_search_tokens"
+
+    id = Column(Integer, primary_key=True)
+    message_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
+    token_hash = Column(String(32), nullable=False)
+
+    __table_args__ = (
+        # Search: "messages of user X containing token T" is an index lookup
+        Index("ix_message_search_tokens_user_token", "user_id", "token_hash", "message_id"),
+    )
+
 
 class Notification(Base):
     __tablename__ = "notifications"
@@ -159,6 +281,48 @@ class SystemSetting(Base):
     value = Column(Text)
 
 
+class JobProgress(Base):
+    """Cursor/progress of long-running background jobs (JSON). Kept out of
+    system_settings so per-batch writes don't invalidate the settings cache."""
+
+    __tablename__ = "job_progress"
+    key = Column(String, primary_key=True)
+    value = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class EphemeralEntry(Base):
+    """Short-lived auth state shared by all workers (see services/ephemeral_store.py).
+    Value is JSON; expires_at is a unix timestamp."""
+
+    __tablename__ = "ephemeral_entries"
+    key = Column(String, primary_key=True)
+    value = Column(Text, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)
+
+
+class SettingsVersion(Base):
+    """Single row counter, bumped with every settings write.
+    Workers compare it to drop their cached settings (see services/utils.py)."""
+
+    __tablename__ = "settings_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+
+class RateLimitEntry(Base):
+    """Sliding-window counter shared by all workers (see services/rate_limiter.py).
+    Times are unix timestamps; rows past expires_at are deleted in batches."""
+
+    __tablename__ = "rate_limit_entries"
+    key = Column(String, primary_key=True)
+    window_start = Column(Float, nullable=False)
+    current_count = Column(Float, default=0, nullable=False)
+    previous_count = Column(Float, default=0, nullable=False)
+    locked_until = Column(Float, default=0, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)
+
+
 class EmailLog(Base):
     __tablename__ = "email_logs"
 
@@ -2,7 +2,7 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional, Union
 
 from email_validator import EmailNotValidError, validate_email
-from pydantic import BaseModel, EmailStr, field_validator
+from pydantic import BaseModel, EmailStr, Field, field_validator
 
 
 class UserBase(BaseModel):
@@ -212,6 +212,47 @@ class OAuthProviders(BaseModel):
 class SupportChatConfig(BaseModel):
     enabled: bool = False
     email_target: Optional[str] = ""
+    # Support messages of one user within this window are sent as one digest email
+    digest_window_seconds: int = 60
+
+
+class WebSocketConfig(BaseModel):
+    # Server sends {"type": "ping"} frames, clients answer with {"type": "pong"}
+    ping_interval_seconds: int = 25
+    # Connections without any inbound frame for this long are closed
+    idle_timeout_seconds: int = 75
+    # Oldest connection is closed when a user opens more (0 = unlimited)
+    max_connections_per_user: int = 5
+    # Inbound chat messages (token buckets: sustained rate per second + burst).
+    # A zero rate would never refill and block chat for good.
+    messages_per_second_per_connection: float = Field(2.0, gt=0)
+    message_burst_per_connection: int = Field(10, ge=1)
+    messages_per_second_per_user: float = Field(4.0, gt=0)
+    message_burst_per_user: int = Field(20, ge=1)
+
+
+class MessageArchiveConfig(BaseModel):
+    enabled: bool = False
+    # Read messages older than this move to the compressed archive (still
+    # readable and searchable); unread ones stay until they are read
+    hot_days: int = 180
+
+
+class ApiRateLimitConfig(BaseModel):
+    enabled: bool = True
+    window_seconds: int = 60
+    # Cost units allowed per window (0 = unlimited); a request costs 1 by default
+    per_user_limit: int = 300
+    per_ip_limit: int = 600
+    # Path patterns (fnmatch, first match wins) of expensive endpoints -> cost
+    route_costs: Dict[str, int] = {
+        "/users/*/export": 30,
+        "/chat/history/*/stream": 10,
+        "/chat/history/*": 3,
+        "/chat/search": 5,
+        "/matches/*": 5,
+        "/users/discover": 5,
+    }
 
 
 class SupportPageConfig(BaseModel):
@@ -263,6 +304,9 @@ class SystemSettings(BaseModel):
     oauth: OAuthConfig = OAuthConfig()
     support_chat: SupportChatConfig = SupportChatConfig()
     support_page: SupportPageConfig = SupportPageConfig()
+    websocket: WebSocketConfig = WebSocketConfig()
+    message_archive: MessageArchiveConfig = MessageArchiveConfig()
+    api_rate_limit: ApiRateLimitConfig = ApiRateLimitConfig()
     registration_notification: RegistrationNotificationConfig = (
         RegistrationNotificationConfig()
     )
@@ -286,6 +330,52 @@ class SystemDiagnostics(BaseModel):
     api_reachable: bool
 
 
+class ReencryptionProgress(BaseModel):
+    status: str = "idle"  # idle, running, paused, completed, failed
+    target_key: Optional[str] = None
+    phase: str = "messages"  # messages, archives
+    last_id: int = 0
+    archive_last_id: int = 0
+    processed: int = 0
+    archives_processed: int = 0
+    failed: int = 0
+    total: int = 0
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+
+
+class ChatKeyStatus(BaseModel):
+    primary_key: str
+    keys: List[str]
+    reencryption: ReencryptionProgress
+
+
+class SearchBackfillProgress(BaseModel):
+    status: str = "idle"  # idle, running, paused, completed, failed
+    last_id: int = 0
+    processed: int = 0
+    failed: int = 0
+    total: int = 0
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+
+
+class ChatSearchStatus(BaseModel):
+    enabled: bool
+    backfill: SearchBackfillProgress
+
+
+class ChatSearchResult(BaseModel):
+    id: int
+    sender_id: int
+    receiver_id: int
+    partner_id: int
+    content: str
+    timestamp: Optional[datetime] = None
+
+
 class ChangelogRelease(BaseModel):
     tag_name: str
     name: Optional[str]
@@ -342,7 +432,8 @@ class WebAuthnAuthOptions(BaseModel):
 
 class WebAuthnAuthResponse(BaseModel):
     credential: Dict[str, Any]
-    user_id: int
+    # None for usernameless login (user is found via the credential)
+    user_id: Optional[int] = None
 
 
 class ReportCreate(BaseModel):
@@ -9,13 +9,20 @@ from app.core.exceptions import register_exception_handlers
 # Local modules
 from app.core.database import Base, SessionLocal, engine
 from app.core.logging_config import logger
+from app.middleware.maintenance import MaintenanceMiddleware
+from app.middleware.rate_limit import RateLimitMiddleware
 from app.scripts.init_data import (check_emergency_reset, check_schema,
                                    ensure_admin_user, ensure_guest_user,
                                    ensure_showcase_dummies,
                                    ensure_support_user, fix_dummy_user_roles,
-                                   generate_dummy_data)
+                                   generate_dummy_data,
+                                   migrate_webauthn_credentials)
+from app.services.message_crypto import reencryption_job
+from app.services.http_client import close_http_client
+from app.services.message_search import search_backfill
 from app.services.scheduler import start_scheduler
-from app.services.tasks import periodic_cleanup_task
+from app.services.support_mail import support_mail_forwarder
+from app.services.tasks import periodic_cleanup_task, websocket_heartbeat_task
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -26,6 +33,13 @@ app = FastAPI(title=PROJECT_NAME, version=CURRENT_VERSION)
 # --- Register Centralized Exception Handlers ---
 register_exception_handlers(app)
 
+# --- Maintenance Mode Gate ---
+# Added before CORS so that CORS stays outermost and 503 responses carry its headers
+app.add_middleware(MaintenanceMiddleware)
+
+# --- API Rate Limits (per user / per IP, weighted by route cost) ---
+app.add_middleware(RateLimitMiddleware)
+
 # --- CORS Middleware ---
 app.add_middleware(
     CORSMiddleware,
@@ -55,6 +69,7 @@ async def startup_event():
 
         # Check DB Schema
         check_schema(db)
+        migrate_webauthn_credentials(db)
 
         # Initialize Data
         ensure_admin_user(db)
@@ -65,6 +80,10 @@ async def startup_event():
         # Initialize Scheduler
         start_scheduler()
 
+        # Continue a chat key re-encryption interrupted by a restart
+        reencryption_job.resume_if_pending(db)
+        search_backfill.resume_if_pending(db)
+
         # Always ensure showcase dummies are present for guest mode
         await ensure_showcase_dummies(db)
 
@@ -79,6 +98,7 @@ async def startup_event():
 
     # Allow cleaner shutdown of background tasks if any
     app.state.cleanup_task = asyncio.create_task(periodic_cleanup_task())
+    app.state.heartbeat_task = asyncio.create_task(websocket_heartbeat_task())
 
 
 @app.on_event("shutdown")
@@ -86,6 +106,12 @@ async def shutdown_event():
     logger.info("Shutting down...")
     if hasattr(app.state, "cleanup_task"):
         app.state.cleanup_task.cancel()
+    if hasattr(app.state, "heartbeat_task"):
+        app.state.heartbeat_task.cancel()
+
+    # Do not lose support messages still waiting in a digest window
+    await support_mail_forwarder.flush_all()
+    await close_http_client()
 
 
 app.include_router(auth.router)
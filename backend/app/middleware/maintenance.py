@@ -1,66 +1,130 @@
+"""
+Maintenance Middleware
+Pure ASGI gate that answers 503 (HTTP) or closes the handshake (WebSocket)
+while maintenance mode is active. Admins still get through.
+
+The maintenance flag and the set of admin IDs are cached in memory. They are
+refreshed at most every MAINTENANCE_REFRESH_SECONDS, or right after a settings
+change in this worker. Regular requests therefore never open a DB session.
+If the DB cannot be read, the last known state is kept (fail open).
+"""
+import asyncio
 import logging
+import os
+import time
+from typing import FrozenSet, Optional, Tuple
+from urllib.parse import parse_qs
 
-from app.core.database import SessionLocal
-from app.services.utils import get_setting
-from starlette.middleware.base import BaseHTTPMiddleware
+from app.services.utils import get_setting, get_settings_version
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import JSONResponse
+from starlette.websockets import WebSocketClose
 
 logger = logging.getLogger(__name__)
 
+MAINTENANCE_REFRESH_SECONDS = float(os.getenv("MAINTENANCE_REFRESH_SECONDS", "5"))
 
-class MaintenanceMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        # Whitelist paths that should ALWAYS work (static assets, config, login)
-        whitelist = [
-            "/public-config",
-            "/static",
-            "/docs",
-            "/openapi.json",
-            "/login",
-            "/auth",
-        ]
-        if any(request.url.path.startswith(path) for path in whitelist):
-            return await call_next(request)
+# Paths that should ALWAYS work (static assets, config, login)
+WHITELIST = (
+    "/public-config",
+    "/static",
+    "/docs",
+    "/openapi.json",
+    "/login",
+    "/auth",
+)
 
-        try:
-            # We need to check the setting. Using a fresh DB session.
-            db = SessionLocal()
+# WebSocket close code "Try Again Later"
+WS_TRY_AGAIN_LATER = 1013
+
+
+class MaintenanceState:
+    """Cached maintenance flag and admin IDs, shared by all requests of a worker."""
+
+    def __init__(self, refresh_seconds: float = MAINTENANCE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.enabled = False
+        self.admin_ids: FrozenSet[int] = frozenset()
+        self._expires = 0.0
+        self._settings_version: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    def is_stale(self) -> bool:
+        return (
+            time.monotonic() >= self._expires
+            or get_settings_version() != self._settings_version
+        )
+
+    async def refresh_if_stale(self):
+        # Concurrent requests keep using the current state while one refreshes
+        if not self.is_stale() or self._lock.locked():
+            return
+        async with self._lock:
             try:
-                # Check global maintenance mode setting
-                maintenance_mode = get_setting(db, "maintenance_mode", False)
-
-                if maintenance_mode:
-                    # Check for Admin via X-User-ID (Project pattern)
-                    user_id = request.headers.get("X-User-ID")
-                    is_admin = False
-
-                    if user_id:
-                        try:
-                            # Verify user is actually an admin in DB
-                            from app.db.models import User
-
-                            user = (
-                                db.query(User).filter(User.id == int(user_id)).first()
-                            )
-                            if user and user.role == "admin":
-                                is_admin = True
-                        except Exception:
-                            pass
-
-                    if not is_admin:
-                        return JSONResponse(
-                            status_code=503,
-                            content={"detail": "Maintenance Mode Active"},
-                        )
-            finally:
-                db.close()
-
-        except Exception as e:
-            # If DB is down (OperationalError) or other startup issues
-            logger.error(f"Maintenance Middleware DB Error: {e}")
-            return JSONResponse(
-                status_code=503,
-                content={"detail": "Service Unavailable (Database Connection Failed)"},
-            )
-
-        return await call_next(request)
+                self.enabled, self.admin_ids = await run_in_threadpool(self._load)
+            except Exception as e:
+                logger.error(f"Maintenance state refresh failed: {e}")
+            # Read after loading: the load itself may invalidate the settings cache
+            self._settings_version = get_settings_version()
+            self._expires = time.monotonic() + self.refresh_seconds
+
+    @staticmethod
+    def _load() -> Tuple[bool, FrozenSet[int]]:
+        from app.core.database import SessionLocal
+        from app.db import models
+
+        db = SessionLocal()
+        try:
+            enabled = bool(get_setting(db, "maintenance_mode", False))
+            admin_ids: FrozenSet[int] = frozenset()
+            if enabled:
+                admin_ids = frozenset(
+                    row.id
+                    for row in db.query(models.User.id).filter(
+                        models.User.role == "admin", models.User.is_active == True
+                    )
+                )
+            return enabled, admin_ids
+        finally:
+            db.close()
+
+
+maintenance_state = MaintenanceState()
+
+
+def _request_user_id(scope) -> Optional[int]:
+    """User ID from the X-User-ID header (HTTP) or the token query param (WebSocket)."""
+    value = None
+    for name, header_value in scope.get("headers", []):
+        if name == b"x-user-id":
+            value = header_value.decode("latin-1")
+            break
+    if value is None and scope["type"] == "websocket":
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        value = (query.get("token") or [None])[0]
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class MaintenanceMiddleware:
+    def __init__(self, app, state: Optional[MaintenanceState] = None):
+        self.app = app
+        self.state = state or maintenance_state
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or scope["path"].startswith(WHITELIST):
+            await self.app(scope, receive, send)
+            return
+
+        await self.state.refresh_if_stale()
+        if not self.state.enabled or _request_user_id(scope) in self.state.admin_ids:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["type"] == "websocket":
+            await WebSocketClose(code=WS_TRY_AGAIN_LATER)(scope, receive, send)
+            return
+        response = JSONResponse(status_code=503, content={"detail": "Maintenance Mode Active"})
+        await response(scope, receive, send)
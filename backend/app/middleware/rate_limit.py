@@ -0,0 +1,152 @@
+"""
+API Rate Limit Middleware
+Pure ASGI layer that charges every HTTP request against sliding-window
+budgets per user (X-User-ID) and per client IP, using the backends of
+services/rate_limiter.py. Expensive endpoints cost more than one unit
+(route_costs), so a scraping client runs out of budget long before it can
+monopolize the database. Over budget requests get 429 with Retry-After.
+
+Limits come from the "api_rate_limit" system setting. Like the maintenance
+gate, the config is cached and refreshed at most every
+RATE_LIMIT_REFRESH_SECONDS or after a settings change in this worker.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from fnmatch import fnmatchcase
+from typing import List, Optional, Tuple
+
+from app.db import schemas
+from app.middleware.maintenance import _request_user_id
+from app.services.metrics import metrics
+from app.services.rate_limiter import create_backend
+from app.services.utils import get_setting, get_settings_version
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_REFRESH_SECONDS = float(os.getenv("RATE_LIMIT_REFRESH_SECONDS", "5"))
+
+# Never charged (static assets, API docs, config needed to render the login page)
+EXEMPT = (
+    "/static",
+    "/docs",
+    "/openapi.json",
+    "/public-config",
+)
+
+
+class ApiRateLimitState:
+    """Cached api_rate_limit config, shared by all requests of a worker."""
+
+    def __init__(self, refresh_seconds: float = RATE_LIMIT_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.config = schemas.ApiRateLimitConfig()
+        self._costs = self._compile(self.config)
+        self._expires = 0.0
+        self._settings_version: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _compile(config: schemas.ApiRateLimitConfig) -> List[Tuple[str, int]]:
+        return list(config.route_costs.items())
+
+    def cost(self, path: str) -> int:
+        for pattern, cost in self._costs:
+            if fnmatchcase(path, pattern):
+                return cost
+        return 1
+
+    def is_stale(self) -> bool:
+        return (
+            time.monotonic() >= self._expires
+            or get_settings_version() != self._settings_version
+        )
+
+    async def refresh_if_stale(self):
+        if not self.is_stale() or self._lock.locked():
+            return
+        async with self._lock:
+            try:
+                config = await run_in_threadpool(self._load)
+                self.config, self._costs = config, self._compile(config)
+            except Exception as e:
+                logger.error(f"API rate limit config refresh failed: {e}")
+            self._settings_version = get_settings_version()
+            self._expires = time.monotonic() + self.refresh_seconds
+
+    @staticmethod
+    def _load() -> schemas.ApiRateLimitConfig:
+        from app.core.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            return schemas.ApiRateLimitConfig(
+                **get_setting(db, "api_rate_limit", schemas.ApiRateLimitConfig().dict())
+            )
+        finally:
+            db.close()
+
+
+api_rate_limit_state = ApiRateLimitState()
+api_rate_limit_backend = create_backend()
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, state: Optional[ApiRateLimitState] = None, backend=None):
+        self.app = app
+        self.state = state or api_rate_limit_state
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend if self._backend is not None else api_rate_limit_backend
+
+    def _charge(self, budgets: List[Tuple[str, int]], cost: int, window: int) -> bool:
+        """Charge all budgets; True if any of them is exhausted."""
+        exceeded = False
+        for key, limit in budgets:
+            count, _ = self.backend.hit(key, window, cost)
+            if limit and count > limit:
+                exceeded = True
+        return exceeded
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXEMPT):
+            await self.app(scope, receive, send)
+            return
+
+        await self.state.refresh_if_stale()
+        config = self.state.config
+        cost = self.state.cost(scope["path"])
+        if not config.enabled or cost <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        budgets = [(f"api:ip:{client[0] if client else 'unknown'}", config.per_ip_limit)]
+        user_id = _request_user_id(scope)
+        if user_id is not None:
+            budgets.append((f"api:user:{user_id}", config.per_user_limit))
+
+        window = max(config.window_seconds, 1)
+        if self.backend.blocking:
+            exceeded = await run_in_threadpool(self._charge, budgets, cost, window)
+        else:
+            exceeded = self._charge(budgets, cost, window)
+        if not exceeded:
+            await self.app(scope, receive, send)
+            return
+
+        metrics.increment("api_rate_limit.rejected")
+        # Budget recovers as the sliding window moves on; the window end is a good estimate
+        retry_after = max(1, math.ceil(window - self.backend.clock() % window))
+        response = JSONResponse(
+            status_code=429,
+            content={"detail": "Too many requests", "retry_after": retry_after},
+            headers={"Retry-After": str(retry_after)},
+        )
+        await response(scope, receive, send)
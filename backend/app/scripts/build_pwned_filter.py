@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Build Pwned Passwords Filter
+Builds the offline Bloom filter used by check_pwned_password_async from a local
+copy of the "Have I Been Pwned" SHA-1 password list:
+
+    python -m app.scripts.build_pwned_filter pwnedpasswords.txt data/pwned.bloom
+
+The input is either one file with "HASH:COUNT" lines (the classic download)
+or a directory of range files named after the 5 character prefix with
+"SUFFIX:COUNT" lines (output of the official PwnedPasswordsDownloader).
+
+Then start the backend with PWNED_PASSWORDS_FILTER=data/pwned.bloom.
+The full list (~1 billion hashes) gives a ~1.8 GB filter at the default
+false positive rate of 0.001. --min-count drops rarely seen hashes to shrink it.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Iterator, Tuple
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.services.pwned_filter import build_filter, optimal_parameters
+
+
+def iter_hashes(source: str) -> Iterator[Tuple[str, int]]:
+    """(40 hex char SHA-1, count) for every line of the dump."""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            prefix = name.split(".")[0].upper()
+            if len(prefix) != 5:
+                continue
+            with open(os.path.join(source, name), "r", encoding="ascii") as f:
+                for line in f:
+                    suffix, _, count = line.strip().partition(":")
+                    if suffix:
+                        yield prefix + suffix.upper(), int(count or 1)
+        return
+
+    with open(source, "r", encoding="ascii") as f:
+        for line in f:
+            digest, _, count = line.strip().partition(":")
+            if digest:
+                yield digest.upper(), int(count or 1)
+
+
+def main(args):
+    def digests():
+        for hex_digest, count in iter_hashes(args.source):
+            if count >= args.min_count and len(hex_digest) == 40:
+                yield bytes.fromhex(hex_digest)
+
+    items = args.expected_items
+    if not items:
+        print("Counting hashes (pass --expected-items to skip)...")
+        items = sum(1 for _ in digests())
+    bits, hashes = optimal_parameters(items, args.false_positive_rate)
+    print(f"Building filter for {items} hashes: {bits // 8 / 2**20:.1f} MiB, k={hashes}")
+
+    started = time.time()
+    added = build_filter(args.output, digests(), items, args.false_positive_rate)
+    if added > items:
+        print(f"Warning: {added} hashes added, more than the {items} expected.")
+    print(f"Done: {added} hashes in {time.time() - started:.0f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline pwned passwords filter")
+    parser.add_argument("source", help="HIBP SHA-1 dump file or range file directory")
+    parser.add_argument("output", help="Filter file to write")
+    parser.add_argument(
+        "--false-positive-rate", type=float, default=0.001, help="Target false positive rate"
+    )
+    parser.add_argument(
+        "--min-count", type=int, default=1, help="Skip hashes seen fewer times than this"
+    )
+    parser.add_argument(
+        "--expected-items", type=int, default=0, help="Number of hashes (default: count them)"
+    )
+    main(parser.parse_args())
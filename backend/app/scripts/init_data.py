@@ -87,6 +87,7 @@ def check_schema(db: Session):
             "reset_token_expires": "TIMESTAMP",
             "app_settings": "TEXT DEFAULT '{}'",
             "push_subscription": "TEXT",
+            "last_seen": "TIMESTAMP",
         }
 
         for col, definition in columns_to_check.items():
@@ -99,10 +100,78 @@ def check_schema(db: Session):
                 db.commit()
                 logger.info(f"Migration successful: Added '{col}'.")
 
+        # Indexes added after the initial schema (create_all skips existing tables)
+        indexes_to_check = {
+            "ix_messages_receiver_id_id": "messages (receiver_id, id)",
+        }
+        for name, definition in indexes_to_check.items():
+            db.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}"))
+        # Search index rows outlive archived messages: drop the former FK to messages
+        # (SQLite does not enforce it unless PRAGMA foreign_keys is on)
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(
+                text(
+                    "ALTER TABLE message_search_tokens "
+                    "DROP CONSTRAINT IF EXISTS message_search_tokens_message_id_fkey"
+                )
+            )
+        db.commit()
+
     except Exception as e:
         logger.error(f"Schema check failed: {e}")
 
 
+def migrate_webauthn_credentials(db: Session):
+    """
+    Moves passkeys from the legacy users.webauthn_credentials JSON list into the
+    webauthn_credentials table and resets the list to "[]". Runs on startup and
+    after a database import; users without legacy entries are skipped by the filter.
+    """
+    try:
+        users = (
+            db.query(models.User.id, models.User.webauthn_credentials)
+            .filter(
+                models.User.webauthn_credentials != None,
+                models.User.webauthn_credentials != "",
+                models.User.webauthn_credentials != "[]",
+            )
+            .all()
+        )
+        if not users:
+            return
+
+        known = {row.credential_id for row in db.query(models.WebAuthnCredential.credential_id)}
+        migrated = 0
+        for user_id, blob in users:
+            try:
+                creds = json.loads(blob)
+            except ValueError:
+                logger.warning(f"Unreadable passkey list of user {user_id} dropped.")
+                creds = []
+            for cred in creds:
+                if not cred.get("id") or not cred.get("public_key") or cred["id"] in known:
+                    continue
+                db.add(
+                    models.WebAuthnCredential(
+                        user_id=user_id,
+                        credential_id=cred["id"],
+                        public_key=cred["public_key"],
+                        sign_count=cred.get("sign_count") or 0,
+                        transports=json.dumps(cred.get("transports") or []),
+                    )
+                )
+                known.add(cred["id"])
+                migrated += 1
+            db.query(models.User).filter(models.User.id == user_id).update(
+                {models.User.webauthn_credentials: "[]"}, synchronize_session=False
+            )
+        db.commit()
+        logger.info(f"Migrated {migrated} passkeys of {len(users)} users to webauthn_credentials.")
+    except Exception as e:
+        logger.error(f"Passkey migration failed: {e}")
+        db.rollback()
+
+
 def ensure_guest_user(db: Session):
     try:
         guest = db.query(models.User).filter(models.User.id == 0).first()
@@ -266,7 +335,7 @@ def check_emergency_reset(db: Session):
     try:
 
         from app.db import models
-        from app.services.utils import get_setting
+        from app.services.utils import get_setting, invalidate_settings
 
         target_id_str = get_setting(db, "admin_emergency_reset_target", None)
         if not target_id_str:
@@ -289,8 +358,7 @@ def check_emergency_reset(db: Session):
         user.hashed_password = hash_password(new_pw)
         user.two_factor_method = "none"
         user.totp_secret = None
-        user.webauthn_credentials = "[]"
-        user.webauthn_challenge = None
+        user.passkeys.clear()
 
         # Clear Flag (by saving None or empty?)
         # get_setting gets a value. We need to DELETE it or set to empty.
@@ -300,6 +368,7 @@ def check_emergency_reset(db: Session):
         ).delete()
 
         db.commit()
+        invalidate_settings(db)
 
         sep = "#" * 60
         msg = f"\n{sep}\nEMERGENCY RESET COMPLETED FOR USER: {user.username}\nNEW PASSWORD: {new_pw}\n{sep}\n"
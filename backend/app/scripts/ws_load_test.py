@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+WebSocket Load Test
+Opens many concurrent /ws/chat connections against a running test instance
+and lets simulated users chat with each other at a fixed rate. Reports
+end-to-end delivery latency percentiles, drop rate and server RSS.
+
+Like DemoService, but drives real clients through the network stack.
+The load users are created directly in the database the instance uses
+(DATABASE_URL, SQLite or Postgres), so run this with the same environment
+as the server:
+
+    DATABASE_URL=sqlite:///./test.db python -m app.scripts.ws_load_test \\
+        --url ws://localhost:7777 --users 2000 --rate 0.5 --duration 60 \\
+        --server-pid $(pgrep -f "uvicorn app.main:app" | head -1)
+
+Thousands of sockets need a raised file descriptor limit (ulimit -n) on
+both sides. Messages above the configured per-connection/per-user limits
+(admin settings -> websocket) are counted as rate limited, not dropped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+import websockets
+from sqlalchemy import or_
+
+from app.core.database import SessionLocal
+from app.db import models
+from app.services.message_search import delete_message_tokens
+
+USERNAME_PREFIX = "loadtest_"
+CONTENT_PREFIX = "lt|"
+
+
+@dataclass
+class LoadStats:
+    connected: int = 0
+    connect_failures: int = 0
+    disconnects: int = 0
+    sent: int = 0
+    delivered: int = 0
+    rate_limited: int = 0
+    errors: int = 0
+    latencies: List[float] = field(default_factory=list)
+    # message key -> monotonic send time, removed on delivery
+    in_flight: Dict[str, float] = field(default_factory=dict)
+    rss_samples: List[int] = field(default_factory=list)
+    # users whose socket the server closed; reader and sender may both notice
+    disconnected: Set[int] = field(default_factory=set)
+
+    def record_disconnect(self, user_id: int):
+        if user_id not in self.disconnected:
+            self.disconnected.add(user_id)
+            self.disconnects += 1
+
+
+# --- Load users ---
+
+
+def ensure_load_users(count: int) -> List[int]:
+    """Create (or reuse) `count` verified test-role users and return their IDs."""
+    db = SessionLocal()
+    try:
+        existing = (
+            db.query(models.User)
+            .filter(models.User.username.like(f"{USERNAME_PREFIX}%"))
+            .order_by(models.User.id)
+            .all()
+        )
+        for i in range(len(existing), count):
+            db.add(
+                models.User(
+                    username=f"{USERNAME_PREFIX}{i}",
+                    email=f"{USERNAME_PREFIX}{i}@loadtest.invalid",
+                    hashed_password="!",  # Cannot log in via password
+                    role="test",  # Test users may chat with each other
+                    is_active=True,
+                    is_verified=True,
+                    is_visible_in_matches=False,
+                )
+            )
+        db.commit()
+        users = (
+            db.query(models.User.id)
+            .filter(models.User.username.like(f"{USERNAME_PREFIX}%"))
+            .order_by(models.User.id)
+            .limit(count)
+            .all()
+        )
+        return [row.id for row in users]
+    finally:
+        db.close()
+
+
+def cleanup_load_users():
+    """Remove all load users and their messages."""
+    db = SessionLocal()
+    try:
+        ids = [
+            row.id
+            for row in db.query(models.User.id).filter(
+                models.User.username.like(f"{USERNAME_PREFIX}%")
+            )
+        ]
+        if not ids:
+            return 0
+        load_test_messages = or_(
+            models.Message.sender_id.in_(ids), models.Message.receiver_id.in_(ids)
+        )
+        delete_message_tokens(db, load_test_messages)
+        db.query(models.Message).filter(load_test_messages).delete(synchronize_session=False)
+        db.query(models.User).filter(models.User.id.in_(ids)).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        return len(ids)
+    finally:
+        db.close()
+
+
+# --- Server RSS ---
+
+
+def read_rss_kb(pid: int) -> Optional[int]:
+    """Resident set size of a process in KiB (Linux /proc)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+async def sample_rss(pid: int, stats: LoadStats, stop: asyncio.Event):
+    while not stop.is_set():
+        rss = read_rss_kb(pid)
+        if rss is not None:
+            stats.rss_samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+
+
+# --- Simulated clients ---
+
+
+async def reader(ws, user_id: int, stats: LoadStats):
+    try:
+        await read_frames(ws, user_id, stats)
+    except websockets.ConnectionClosed:
+        pass
+    # The client only closes after cancelling this task, so any end of the
+    # stream means the server dropped the connection
+    stats.record_disconnect(user_id)
+
+
+async def read_frames(ws, user_id: int, stats: LoadStats):
+    async for raw in ws:
+        now = time.monotonic()
+        try:
+            frame = json.loads(raw)
+        except ValueError:
+            stats.errors += 1
+            continue
+
+        frame_type = frame.get("type")
+        if frame_type == "ping":
+            await ws.send('{"type":"pong"}')
+        elif frame_type == "rate_limited":
+            stats.rate_limited += 1
+        elif frame.get("error"):
+            stats.errors += 1
+        elif frame.get("receiver_id") == user_id and frame.get("sender_id") != user_id:
+            content = frame.get("content", "")
+            if content.startswith(CONTENT_PREFIX):
+                sent_at = stats.in_flight.pop(content, None)
+                if sent_at is not None:
+                    stats.latencies.append(now - sent_at)
+                    stats.delivered += 1
+
+
+async def simulated_user(
+    url: str,
+    user_id: int,
+    user_ids: List[int],
+    rate: float,
+    start: asyncio.Event,
+    sending_stop: asyncio.Event,
+    stop: asyncio.Event,
+    stats: LoadStats,
+):
+    try:
+        ws = await websockets.connect(f"{url}/ws/chat?token={user_id}", open_timeout=30)
+    except Exception:
+        stats.connect_failures += 1
+        return
+
+    stats.connected += 1
+    read_task = asyncio.create_task(reader(ws, user_id, stats))
+    seq = 0
+    try:
+        # Messages to partners that are not connected yet would count as drops
+        await start.wait()
+        # Spread the first messages so clients do not send in lockstep
+        await asyncio.sleep(random.uniform(0, 1 / rate) if rate > 0 else 0)
+        while not sending_stop.is_set() and rate > 0:
+            partner = random.choice(user_ids)
+            if partner == user_id and len(user_ids) > 1:
+                continue
+            key = f"{CONTENT_PREFIX}{user_id}:{seq}"
+            seq += 1
+            stats.in_flight[key] = time.monotonic()
+            await ws.send(json.dumps({"receiver_id": partner, "content": key}))
+            stats.sent += 1
+            try:
+                await asyncio.wait_for(sending_stop.wait(), timeout=random.expovariate(rate))
+            except asyncio.TimeoutError:
+                pass
+        # Keep listening until the drain period is over
+        await stop.wait()
+    except websockets.ConnectionClosed:
+        stats.record_disconnect(user_id)
+    finally:
+        read_task.cancel()
+        await ws.close()
+
+
+async def run(args) -> LoadStats:
+    user_ids = ensure_load_users(args.users)
+    stats = LoadStats()
+    start = asyncio.Event()
+    sending_stop = asyncio.Event()
+    stop = asyncio.Event()
+
+    rss_task = None
+    if args.server_pid:
+        rss_task = asyncio.create_task(sample_rss(args.server_pid, stats, stop))
+
+    tasks = []
+    for index, user_id in enumerate(user_ids):
+        tasks.append(
+            asyncio.create_task(
+                simulated_user(
+                    args.url, user_id, user_ids, args.rate, start, sending_stop, stop, stats
+                )
+            )
+        )
+        # Ramp up instead of opening all sockets at once
+        if args.ramp and (index + 1) % args.ramp == 0:
+            await asyncio.sleep(1)
+
+    # Wait until every client connected (or gave up) before sending
+    while stats.connected + stats.connect_failures < len(user_ids):
+        await asyncio.sleep(0.1)
+    start.set()
+
+    await asyncio.sleep(args.duration)
+    sending_stop.set()
+    # In-flight messages may still arrive
+    await asyncio.sleep(args.drain)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if rss_task:
+        await rss_task
+    return stats
+
+
+# --- Report ---
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def build_report(stats: LoadStats, duration: float) -> dict:
+    accepted = stats.sent - stats.rate_limited
+    dropped = len(stats.in_flight) - stats.rate_limited
+    return {
+        "connections": stats.connected,
+        "connect_failures": stats.connect_failures,
+        "disconnects": stats.disconnects,
+        "sent": stats.sent,
+        "delivered": stats.delivered,
+        "rate_limited": stats.rate_limited,
+        "errors": stats.errors,
+        "drop_rate": round(max(dropped, 0) / accepted, 4) if accepted > 0 else 0.0,
+        "throughput_per_second": round(stats.delivered / duration, 1) if duration else 0.0,
+        "latency_ms": {
+            f"p{pct}": round(percentile(stats.latencies, pct) * 1000, 2)
+            for pct in (50, 90, 95, 99)
+        }
+        | {"max": round(max(stats.latencies, default=0) * 1000, 2)},
+        "server_rss_mb": {
+            "start": round(stats.rss_samples[0] / 1024, 1),
+            "peak": round(max(stats.rss_samples) / 1024, 1),
+            "end": round(stats.rss_samples[-1] / 1024, 1),
+        }
+        if stats.rss_samples
+        else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solumati WebSocket load test")
+    parser.add_argument("--url", default="ws://localhost:7777", help="Base WebSocket URL")
+    parser.add_argument("--users", type=int, default=100, help="Concurrent simulated users")
+    parser.add_argument(
+        "--rate", type=float, default=0.2, help="Messages per second per user"
+    )
+    parser.add_argument("--duration", type=float, default=30, help="Sending phase in seconds")
+    parser.add_argument(
+        "--drain", type=float, default=5, help="Seconds to wait for in-flight messages"
+    )
+    parser.add_argument(
+        "--ramp", type=int, default=200, help="New connections per second (0 = all at once)"
+    )
+    parser.add_argument("--server-pid", type=int, help="Server PID for RSS sampling")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument(
+        "--cleanup", action="store_true", help="Delete load users and their messages afterwards"
+    )
+    args = parser.parse_args()
+
+    try:
+        result = asyncio.run(run(args))
+        report = build_report(result, args.duration)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print(f"Connections:  {report['connections']} ({report['connect_failures']} failed)")
+            print(
+                f"Messages:     {report['sent']} sent, {report['delivered']} delivered, "
+                f"{report['rate_limited']} rate limited, drop rate {report['drop_rate']:.2%}"
+            )
+            print(f"Throughput:   {report['throughput_per_second']} msg/s")
+            latency = report["latency_ms"]
+            print(
+                f"Latency (ms): p50 {latency['p50']}  p90 {latency['p90']}  "
+                f"p99 {latency['p99']}  max {latency['max']}"
+            )
+            if report["server_rss_mb"]:
+                rss = report["server_rss_mb"]
+                print(f"Server RSS:   {rss['start']} -> peak {rss['peak']} MB (end {rss['end']} MB)")
+    finally:
+        if args.cleanup:
+            print(f"Removed {cleanup_load_users()} load users.")
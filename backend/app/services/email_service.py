@@ -7,11 +7,12 @@ import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr
+from typing import Optional
 
 from sqlalchemy.orm import Session
 
 from app.core.config import PROJECT_NAME
-from app.services.settings_service import SettingsService
+from app.services.settings_service import SettingsSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +26,7 @@ class EmailService:
         action_text: str = None,
         server_domain: str = "",
         db: Session = None,
+        settings: Optional[SettingsSnapshot] = None,
     ) -> str:
         if server_domain.endswith("/"):
             server_domain = server_domain[:-1]
@@ -33,20 +35,17 @@ class EmailService:
         support_url = None
         contact_email = None
 
-        if db:
+        if db or settings:
+            settings = settings or SettingsSnapshot(db)
             try:
                 # Fetch settings for footer
-                reg_config = SettingsService.get(db, "registration", {})
                 if not server_domain:
-                     host_url = reg_config.get("server_domain", host_url)
+                     host_url = settings.registration.server_domain or host_url
 
-                support_conf = SettingsService.get(db, "support_page", {})
-                legal_conf = SettingsService.get(db, "legal", {})
-
-                if isinstance(support_conf, dict) and support_conf.get("enabled", True):
+                if settings.support_page.enabled:
                     support_url = f"{host_url}/support"
 
-                contact_email = legal_conf.get("contact_email") if isinstance(legal_conf, dict) else None
+                contact_email = settings.legal.contact_email or None
 
             except Exception as e:
                 logger.warn(f"Failed to fetch settings for email build: {e}")
@@ -101,7 +100,13 @@ class EmailService:
         """
 
     @staticmethod
-    def send_mail_sync(to_email: str, subject: str, html_body: str, db: Session) -> bool:
+    def send_mail_sync(
+        to_email: str,
+        subject: str,
+        html_body: str,
+        db: Session,
+        settings: Optional[SettingsSnapshot] = None,
+    ) -> bool:
         """
         Send an email synchronously.
 
@@ -110,12 +115,13 @@ class EmailService:
             subject: Email subject
             html_body: HTML content
             db: Database session for config lookup
+            settings: Request settings snapshot to reuse (optional)
 
         Returns:
             True if sent successfully, False otherwise
         """
         try:
-            config = SettingsService.get_mail_config(db)
+            config = (settings or SettingsSnapshot(db)).mail
 
             if not config.enabled:
                 logger.debug(f"Mail disabled. Skipping email to {to_email}")
@@ -0,0 +1,188 @@
+"""
+Ephemeral Store
+Short-lived authentication state (email 2FA codes, WebAuthn challenges,
+password reset tokens) with automatic expiry. Login ceremonies therefore
+don't write to and clear columns of the users table.
+
+Backends (EPHEMERAL_STORE_BACKEND):
+- memory: per process. Expiry via a min-heap, so purging costs O(log n)
+  per entry. Fine for a single worker.
+- database: the ephemeral_entries table, shared by all workers (needed when
+  a reset link or 2FA step may hit a different worker than the one that
+  created it). Expired rows are purged through the expires_at index.
+
+Values must be JSON serializable. pop() is atomic, so a code or challenge
+can be consumed only once.
+"""
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.db import models
+
+logger = logging.getLogger(__name__)
+
+EPHEMERAL_STORE_BACKEND = os.getenv("EPHEMERAL_STORE_BACKEND", "memory").lower()
+EPHEMERAL_STORE_MAX_ENTRIES = int(os.getenv("EPHEMERAL_STORE_MAX_ENTRIES", "100000"))
+PURGE_INTERVAL_SECONDS = 60
+
+
+class MemoryEphemeralStore:
+    def __init__(
+        self,
+        maxsize: int = EPHEMERAL_STORE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        # (expires_at, key); stale items (key overwritten/removed) are skipped
+        self._expiry: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _purge(self, now: float):
+        while self._expiry and (
+            self._expiry[0][0] <= now or len(self._entries) > self.maxsize
+        ):
+            expires, key = heapq.heappop(self._expiry)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == expires:
+                del self._entries[key]
+        # Heap only holds stale items for overwritten keys: rebuild if it piles up
+        if len(self._expiry) > 2 * len(self._entries) + 64:
+            self._expiry = [(expires, key) for key, (expires, _) in self._entries.items()]
+            heapq.heapify(self._expiry)
+
+    def set(self, key: str, value: Any, ttl: float):
+        now = self.clock()
+        with self._lock:
+            expires = now + ttl
+            self._entries[key] = (expires, value)
+            heapq.heappush(self._expiry, (expires, key))
+            self._purge(now)
+
+    def get(self, key: str) -> Optional[Any]:
+        now = self.clock()
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def pop(self, key: str) -> Optional[Any]:
+        now = self.clock()
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.pop(key, None)
+            return entry[1] if entry is not None else None
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DatabaseEphemeralStore:
+    def __init__(
+        self,
+        session_factory: Optional[Callable] = None,
+        clock: Callable[[], float] = time.time,
+        purge_interval: int = PURGE_INTERVAL_SECONDS,
+    ):
+        self._session_factory = session_factory
+        self.clock = clock
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    def _session(self):
+        if self._session_factory is not None:
+            return self._session_factory()
+        from app.core import database
+
+        return database.SessionLocal()
+
+    def _purge(self, db, now: float):
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        db.query(models.EphemeralEntry).filter(
+            models.EphemeralEntry.expires_at <= now
+        ).delete(synchronize_session=False)
+
+    def set(self, key: str, value: Any, ttl: float):
+        now = self.clock()
+        db = self._session()
+        try:
+            self._purge(db, now)
+            db.merge(
+                models.EphemeralEntry(key=key, value=json.dumps(value), expires_at=now + ttl)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _live_entry(self, db, key: str, now: float):
+        return (
+            db.query(models.EphemeralEntry)
+            .filter(
+                models.EphemeralEntry.key == key,
+                models.EphemeralEntry.expires_at > now,
+            )
+            .first()
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        db = self._session()
+        try:
+            entry = self._live_entry(db, key, self.clock())
+            return json.loads(entry.value) if entry is not None else None
+        finally:
+            db.close()
+
+    def pop(self, key: str) -> Optional[Any]:
+        now = self.clock()
+        db = self._session()
+        try:
+            entry = self._live_entry(db, key, now)
+            if entry is None:
+                return None
+            value = json.loads(entry.value)
+            # Only the worker whose DELETE hits the row consumes the entry
+            deleted = (
+                db.query(models.EphemeralEntry)
+                .filter(
+                    models.EphemeralEntry.key == key,
+                    models.EphemeralEntry.expires_at == entry.expires_at,
+                )
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            return value if deleted else None
+        finally:
+            db.close()
+
+    def delete(self, key: str):
+        db = self._session()
+        try:
+            db.query(models.EphemeralEntry).filter(
+                models.EphemeralEntry.key == key
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+def create_store(name: str = EPHEMERAL_STORE_BACKEND):
+    if name == "database":
+        return DatabaseEphemeralStore()
+    if name != "memory":
+        logger.warning(f"Unknown EPHEMERAL_STORE_BACKEND '{name}', using memory")
+    return MemoryEphemeralStore()
+
+
+ephemeral_store = create_store()
@@ -4,6 +4,7 @@ import zipfile
 from datetime import datetime
 
 from app.db import models
+from app.services.message_archive import load_user_archived_messages
 from sqlalchemy.orm import Session
 
 
@@ -18,7 +19,12 @@ def collect_user_data(db: Session, user_id: int):
     """
     Collects all stored data for a specific user complying with GDPR/DSGVO Article 15.
     """
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = (
+        db.query(models.User)
+        .options(*models.USER_FULL)
+        .filter(models.User.id == user_id)
+        .first()
+    )
     if not user:
         return None
 
@@ -95,6 +101,17 @@ def collect_user_data(db: Session, user_id: int):
             }
         )
 
+    # Older messages live in the compressed archive
+    for m in load_user_archived_messages(db, user_id):
+        if m["sender_id"] == user_id:
+            entry = {"direction": "sent", "to_user_id": m["receiver_id"]}
+        else:
+            entry = {"direction": "received", "from_user_id": m["sender_id"]}
+        entry.update(
+            {"content": m["content"], "timestamp": m["timestamp"], "is_read": m["is_read"]}
+        )
+        msgs_export.append(entry)
+
     # 4. Reports (Active transparency)
     reports_filed = (
         db.query(models.Report).filter(models.Report.reporter_id == user_id).all()
@@ -0,0 +1,40 @@
+"""
+Shared HTTP Client
+One long-lived httpx.AsyncClient per worker for outbound API calls (HIBP,
+CAPTCHA providers, ...). Reusing its connection pool avoids a TCP and TLS
+handshake per request. Callers pass their own tight timeouts per request.
+
+The client belongs to the event loop it was created on. It is closed on app
+shutdown and recreated lazily on the next use.
+"""
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_CLIENT_LIMITS = httpx.Limits(
+    max_connections=100, max_keepalive_connections=20, keepalive_expiry=60
+)
+DEFAULT_TIMEOUT = httpx.Timeout(5.0, connect=2.0)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=DEFAULT_TIMEOUT,
+            limits=HTTP_CLIENT_LIMITS,
+            headers={"User-Agent": "Solumati"},
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
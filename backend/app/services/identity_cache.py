@@ -0,0 +1,125 @@
+"""
+Identity Cache
+Bounded LRU of the authorization-relevant fields of a user (role, is_active,
+is_guest, plus the username for audit logs), so requests can be authorized without selecting the full users row.
+
+Entries are invalidated explicitly on ban/reactivation, role change and
+deletion, and expire after IDENTITY_CACHE_TTL_SECONDS. The TTL bounds
+staleness for changes made by other workers.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from app.db import models
+
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+IDENTITY_CACHE_TTL_SECONDS = float(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "60"))
+
+
+@dataclass(frozen=True)
+class Identity:
+    id: int
+    role: str
+    is_active: bool
+    is_guest: bool
+    username: str = ""
+    # Invalidation counter of the cache at load time
+    version: int = 0
+
+
+class IdentityCache:
+    def __init__(
+        self, maxsize: int = IDENTITY_CACHE_SIZE, ttl: float = IDENTITY_CACHE_TTL_SECONDS
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[float, Identity]]" = OrderedDict()
+        # Bumped by every invalidation. One counter for all users keeps memory
+        # bounded; a concurrent invalidation of another user only costs a cache fill.
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Identity]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def version(self) -> int:
+        """Take before loading a user from the DB and pass it back to put()."""
+        return self._version
+
+    def put(self, identity: Identity):
+        """Store an identity unless the user was invalidated since it was loaded."""
+        with self._lock:
+            if identity.version != self._version:
+                return
+            self._entries[identity.id] = (time.monotonic() + self.ttl, identity)
+            self._entries.move_to_end(identity.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def put_user(self, user: models.User, version: int):
+        self.put(
+            Identity(
+                id=user.id,
+                role=user.role,
+                is_active=bool(user.is_active),
+                is_guest=bool(user.is_guest),
+                username=user.username,
+                version=version,
+            )
+        )
+
+    def load(self, db, user_id: int) -> Optional[Identity]:
+        """Cached identity, or the identity columns from the DB (None if unknown)."""
+        identity = self.get(user_id)
+        if identity is not None:
+            return identity
+
+        version = self.version()
+        row = (
+            db.query(
+                models.User.id,
+                models.User.role,
+                models.User.is_active,
+                models.User.is_guest,
+                models.User.username,
+            )
+            .filter(models.User.id == user_id)
+            .first()
+        )
+        if row is None:
+            return None
+        identity = Identity(
+            id=row.id,
+            role=row.role,
+            is_active=bool(row.is_active),
+            is_guest=bool(row.is_guest),
+            username=row.username,
+            version=version,
+        )
+        self.put(identity)
+        return identity
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._version += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version += 1
+
+
+identity_cache = IdentityCache()
@@ -0,0 +1,268 @@
+"""
+Message Archive Service
+Moves old chat messages out of the hot messages table into compressed,
+per-conversation monthly archive rows (message_archives). Archived messages
+stay readable through the history API and searchable (their search index
+rows are kept); hot queries (inbox, reconnect sync, unread counts) only
+touch recent rows, which keeps the table and its indexes small.
+
+Only read messages are archived. Archive rows are written once and never
+track read state, so unread messages stay hot until the receiver opens them.
+"""
+import json
+import logging
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from sqlalchemy import or_
+
+from app.db import models
+from app.services.message_search import delete_tokens_for_ids
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SETTING = "message_archive"
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def conversation_key(user_a: int, user_b: int) -> Tuple[int, int]:
+    return (min(user_a, user_b), max(user_a, user_b))
+
+
+def pack_messages(messages: List[dict]) -> bytes:
+    return zlib.compress(json.dumps(messages, separators=(",", ":")).encode(), 9)
+
+
+def unpack_messages(payload: bytes) -> List[dict]:
+    messages = json.loads(zlib.decompress(payload))
+    for m in messages:
+        if m.get("timestamp"):
+            m["timestamp"] = datetime.fromisoformat(m["timestamp"])
+    return messages
+
+
+def _entry(m) -> dict:
+    return {
+        "id": m.id,
+        "sender_id": m.sender_id,
+        "receiver_id": m.receiver_id,
+        "content": m.content,  # Still encrypted
+        "timestamp": m.timestamp.isoformat() if m.timestamp else None,
+        "is_read": bool(m.is_read),
+    }
+
+
+def iter_archived_messages(db, user_a: int, user_b: int) -> Iterator[dict]:
+    """Archived messages of a conversation, oldest first (contents encrypted).
+    Only one archive row is decompressed at a time."""
+    low, high = conversation_key(user_a, user_b)
+    archives = (
+        db.query(models.MessageArchive.payload)
+        .filter(models.MessageArchive.user_low == low, models.MessageArchive.user_high == high)
+        .order_by(models.MessageArchive.period)
+        .yield_per(1)
+    )
+    for (payload,) in archives:
+        yield from unpack_messages(payload)
+
+
+def load_archived_messages(db, user_a: int, user_b: int) -> List[dict]:
+    return list(iter_archived_messages(db, user_a, user_b))
+
+
+def load_user_archived_messages(db, user_id: int) -> List[dict]:
+    """All archived messages a user sent or received (data export)."""
+    archives = db.query(models.MessageArchive.payload).filter(
+        or_(models.MessageArchive.user_low == user_id, models.MessageArchive.user_high == user_id)
+    )
+    messages = []
+    for (payload,) in archives:
+        messages.extend(
+            m for m in unpack_messages(payload) if user_id in (m["sender_id"], m["receiver_id"])
+        )
+    return messages
+
+
+def find_archived_messages(db, user_id: int, message_ids) -> List[dict]:
+    """Archived messages of a user by id (search hits no longer in the hot table)."""
+    wanted = set(message_ids)
+    if not wanted:
+        return []
+    rows = (
+        db.query(
+            models.MessageArchive.id,
+            models.MessageArchive.first_message_id,
+            models.MessageArchive.last_message_id,
+        )
+        .filter(
+            or_(models.MessageArchive.user_low == user_id, models.MessageArchive.user_high == user_id),
+            models.MessageArchive.first_message_id <= max(wanted),
+            models.MessageArchive.last_message_id >= min(wanted),
+        )
+        .all()
+    )
+    # Only decompress rows whose id range contains one of the wanted ids
+    candidates = [
+        archive_id for archive_id, first, last in rows if any(first <= i <= last for i in wanted)
+    ]
+    if not candidates:
+        return []
+
+    messages = []
+    for (payload,) in db.query(models.MessageArchive.payload).filter(
+        models.MessageArchive.id.in_(candidates)
+    ):
+        messages.extend(
+            m
+            for m in unpack_messages(payload)
+            if m["id"] in wanted and user_id in (m["sender_id"], m["receiver_id"])
+        )
+    return messages
+
+
+def latest_archived_conversations(db, user_id: int, exclude=()) -> Dict[int, dict]:
+    """
+    Conversations of a user that only exist in the archive (inbox fallback).
+    Returns partner_id -> newest archived message (encrypted); archived
+    messages are always read. Only the newest archive row per partner is
+    decompressed.
+    """
+    rows = (
+        db.query(
+            models.MessageArchive.id,
+            models.MessageArchive.user_low,
+            models.MessageArchive.user_high,
+        )
+        .filter(
+            or_(models.MessageArchive.user_low == user_id, models.MessageArchive.user_high == user_id)
+        )
+        .order_by(models.MessageArchive.period.desc())
+        .all()
+    )
+    newest: Dict[int, int] = {}
+    for archive_id, low, high in rows:
+        partner_id = high if low == user_id else low
+        if partner_id not in exclude:
+            newest.setdefault(partner_id, archive_id)
+    if not newest:
+        return {}
+
+    payloads = dict(
+        db.query(models.MessageArchive.id, models.MessageArchive.payload).filter(
+            models.MessageArchive.id.in_(list(newest.values()))
+        )
+    )
+    return {
+        partner_id: unpack_messages(payloads[archive_id])[-1]
+        for partner_id, archive_id in newest.items()
+    }
+
+
+def delete_user_archives(db, user_id: int):
+    """Remove all archived conversations of a user and their search index rows
+    (commit is up to the caller)."""
+    user_archives = or_(
+        models.MessageArchive.user_low == user_id, models.MessageArchive.user_high == user_id
+    )
+    message_ids = [
+        m["id"]
+        for (payload,) in db.query(models.MessageArchive.payload).filter(user_archives)
+        for m in json.loads(zlib.decompress(payload))
+    ]
+    delete_tokens_for_ids(db, message_ids)
+    db.query(models.MessageArchive).filter(user_archives).delete(synchronize_session=False)
+
+
+def archive_old_messages(db, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Moves read messages older than `cutoff` into the archive, one committed
+    batch at a time. Messages of a conversation/month that already has an
+    archive row are merged into it. Search index rows are kept. Returns the
+    number of archived messages.
+    """
+    archived = 0
+    while True:
+        batch = (
+            db.query(models.Message)
+            .filter(models.Message.timestamp < cutoff, models.Message.is_read == True)
+            .order_by(models.Message.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+
+        groups: Dict[Tuple[int, int, str], List[dict]] = defaultdict(list)
+        for m in batch:
+            low, high = conversation_key(m.sender_id, m.receiver_id)
+            groups[(low, high, m.timestamp.strftime("%Y-%m"))].append(_entry(m))
+
+        for (low, high, period), entries in groups.items():
+            archive = (
+                db.query(models.MessageArchive)
+                .filter(
+                    models.MessageArchive.user_low == low,
+                    models.MessageArchive.user_high == high,
+                    models.MessageArchive.period == period,
+                )
+                .with_for_update()  # Re-encryption job rewrites the same payload
+                .first()
+            )
+            if archive:
+                merged = {m["id"]: m for m in json.loads(zlib.decompress(archive.payload))}
+                merged.update({m["id"]: m for m in entries})
+                entries = sorted(merged.values(), key=lambda m: m["id"])
+            else:
+                archive = models.MessageArchive(user_low=low, user_high=high, period=period)
+                db.add(archive)
+            archive.payload = pack_messages(entries)
+            archive.message_count = len(entries)
+            archive.first_message_id = entries[0]["id"]
+            archive.last_message_id = entries[-1]["id"]
+
+        ids = [m.id for m in batch]
+        db.query(models.Message).filter(models.Message.id.in_(ids)).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        archived += len(ids)
+
+    return archived
+
+
+def reencrypt_payload(payload: bytes, reencrypt: Callable[[str], str]) -> Tuple[bytes, int]:
+    """Re-encrypts every message of an archive row. Returns (payload, failed count)."""
+    messages = json.loads(zlib.decompress(payload))
+    failed = 0
+    for m in messages:
+        try:
+            m["content"] = reencrypt(m["content"])
+        except Exception:
+            failed += 1
+    return pack_messages(messages), failed
+
+
+def run_message_archival():
+    """Scheduler job: archive messages older than the configured hot window."""
+    from app.core.database import SessionLocal
+    from app.db import schemas
+    from app.services.utils import get_setting
+
+    db = SessionLocal()
+    try:
+        config = schemas.MessageArchiveConfig(
+            **get_setting(db, ARCHIVE_SETTING, schemas.MessageArchiveConfig().dict())
+        )
+        if not config.enabled:
+            return
+        cutoff = datetime.utcnow() - timedelta(days=config.hot_days)
+        count = archive_old_messages(db, cutoff)
+        if count:
+            logger.info(f"Archived {count} messages older than {cutoff.date()}.")
+    except Exception as e:
+        logger.error(f"Message archival failed: {e}")
+        db.rollback()
+    finally:
+        db.close()
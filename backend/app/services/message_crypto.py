@@ -0,0 +1,380 @@
+"""
+Message Crypto Service
+Keyring based encryption for chat messages with key rotation and
+throttled, resumable re-encryption of stored messages (including the
+compressed message archive).
+
+The key file holds one Fernet key per line, newest first. The newest key
+encrypts new messages, all keys are tried for decryption (MultiFernet).
+Legacy single-key files are therefore read without any migration.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from sqlalchemy import update
+
+from app.db import models
+
+logger = logging.getLogger(__name__)
+
+KEY_FILE = os.getenv("MESSAGE_KEY_FILE", "secret.key")
+
+# Setting key used to persist re-encryption progress (survives restarts)
+REENCRYPTION_PROGRESS = "chat_key_rotation"
+
+# Throttling defaults: small batches with a pause in between keep row locks short
+REENCRYPTION_BATCH_SIZE = int(os.getenv("REENCRYPTION_BATCH_SIZE", "200"))
+REENCRYPTION_PAUSE_SECONDS = float(os.getenv("REENCRYPTION_PAUSE_SECONDS", "0.5"))
+
+# Seconds between key file change checks. Until then, another worker may
+# still encrypt new messages with the previous primary key.
+KEY_RELOAD_INTERVAL_SECONDS = 5
+# Retired keys can be pruned this long after a completed re-encryption,
+# once every worker has picked up the new primary key
+PRUNE_GRACE_SECONDS = 2 * KEY_RELOAD_INTERVAL_SECONDS
+
+
+def key_fingerprint(key: bytes) -> str:
+    """Short, non-reversible identifier of a key for display in the admin API."""
+    return hashlib.sha256(key).hexdigest()[:12]
+
+
+class MessageKeyring:
+    """Thread-safe keyring backed by a key file (newest key first)."""
+
+    def __init__(self, key_file: str = KEY_FILE):
+        self.key_file = key_file
+        self._lock = threading.Lock()
+        self._keys: List[bytes] = []
+        self._cipher: Optional[MultiFernet] = None
+        self._mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._reload_interval = KEY_RELOAD_INTERVAL_SECONDS
+        self._load()
+
+    def _read_keys(self) -> List[bytes]:
+        keys = []
+        with open(self.key_file, "rb") as key_file:
+            for line in key_file.read().splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    Fernet(line)
+                    keys.append(line)
+                except Exception:
+                    logger.warning("Ignoring invalid entry in message key file.")
+        return keys
+
+    def _load(self):
+        with self._lock:
+            try:
+                if not os.path.exists(self.key_file):
+                    key = Fernet.generate_key()
+                    with open(self.key_file, "wb") as key_file:
+                        key_file.write(key + b"\n")
+                keys = self._read_keys()
+                self._mtime = os.path.getmtime(self.key_file)
+            except Exception as e:
+                # Fallback if something fails (e.g. read permissions), though dangerous for data loss
+                logger.error(f"Could not load message key file: {e}")
+                keys = []
+
+            if not keys:
+                logger.error("No valid message key found. Using an ephemeral key.")
+                keys = [Fernet.generate_key()]
+
+            self._keys = keys
+            self._cipher = MultiFernet([Fernet(k) for k in keys])
+            self._last_check = time.time()
+
+    def _maybe_reload(self, force: bool = False):
+        """Pick up rotations done by other workers (key file changed on disk)."""
+        now = time.time()
+        if not force and now - self._last_check < self._reload_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = os.path.getmtime(self.key_file)
+        except OSError:
+            return
+        if force or mtime != self._mtime:
+            self._load()
+
+    @property
+    def fingerprints(self) -> List[str]:
+        return [key_fingerprint(k) for k in self._keys]
+
+    @property
+    def primary_fingerprint(self) -> str:
+        return key_fingerprint(self._keys[0])
+
+    def encrypt(self, message: str) -> str:
+        self._maybe_reload()
+        return self._cipher.encrypt(message.encode()).decode()
+
+    def decrypt(self, token: str) -> str:
+        self._maybe_reload()
+        try:
+            return self._cipher.decrypt(token.encode()).decode()
+        except InvalidToken:
+            # Another worker may have rotated in the meantime
+            self._maybe_reload(force=True)
+            return self._cipher.decrypt(token.encode()).decode()
+
+    def reencrypt(self, token: str) -> str:
+        """Re-encrypt a token with the current primary key."""
+        self._maybe_reload()
+        return self._cipher.rotate(token.encode()).decode()
+
+    def rotate(self) -> str:
+        """Generate a new primary key. Old keys stay available for decryption."""
+        new_key = Fernet.generate_key()
+        with self._lock:
+            keys = [new_key] + self._keys
+            self._write_keys(keys)
+        self._load()
+        logger.info(f"Message key rotated. New primary key: {key_fingerprint(new_key)}")
+        return key_fingerprint(new_key)
+
+    def prune(self) -> int:
+        """Drop all keys except the primary one. Returns number of removed keys."""
+        with self._lock:
+            removed = len(self._keys) - 1
+            if removed > 0:
+                self._write_keys(self._keys[:1])
+        self._load()
+        return max(removed, 0)
+
+    def _write_keys(self, keys: List[bytes]):
+        tmp_file = f"{self.key_file}.tmp"
+        with open(tmp_file, "wb") as key_file:
+            key_file.write(b"\n".join(keys) + b"\n")
+        os.replace(tmp_file, self.key_file)
+
+
+keyring = MessageKeyring()
+
+
+# --- Re-encryption Job ---
+
+
+def _default_progress() -> dict:
+    return {
+        "status": "idle",  # idle, running, paused, completed, failed
+        "target_key": None,
+        "phase": "messages",  # messages, archives
+        "last_id": 0,
+        "archive_last_id": 0,
+        "processed": 0,
+        "archives_processed": 0,
+        "failed": 0,
+        "total": 0,
+        "started_at": None,
+        "finished_at": None,
+        "error": None,
+    }
+
+
+def get_reencryption_status(db) -> dict:
+    from app.services.utils import get_job_progress
+
+    progress = _default_progress()
+    progress.update(get_job_progress(db, REENCRYPTION_PROGRESS))
+    return progress
+
+
+class ReencryptionJob:
+    """
+    Walks the messages table in primary key order and re-encrypts each batch
+    with the primary key. Progress is committed per batch, so the job can be
+    paused and resumed (also across restarts) without redoing work.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, restart: bool = False) -> bool:
+        """Start (or resume) the job in a background thread. Returns False if already running."""
+        with self._lock:
+            if self.is_running:
+                return False
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self.run,
+                kwargs={"restart": restart},
+                name="message-reencryption",
+                daemon=True,
+            )
+            self._thread.start()
+            return True
+
+    def pause(self):
+        self._stop_event.set()
+
+    def run(
+        self,
+        restart: bool = False,
+        batch_size: int = REENCRYPTION_BATCH_SIZE,
+        pause_seconds: float = REENCRYPTION_PAUSE_SECONDS,
+    ):
+        from app.core.database import SessionLocal
+        from app.services.utils import save_job_progress
+
+        db = SessionLocal()
+        try:
+            progress = get_reencryption_status(db)
+            # The key may have been rotated by another worker moments ago
+            keyring._maybe_reload(force=True)
+            target_key = keyring.primary_fingerprint
+
+            # A new primary key (or explicit restart) invalidates the old cursor
+            if restart or progress["target_key"] != target_key or progress["status"] == "completed":
+                progress = _default_progress()
+                progress["target_key"] = target_key
+                progress["started_at"] = datetime.utcnow().isoformat()
+
+            progress["status"] = "running"
+            progress["total"] = db.query(models.Message).count()
+            save_job_progress(db, REENCRYPTION_PROGRESS, progress)
+            logger.info(f"Message re-encryption started at id > {progress['last_id']}")
+
+            while not self._stop_event.is_set():
+                # Second phase: compressed archive rows (see services/message_archive.py)
+                if progress["phase"] == "archives":
+                    if not self._reencrypt_archives(db, progress, batch_size):
+                        progress["status"] = "completed"
+                        progress["finished_at"] = datetime.utcnow().isoformat()
+                        break
+                    save_job_progress(db, REENCRYPTION_PROGRESS, progress)
+                    time.sleep(pause_seconds)
+                    continue
+
+                if not self._reencrypt_messages(db, progress, batch_size):
+                    progress["phase"] = "archives"
+                    continue
+                # Progress is committed together with the batch
+                save_job_progress(db, REENCRYPTION_PROGRESS, progress)
+
+                time.sleep(pause_seconds)
+            else:
+                progress["status"] = "paused"
+
+            save_job_progress(db, REENCRYPTION_PROGRESS, progress)
+            logger.info(
+                f"Message re-encryption {progress['status']}: "
+                f"{progress['processed']} processed, {progress['failed']} failed"
+            )
+        except Exception as e:
+            logger.error(f"Message re-encryption failed: {e}")
+            db.rollback()
+            try:
+                progress = get_reencryption_status(db)
+                progress["status"] = "failed"
+                progress["error"] = str(e)
+                save_job_progress(db, REENCRYPTION_PROGRESS, progress)
+            except Exception:
+                pass
+        finally:
+            db.close()
+
+    def _reencrypt_messages(self, db, progress: dict, batch_size: int) -> int:
+        """Re-encrypts the next messages after last_id. Returns how many were read."""
+        rows = (
+            db.query(models.Message.id, models.Message.content)
+            .filter(models.Message.id > progress["last_id"])
+            .order_by(models.Message.id)
+            .limit(batch_size)
+            .all()
+        )
+        updates = []
+        for msg_id, content in rows:
+            try:
+                updates.append({"id": msg_id, "content": keyring.reencrypt(content)})
+            except Exception:
+                progress["failed"] += 1
+
+        if updates:
+            db.execute(update(models.Message), updates)
+        if rows:
+            progress["last_id"] = rows[-1][0]
+            progress["processed"] += len(rows)
+        return len(rows)
+
+    def reencrypt_remaining(self, db, batch_size: int = REENCRYPTION_BATCH_SIZE) -> dict:
+        """
+        Final pass before pruning: messages stored after the job passed their
+        ids, possibly encrypted with a retired key by a worker that had not
+        reloaded the key file yet. Returns the updated progress.
+        """
+        from app.services.utils import save_job_progress
+
+        keyring._maybe_reload(force=True)
+        progress = get_reencryption_status(db)
+        while self._reencrypt_messages(db, progress, batch_size):
+            save_job_progress(db, REENCRYPTION_PROGRESS, progress)
+        return progress
+
+    def _reencrypt_archives(self, db, progress: dict, batch_size: int) -> int:
+        """Re-encrypts the next archive rows. Returns how many were processed."""
+        from app.services.message_archive import reencrypt_payload
+
+        # One archive row holds a whole conversation month: use smaller batches.
+        # Rows are locked against archive_old_messages merging into them meanwhile.
+        archives = (
+            db.query(
+                models.MessageArchive.id,
+                models.MessageArchive.payload,
+                models.MessageArchive.message_count,
+            )
+            .filter(models.MessageArchive.id > progress["archive_last_id"])
+            .order_by(models.MessageArchive.id)
+            .limit(max(batch_size // 50, 1))
+            .with_for_update()
+            .all()
+        )
+        archive_table = models.MessageArchive.__table__
+        failed_total = 0
+        for archive_id, payload, message_count in archives:
+            payload, failed = reencrypt_payload(payload, keyring.reencrypt)
+            # Compare-and-set for databases without row locks: a merge grows message_count
+            result = db.execute(
+                update(archive_table)
+                .where(
+                    archive_table.c.id == archive_id,
+                    archive_table.c.message_count == message_count,
+                )
+                .values(payload=payload)
+            )
+            if result.rowcount == 0:
+                # Merged meanwhile: redo the batch with the fresh payload
+                db.rollback()
+                return len(archives)
+            failed_total += failed
+
+        if archives:
+            progress["failed"] += failed_total
+            progress["archive_last_id"] = archives[-1][0]
+            progress["archives_processed"] += len(archives)
+        return len(archives)
+
+    def resume_if_pending(self, db):
+        """Resume a job that was interrupted by a restart."""
+        if get_reencryption_status(db)["status"] == "running":
+            logger.info("Resuming interrupted message re-encryption.")
+            self.start()
+
+
+reencryption_job = ReencryptionJob()
@@ -0,0 +1,358 @@
+"""
+Message Search Service
+Opt-in blind index for searching Fernet-encrypted chat messages.
+
+Every word of a message is normalized and hashed with a keyed HMAC; only the
+hashes are stored (per participant) in message_search_tokens. A search hashes
+the query words the same way and becomes an indexed lookup, so its cost does
+not depend on the size of the chat history. The HMAC key lives in its own key
+file and is independent of the (rotatable) message encryption keys.
+
+New messages are indexed on insert, existing ones by a throttled, resumable
+backfill job. Index rows stay when a message moves to the archive, so
+archived messages are found as well.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import distinct, func, insert, select
+
+from app.db import models
+
+logger = logging.getLogger(__name__)
+
+SEARCH_KEY_FILE = os.getenv("SEARCH_INDEX_KEY_FILE", "search.key")
+
+# Setting keys: {"enabled": bool} and backfill progress
+SEARCH_SETTING = "chat_search"
+BACKFILL_PROGRESS = "chat_search_backfill"
+
+MIN_TOKEN_LENGTH = 2
+MAX_TOKENS_PER_MESSAGE = 64
+MAX_QUERY_TOKENS = 8
+
+BACKFILL_BATCH_SIZE = int(os.getenv("SEARCH_BACKFILL_BATCH_SIZE", "500"))
+BACKFILL_PAUSE_SECONDS = float(os.getenv("SEARCH_BACKFILL_PAUSE_SECONDS", "0.2"))
+# Message ids per IN (...) when deleting index rows by id
+DELETE_CHUNK_SIZE = 500
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str, limit: int = MAX_TOKENS_PER_MESSAGE) -> List[str]:
+    """Unique, case-folded words in order of appearance."""
+    tokens: Dict[str, None] = {}
+    for word in _WORD_RE.findall(text.casefold()):
+        if len(word) >= MIN_TOKEN_LENGTH:
+            tokens.setdefault(word, None)
+            if len(tokens) >= limit:
+                break
+    return list(tokens)
+
+
+class BlindIndex:
+    """HMAC-SHA256 token hashing with a key file (generated on first use)."""
+
+    def __init__(self, key_file: str = SEARCH_KEY_FILE):
+        self.key_file = key_file
+        self._key: Optional[bytes] = None
+        self._lock = threading.Lock()
+
+    def _load_key(self) -> bytes:
+        with self._lock:
+            if self._key is None:
+                try:
+                    if not os.path.exists(self.key_file):
+                        with open(self.key_file, "w") as key_file:
+                            key_file.write(secrets.token_hex(32))
+                    with open(self.key_file) as key_file:
+                        self._key = bytes.fromhex(key_file.read().strip())
+                except Exception as e:
+                    # An ephemeral key keeps search working until restart (index must be rebuilt)
+                    logger.error(f"Could not load search index key file: {e}")
+                    self._key = secrets.token_bytes(32)
+            return self._key
+
+    def token_hash(self, token: str) -> str:
+        digest = hmac.new(self._load_key(), token.encode(), hashlib.sha256)
+        return digest.hexdigest()[:32]
+
+    def rows_for(self, message_id: int, sender_id: int, receiver_id: int, content: str) -> List[dict]:
+        hashes = [self.token_hash(t) for t in tokenize(content)]
+        return [
+            {"message_id": message_id, "user_id": user_id, "token_hash": h}
+            for user_id in {sender_id, receiver_id}
+            for h in hashes
+        ]
+
+
+blind_index = BlindIndex()
+
+
+def is_search_enabled(db) -> bool:
+    from app.services.utils import get_setting
+
+    return bool(get_setting(db, SEARCH_SETTING, {}).get("enabled", False))
+
+
+def index_message(db, message_id: int, sender_id: int, receiver_id: int, content: str):
+    """Add index rows for a new message. Committed together with the message by the caller."""
+    rows = blind_index.rows_for(message_id, sender_id, receiver_id, content)
+    if rows:
+        db.execute(insert(models.MessageSearchToken), rows)
+
+
+def search_message_ids(db, user_id: int, query: str, limit: int = 50) -> List[int]:
+    """IDs of the user's messages containing all query words (newest first)."""
+    hashes = [blind_index.token_hash(t) for t in tokenize(query, MAX_QUERY_TOKENS)]
+    if not hashes:
+        return []
+
+    token = models.MessageSearchToken
+    rows = (
+        db.query(token.message_id)
+        .filter(token.user_id == user_id, token.token_hash.in_(hashes))
+        .group_by(token.message_id)
+        .having(func.count(distinct(token.token_hash)) == len(hashes))
+        .order_by(token.message_id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [row.message_id for row in rows]
+
+
+# --- Backfill Job ---
+
+
+def _default_progress() -> dict:
+    return {
+        "status": "idle",  # idle, running, paused, completed, failed
+        "phase": "messages",  # messages, archives
+        "last_id": 0,
+        "archive_last_id": 0,
+        "processed": 0,
+        "failed": 0,
+        "total": 0,
+        "started_at": None,
+        "finished_at": None,
+        "error": None,
+    }
+
+
+def get_backfill_status(db) -> dict:
+    from app.services.utils import get_job_progress
+
+    progress = _default_progress()
+    progress.update(get_job_progress(db, BACKFILL_PROGRESS))
+    return progress
+
+
+class SearchIndexBackfill:
+    """
+    Indexes existing messages in primary key order, in small batches with a
+    pause in between, then the archived ones. Progress is committed per
+    batch, so the job resumes after a pause or restart. Batches are
+    idempotent (rows are replaced).
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, restart: bool = False) -> bool:
+        with self._lock:
+            if self.is_running:
+                return False
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self.run,
+                kwargs={"restart": restart},
+                name="search-index-backfill",
+                daemon=True,
+            )
+            self._thread.start()
+            return True
+
+    def pause(self, wait: float = 0):
+        """Stop after the current batch; optionally wait up to `wait` seconds for it."""
+        self._stop_event.set()
+        if wait and self._thread is not None:
+            self._thread.join(timeout=wait)
+
+    def run(
+        self,
+        restart: bool = False,
+        batch_size: int = BACKFILL_BATCH_SIZE,
+        pause_seconds: float = BACKFILL_PAUSE_SECONDS,
+    ):
+        from app.api.routers.chat import decrypt_message
+        from app.core.database import SessionLocal
+        from app.services.utils import save_job_progress
+
+        db = SessionLocal()
+        try:
+            progress = get_backfill_status(db)
+            if restart or progress["status"] == "completed":
+                progress = _default_progress()
+                progress["started_at"] = datetime.utcnow().isoformat()
+
+            progress["status"] = "running"
+            progress["total"] = db.query(models.Message).count() + (
+                db.query(func.coalesce(func.sum(models.MessageArchive.message_count), 0)).scalar()
+            )
+            save_job_progress(db, BACKFILL_PROGRESS, progress)
+
+            while not self._stop_event.is_set():
+                # Second phase: compressed archive rows (see services/message_archive.py)
+                if progress["phase"] == "archives":
+                    if not self._index_archives(db, progress, batch_size):
+                        progress["status"] = "completed"
+                        progress["finished_at"] = datetime.utcnow().isoformat()
+                        break
+                    save_job_progress(db, BACKFILL_PROGRESS, progress)
+                    time.sleep(pause_seconds)
+                    continue
+
+                batch = (
+                    db.query(
+                        models.Message.id,
+                        models.Message.sender_id,
+                        models.Message.receiver_id,
+                        models.Message.content,
+                    )
+                    .filter(models.Message.id > progress["last_id"])
+                    .order_by(models.Message.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not batch:
+                    progress["phase"] = "archives"
+                    continue
+
+                rows = []
+                for msg_id, sender_id, receiver_id, content in batch:
+                    plaintext = decrypt_message(content)
+                    if plaintext == "[Decryption Error]":
+                        progress["failed"] += 1
+                        continue
+                    rows.extend(blind_index.rows_for(msg_id, sender_id, receiver_id, plaintext))
+
+                ids = [row[0] for row in batch]
+                db.query(models.MessageSearchToken).filter(
+                    models.MessageSearchToken.message_id.in_(ids)
+                ).delete(synchronize_session=False)
+                if rows:
+                    db.execute(insert(models.MessageSearchToken), rows)
+                progress["last_id"] = ids[-1]
+                progress["processed"] += len(batch)
+                # Progress is committed together with the batch
+                save_job_progress(db, BACKFILL_PROGRESS, progress)
+
+                time.sleep(pause_seconds)
+            else:
+                progress["status"] = "paused"
+
+            save_job_progress(db, BACKFILL_PROGRESS, progress)
+            logger.info(
+                f"Search index backfill {progress['status']}: "
+                f"{progress['processed']} processed, {progress['failed']} failed"
+            )
+        except Exception as e:
+            logger.error(f"Search index backfill failed: {e}")
+            db.rollback()
+            try:
+                progress = get_backfill_status(db)
+                progress["status"] = "failed"
+                progress["error"] = str(e)
+                save_job_progress(db, BACKFILL_PROGRESS, progress)
+            except Exception:
+                pass
+        finally:
+            db.close()
+
+    def _index_archives(self, db, progress: dict, batch_size: int) -> int:
+        """Indexes the messages of the next archive rows. Returns how many rows were read."""
+        from app.api.routers.chat import decrypt_message
+        from app.services.message_archive import unpack_messages
+
+        # One archive row holds a whole conversation month: use smaller batches
+        archives = (
+            db.query(models.MessageArchive.id, models.MessageArchive.payload)
+            .filter(models.MessageArchive.id > progress["archive_last_id"])
+            .order_by(models.MessageArchive.id)
+            .limit(max(batch_size // 50, 1))
+            .all()
+        )
+        for archive_id, payload in archives:
+            messages = unpack_messages(payload)
+            rows = []
+            for m in messages:
+                plaintext = decrypt_message(m["content"])
+                if plaintext == "[Decryption Error]":
+                    progress["failed"] += 1
+                    continue
+                rows.extend(
+                    blind_index.rows_for(m["id"], m["sender_id"], m["receiver_id"], plaintext)
+                )
+            delete_tokens_for_ids(db, [m["id"] for m in messages])
+            if rows:
+                db.execute(insert(models.MessageSearchToken), rows)
+            progress["processed"] += len(messages)
+
+        if archives:
+            progress["archive_last_id"] = archives[-1][0]
+        return len(archives)
+
+    def resume_if_pending(self, db):
+        """Resume a backfill that was interrupted by a restart."""
+        if get_backfill_status(db)["status"] == "running":
+            logger.info("Resuming interrupted search index backfill.")
+            self.start()
+
+
+search_backfill = SearchIndexBackfill()
+
+
+def delete_message_tokens(db, message_filter):
+    """
+    Remove the index rows of the messages matching `message_filter`; call it
+    before bulk-deleting those messages (commit is up to the caller). Index
+    rows are not tied to messages by a foreign key, and orphaned rows would
+    match a message that later reuses the id.
+    """
+    message_ids = select(models.Message.id).where(message_filter)
+    db.query(models.MessageSearchToken).filter(
+        models.MessageSearchToken.message_id.in_(message_ids)
+    ).delete(synchronize_session=False)
+
+
+def delete_tokens_for_ids(db, message_ids: List[int]):
+    """Remove the index rows of the given (e.g. archived) message ids."""
+    for start in range(0, len(message_ids), DELETE_CHUNK_SIZE):
+        db.query(models.MessageSearchToken).filter(
+            models.MessageSearchToken.message_id.in_(
+                message_ids[start : start + DELETE_CHUNK_SIZE]
+            )
+        ).delete(synchronize_session=False)
+
+
+def clear_search_index(db) -> int:
+    """Drop all index rows (used when search is disabled again)."""
+    from app.services.utils import save_job_progress
+
+    removed = db.query(models.MessageSearchToken).delete(synchronize_session=False)
+    save_job_progress(db, BACKFILL_PROGRESS, _default_progress())
+    return removed
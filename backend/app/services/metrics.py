@@ -0,0 +1,83 @@
+"""
+Metrics
+Small in-process registry for latency samples and counters of hot paths
+(password hashing, CAPTCHA providers, ...). Admins read it via
+GET /admin/metrics. Values are per worker and reset on restart.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict
+
+# Recent samples kept per metric for percentiles
+SAMPLE_SIZE = 1000
+
+
+class LatencyStats:
+    def __init__(self, sample_size: int = SAMPLE_SIZE):
+        self.samples: Deque[float] = deque(maxlen=sample_size)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.samples)
+
+        def pct(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(pct(50) * 1000, 2),
+            "p95_ms": round(pct(95) * 1000, 2),
+            "p99_ms": round(pct(99) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._latencies: Dict[str, LatencyStats] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(name, LatencyStats()).observe(seconds)
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "latency": {name: s.snapshot() for name, s in sorted(self._latencies.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._latencies.clear()
+            self._counters.clear()
+
+
+metrics = MetricsRegistry()
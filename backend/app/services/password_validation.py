@@ -1,11 +1,27 @@
 import hashlib
 import logging
+import os
 import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
 
 import httpx
+from app.services.http_client import get_http_client
+from app.services.metrics import metrics
+from app.services.pwned_filter import get_pwned_filter
 
 logger = logging.getLogger(__name__)
 
+HIBP_RANGE_URL = "https://api.pwnedpasswords.com/range/{prefix}"
+HIBP_HEADERS = {"User-Agent": "Solumati-Password-Check"}
+# Short timeout to fail open if the API is slow
+HIBP_TIMEOUT = httpx.Timeout(3.0, connect=1.5)
+# A range response is ~30 KB, so 1024 entries stay around 30 MB
+HIBP_RANGE_CACHE_SIZE = int(os.getenv("HIBP_RANGE_CACHE_SIZE", "1024"))
+HIBP_RANGE_CACHE_TTL_SECONDS = float(os.getenv("HIBP_RANGE_CACHE_TTL_SECONDS", "3600"))
+
 
 def validate_password_complexity(password: str) -> None:
     """
@@ -32,41 +48,105 @@ def validate_password_complexity(password: str) -> None:
         raise ValueError("Password must contain at least one special character.")
 
 
-def check_pwned_password(password: str) -> None:
+class RangeCache:
+    """LRU of HIBP range responses (raw text) keyed by the 5 character hash prefix."""
+
+    def __init__(
+        self, maxsize: int = HIBP_RANGE_CACHE_SIZE, ttl: float = HIBP_RANGE_CACHE_TTL_SECONDS
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, prefix: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[prefix]
+                return None
+            self._entries.move_to_end(prefix)
+            return entry[1]
+
+    def put(self, prefix: str, text: str):
+        with self._lock:
+            self._entries[prefix] = (time.monotonic() + self.ttl, text)
+            self._entries.move_to_end(prefix)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+range_cache = RangeCache()
+
+
+def _hash_parts(password: str) -> Tuple[str, str]:
+    sha1_password = hashlib.sha1(password.encode("utf-8")).hexdigest().upper()
+    return sha1_password[:5], sha1_password[5:]
+
+
+def _check_offline(password: str) -> bool:
+    """Check against the offline filter. False if none is configured."""
+    pwned_filter = get_pwned_filter()
+    if pwned_filter is None:
+        return False
+    if password in pwned_filter:
+        raise ValueError(
+            "This password has been exposed in a data breach. Please choose a different one."
+        )
+    return True
+
+
+def _check_range(range_text: str, suffix: str) -> None:
+    # Response format: SUFFIX:COUNT
+    hashes = (line.split(":") for line in range_text.splitlines())
+    for h, count in hashes:
+        if h == suffix:
+            raise ValueError(
+                f"This password has been exposed in a data breach (seen {count} times). Please choose a different one."
+            )
+
+
+async def check_pwned_password_async(password: str) -> None:
     """
     Checks if the password has been leaked using Have I Been Pwned API (k-anonymity).
     Do NOT send the full password. Only the first 5 chars of SHA-1 hash.
+    With an offline filter configured (PWNED_PASSWORDS_FILTER), no request is made.
+    Range responses are cached, and requests go through the shared pooled
+    AsyncClient, so no connection is opened per check and no worker thread blocks.
     """
-    try:
-        sha1_password = hashlib.sha1(password.encode("utf-8")).hexdigest().upper()
-        prefix = sha1_password[:5]
-        suffix = sha1_password[5:]
+    if _check_offline(password):
+        return
 
-        url = f"https://api.pwnedpasswords.com/range/{prefix}"
-        headers = {"User-Agent": "Solumati-Password-Check"}
-
-        # Use a short timeout to fail open if API is slow
-        with httpx.Client(timeout=3.0) as client:
-            response = client.get(url, headers=headers)
+    try:
+        prefix, suffix = _hash_parts(password)
+        range_text = range_cache.get(prefix)
+        if range_text is None:
+            with metrics.timer("hibp.range_request"):
+                response = await get_http_client().get(
+                    HIBP_RANGE_URL.format(prefix=prefix),
+                    headers=HIBP_HEADERS,
+                    timeout=HIBP_TIMEOUT,
+                )
 
-        if response.status_code != 200:
-            logger.warning(
-                f"HIBP API returned status {response.status_code}. Skipping leak check."
-            )
-            return
-
-        # Response format: SUFFIX:COUNT
-        hashes = (line.split(":") for line in response.text.splitlines())
-        for h, count in hashes:
-            if h == suffix:
-                raise ValueError(
-                    f"This password has been exposed in a data breach (seen {count} times). Please choose a different one."
+            if response.status_code != 200:
+                logger.warning(
+                    f"HIBP API returned status {response.status_code}. Skipping leak check."
                 )
+                return
+            range_text = response.text
+            range_cache.put(prefix, range_text)
+
+        _check_range(range_text, suffix)
 
     except httpx.RequestError as e:
         logger.warning(f"HIBP API Request failed: {e}. Skipping leak check.")
     except ValueError:
-        raise  # Re-raise security validation errors
+        raise
     except Exception as e:
         logger.error(f"Unexpected error in password leak check: {e}")
-        # Fail open: ensure user can still register if our check fails technically
@@ -0,0 +1,103 @@
+"""
+Presence Service
+Tracks who is online (driven by ConnectionManager connect/disconnect events)
+and when users were last seen. Changes are kept in memory and written to
+users.last_seen in periodic batches, never per event.
+"""
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from sqlalchemy import bindparam, update
+
+from app.db import models
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_FLUSH_INTERVAL_SECONDS = 60
+
+
+class PresenceTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._online: Set[int] = set()
+        # Newest known last-seen per user (also served to readers before the flush)
+        self._last_seen: Dict[int, datetime] = {}
+        # Users whose last-seen changed since the previous flush
+        self._dirty: Set[int] = set()
+
+    def set_online(self, user_id: int):
+        with self._lock:
+            self._online.add(user_id)
+            self._last_seen[user_id] = datetime.utcnow()
+            self._dirty.add(user_id)
+
+    def set_offline(self, user_id: int):
+        with self._lock:
+            self._online.discard(user_id)
+            self._last_seen[user_id] = datetime.utcnow()
+            self._dirty.add(user_id)
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self._online
+
+    def get_presence(self, user: models.User) -> dict:
+        """Presence of an already loaded user (no DB access)."""
+        last_seen = self._last_seen.get(user.id) or user.last_seen
+        return {
+            "online": self.is_online(user.id),
+            "last_seen": last_seen.isoformat() if last_seen else None,
+        }
+
+    def flush(self, db) -> int:
+        """Persist pending last-seen changes in one bulk update. Returns number of rows."""
+        now = datetime.utcnow()
+        with self._lock:
+            # Users that stay connected are still active: refresh them as well
+            for user_id in self._online:
+                self._last_seen[user_id] = now
+            pending = self._dirty | self._online
+            rows = [{"id": uid, "last_seen": self._last_seen[uid]} for uid in pending]
+            self._dirty = set()
+            # Offline users are persisted now, no need to keep them in memory
+            for uid in pending - self._online:
+                self._last_seen.pop(uid, None)
+
+        if not rows:
+            return 0
+        # Core executemany: ids deleted meanwhile (guest cleanup, account
+        # deletion) just match no row instead of failing the whole batch
+        users = models.User.__table__
+        stmt = (
+            update(users)
+            .where(users.c.id == bindparam("user_id"))
+            .values(last_seen=bindparam("seen"))
+        )
+        try:
+            db.execute(stmt, [{"user_id": r["id"], "seen": r["last_seen"]} for r in rows])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error flushing presence: {e}")
+            # Retry with the next flush
+            with self._lock:
+                for row in rows:
+                    self._last_seen.setdefault(row["id"], row["last_seen"])
+                    self._dirty.add(row["id"])
+            return 0
+        return len(rows)
+
+
+presence_tracker = PresenceTracker()
+
+
+def flush_presence():
+    """Scheduler job: write buffered presence changes to the DB."""
+    from app.core.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        presence_tracker.flush(db)
+    finally:
+        db.close()
@@ -0,0 +1,130 @@
+"""
+Pwned Passwords Filter
+Offline alternative to the HIBP range API: a Bloom filter over the SHA-1
+hashes of the "Have I Been Pwned" password list, memory-mapped from disk.
+A lookup reads k bits of the mapped file, so it takes microseconds and only
+the touched pages stay resident.
+
+A Bloom filter has no false negatives, but a small, configurable rate of
+false positives (default 1 in 1000): a very rare unbreached password is
+rejected as breached, and the user just picks another one.
+
+Build the file with app/scripts/build_pwned_filter.py. To use it, point
+PWNED_PASSWORDS_FILTER at the file.
+
+File layout: a 32 byte header (magic, format version, k, bit count, item
+count), followed by the bit array.
+"""
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+PWNED_PASSWORDS_FILTER = os.getenv("PWNED_PASSWORDS_FILTER", "")
+
+MAGIC = b"SLMBLOOM"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIQQ")
+HEADER_SIZE = HEADER.size  # 32
+
+
+def optimal_parameters(items: int, false_positive_rate: float):
+    """Bit count m and hash count k for `items` entries at the given rate."""
+    items = max(items, 1)
+    bits = math.ceil(-items * math.log(false_positive_rate) / (math.log(2) ** 2))
+    bits = max(8, (bits + 7) // 8 * 8)
+    hashes = max(1, round(bits / items * math.log(2)))
+    return bits, hashes
+
+
+def _positions(digest: bytes, hashes: int, bits: int):
+    # SHA-1 output is already uniform: derive k positions by double hashing
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:16], "little") | 1
+    for i in range(hashes):
+        yield (h1 + i * h2) % bits
+
+
+class PwnedFilter:
+    """Read-only view of a filter file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.hashes, self.bits, self.items = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a pwned passwords filter (v{FORMAT_VERSION})")
+        if len(self._mm) < HEADER_SIZE + self.bits // 8:
+            self._mm.close()
+            raise ValueError(f"{path} is truncated")
+
+    def contains_digest(self, digest: bytes) -> bool:
+        mm = self._mm
+        for pos in _positions(digest, self.hashes, self.bits):
+            if not mm[HEADER_SIZE + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __contains__(self, password: str) -> bool:
+        return self.contains_digest(hashlib.sha1(password.encode("utf-8")).digest())
+
+    def close(self):
+        self._mm.close()
+
+
+def build_filter(
+    path: str,
+    digests: Iterable[bytes],
+    items: int,
+    false_positive_rate: float = 0.001,
+) -> int:
+    """
+    Write a filter for up to `items` SHA-1 digests to `path`.
+    The bit array is filled through a writable mapping, so memory use stays
+    flat regardless of the filter size. Returns the number of digests added.
+    """
+    bits, hashes = optimal_parameters(items, false_positive_rate)
+    tmp_path = f"{path}.tmp"
+    added = 0
+    with open(tmp_path, "wb+") as f:
+        f.truncate(HEADER_SIZE + bits // 8)
+        with mmap.mmap(f.fileno(), 0) as mm:
+            for digest in digests:
+                for pos in _positions(digest, hashes, bits):
+                    mm[HEADER_SIZE + (pos >> 3)] |= 1 << (pos & 7)
+                added += 1
+            HEADER.pack_into(mm, 0, MAGIC, FORMAT_VERSION, hashes, bits, added)
+            mm.flush()
+    os.replace(tmp_path, path)
+    return added
+
+
+_filter: Optional[PwnedFilter] = None
+_filter_failed = False
+_filter_lock = threading.Lock()
+
+
+def get_pwned_filter() -> Optional[PwnedFilter]:
+    """The configured filter, opened once per process (None if not configured)."""
+    global _filter, _filter_failed
+    if _filter is not None or _filter_failed or not PWNED_PASSWORDS_FILTER:
+        return _filter
+    with _filter_lock:
+        if _filter is None and not _filter_failed:
+            try:
+                _filter = PwnedFilter(PWNED_PASSWORDS_FILTER)
+                logger.info(
+                    f"Pwned passwords filter loaded: {_filter.items} hashes from {PWNED_PASSWORDS_FILTER}"
+                )
+            except (OSError, ValueError) as e:
+                _filter_failed = True
+                logger.error(f"Cannot open pwned passwords filter, using the HIBP API: {e}")
+    return _filter
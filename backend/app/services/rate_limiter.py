@@ -1,76 +1,340 @@
 """
 Rate limiter for tracking failed login attempts per IP.
-Uses in-memory storage with automatic cleanup.
+
+Attempts are counted in a sliding window: the counts of the current and the
+previous fixed window, the latter weighted by how much of it still overlaps.
+Counts therefore decay on their own instead of waiting for a cleanup sweep.
+
+Storage is pluggable (RATE_LIMIT_BACKEND):
+- memory: per process, lock-striped. Entries expire through a timing wheel,
+  so expiry costs O(1) per entry and never scans or locks the whole table.
+  The first access in a new wheel slot sweeps the due slots of every stripe
+  (one stripe lock at a time), so stripes nobody touches still get emptied.
+- database: rows in rate_limit_entries, so limits hold across all workers
+  sharing the database.
+
+Also provides a small token bucket for throttling message streams.
 """
 
 import logging
+import os
 import threading
 import time
-from dataclasses import dataclass
-from typing import Dict, Tuple
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from app.db import models
+from sqlalchemy.exc import IntegrityError
 
 logger = logging.getLogger(__name__)
 
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+# Failed attempts older than this no longer count
+RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "3600"))
+RATE_LIMIT_STRIPES = 16
+# Timing wheel slot width (memory) / minimum gap between purges (database)
+EXPIRY_RESOLUTION_SECONDS = 60
+
+
+def _window_start(now: float, window: int) -> float:
+    return float(int(now // window) * window)
+
+
+def _roll(start: float, current: float, previous: float, now: float, window: int):
+    """Shift the counters to the fixed window containing `now`."""
+    new_start = _window_start(now, window)
+    if new_start == start:
+        return start, current, previous
+    if new_start - start == window:
+        return new_start, 0.0, current
+    return new_start, 0.0, 0.0
+
+
+def _estimate(start: float, current: float, previous: float, now: float, window: int):
+    overlap = max(1.0 - (now - start) / window, 0.0)
+    return current + previous * overlap
+
 
 @dataclass
-class AttemptRecord:
-    count: int = 0
-    first_attempt: float = 0
-    last_attempt: float = 0
+class WindowEntry:
+    window_start: float = 0
+    current: float = 0
+    previous: float = 0
     locked_until: float = 0
+    expires_at: float = 0
+    slot: Optional[int] = None
 
 
-class RateLimiter:
-    """Thread-safe rate limiter for login attempts."""
-
+class _Stripe:
     def __init__(self):
-        self._attempts: Dict[str, AttemptRecord] = {}
-        self._lock = threading.Lock()
-        self._cleanup_interval = 300  # Cleanup every 5 minutes
-        self._last_cleanup = time.time()
-
-    def _cleanup_old_entries(self, max_age: int = 3600):
-        """Remove entries older than max_age seconds."""
-        now = time.time()
-        if now - self._last_cleanup < self._cleanup_interval:
+        self.entries: Dict[str, WindowEntry] = {}
+        # Timing wheel: slot number -> keys expiring in that slot
+        self.wheel: Dict[int, Set[str]] = {}
+        self.cursor: Optional[int] = None
+        self.lock = threading.Lock()
+
+
+class MemoryRateLimitBackend:
+    """Per-process sliding-window counters, striped over several locks."""
+
+    # Calls never block on I/O (safe to use on the event loop)
+    blocking = False
+
+    def __init__(
+        self,
+        stripes: int = RATE_LIMIT_STRIPES,
+        resolution: int = EXPIRY_RESOLUTION_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self.resolution = resolution
+        self.clock = clock
+        # Last wheel slot swept across all stripes
+        self._swept_slot = -1
+        self._sweep_lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def _stripe(self, key: str) -> _Stripe:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def _expire(self, stripe: _Stripe, now: float):
+        """Drop the keys of all wheel slots that have passed (stripe lock held)."""
+        now_slot = int(now // self.resolution)
+        if stripe.cursor is None:
+            stripe.cursor = now_slot
+        if stripe.cursor > now_slot:
+            return
+        if now_slot - stripe.cursor <= len(stripe.wheel):
+            slots = range(stripe.cursor, now_slot + 1)
+        else:  # Long idle gap: only visit the occupied slots
+            slots = sorted(slot for slot in stripe.wheel if slot <= now_slot)
+        for slot in slots:
+            for key in stripe.wheel.pop(slot, ()):
+                del stripe.entries[key]
+        stripe.cursor = now_slot + 1
+
+    def _sweep(self, now: float):
+        """Once per slot: expire the due slots of every stripe (no stripe lock held)."""
+        now_slot = int(now // self.resolution)
+        if now_slot <= self._swept_slot:
+            return
+        # Another thread is already sweeping this slot
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            if now_slot <= self._swept_slot:
+                return
+            self._swept_slot = now_slot
+            for stripe in self._stripes:
+                with stripe.lock:
+                    self._expire(stripe, now)
+        finally:
+            self._sweep_lock.release()
+
+    def _schedule(self, stripe: _Stripe, key: str, entry: WindowEntry, window: int):
+        entry.expires_at = max(entry.locked_until, entry.window_start + 2 * window)
+        slot = max(int(entry.expires_at // self.resolution) + 1, stripe.cursor or 0)
+        if slot == entry.slot:
+            return
+        if entry.slot is not None:
+            stripe.wheel.get(entry.slot, set()).discard(key)
+        stripe.wheel.setdefault(slot, set()).add(key)
+        entry.slot = slot
+
+    def _entry(self, stripe: _Stripe, key: str, now: float, window: int) -> WindowEntry:
+        entry = stripe.entries.get(key)
+        if entry is None:
+            entry = stripe.entries[key] = WindowEntry(window_start=_window_start(now, window))
+        else:
+            entry.window_start, entry.current, entry.previous = _roll(
+                entry.window_start, entry.current, entry.previous, now, window
+            )
+        return entry
+
+    def hit(self, key: str, window: int, cost: float = 1) -> Tuple[float, float]:
+        """Add `cost` to the key. Returns (count, locked_until)."""
+        stripe = self._stripe(key)
+        now = self.clock()
+        self._sweep(now)
+        with stripe.lock:
+            self._expire(stripe, now)
+            entry = self._entry(stripe, key, now, window)
+            entry.current += cost
+            self._schedule(stripe, key, entry, window)
+            return (
+                _estimate(entry.window_start, entry.current, entry.previous, now, window),
+                entry.locked_until,
+            )
+
+    def peek(self, key: str, window: int) -> Tuple[float, float]:
+        stripe = self._stripe(key)
+        now = self.clock()
+        self._sweep(now)
+        with stripe.lock:
+            self._expire(stripe, now)
+            entry = stripe.entries.get(key)
+            if entry is None:
+                return (0.0, 0.0)
+            entry.window_start, entry.current, entry.previous = _roll(
+                entry.window_start, entry.current, entry.previous, now, window
+            )
+            return (
+                _estimate(entry.window_start, entry.current, entry.previous, now, window),
+                entry.locked_until,
+            )
+
+    def lock(self, key: str, until: float, window: int):
+        stripe = self._stripe(key)
+        now = self.clock()
+        self._sweep(now)
+        with stripe.lock:
+            self._expire(stripe, now)
+            entry = self._entry(stripe, key, now, window)
+            entry.locked_until = until
+            self._schedule(stripe, key, entry, window)
+
+    def clear(self, key: str):
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.pop(key, None)
+            if entry is not None and entry.slot is not None:
+                stripe.wheel.get(entry.slot, set()).discard(key)
+
+
+class DatabaseRateLimitBackend:
+    """Sliding-window counters in the rate_limit_entries table, shared by all workers."""
+
+    blocking = True
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable] = None,
+        clock: Callable[[], float] = time.time,
+        purge_interval: int = EXPIRY_RESOLUTION_SECONDS,
+    ):
+        self._session_factory = session_factory
+        self.clock = clock
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    def _session(self):
+        if self._session_factory is not None:
+            return self._session_factory()
+        from app.core import database
+
+        return database.SessionLocal()
+
+    def _purge(self, db, now: float):
+        """Delete expired rows (an index range scan), at most once per interval."""
+        if now - self._last_purge < self.purge_interval:
             return
+        self._last_purge = now
+        db.query(models.RateLimitEntry).filter(
+            models.RateLimitEntry.expires_at < now
+        ).delete(synchronize_session=False)
 
-        with self._lock:
-            expired_ips = [
-                ip
-                for ip, record in self._attempts.items()
-                if now - record.last_attempt > max_age
-            ]
-            for ip in expired_ips:
-                del self._attempts[ip]
-            self._last_cleanup = now
-            if expired_ips:
-                logger.debug(
-                    f"Rate limiter cleanup: removed {len(expired_ips)} old entries"
+    def _update(self, key: str, window: int, apply: Callable, create: bool = True):
+        now = self.clock()
+        for attempt in range(2):
+            db = self._session()
+            try:
+                self._purge(db, now)
+                row = (
+                    db.query(models.RateLimitEntry)
+                    .filter(models.RateLimitEntry.key == key)
+                    .with_for_update()
+                    .first()
+                )
+                if row is None:
+                    if not create:
+                        db.commit()
+                        return (0.0, 0.0)
+                    row = models.RateLimitEntry(
+                        key=key,
+                        window_start=_window_start(now, window),
+                        current_count=0,
+                        previous_count=0,
+                        locked_until=0,
+                    )
+                    db.add(row)
+                else:
+                    row.window_start, row.current_count, row.previous_count = _roll(
+                        row.window_start, row.current_count, row.previous_count, now, window
+                    )
+                apply(row)
+                row.expires_at = max(row.locked_until, row.window_start + 2 * window)
+                result = (
+                    _estimate(
+                        row.window_start, row.current_count, row.previous_count, now, window
+                    ),
+                    row.locked_until,
                 )
+                db.commit()
+                return result
+            except IntegrityError:
+                # Another worker inserted the same key first: retry as an update
+                db.rollback()
+                if attempt:
+                    raise
+            finally:
+                db.close()
+
+    def hit(self, key: str, window: int, cost: float = 1) -> Tuple[float, float]:
+        def apply(row):
+            row.current_count += cost
+
+        return self._update(key, window, apply)
+
+    def peek(self, key: str, window: int) -> Tuple[float, float]:
+        return self._update(key, window, lambda row: None, create=False)
+
+    def lock(self, key: str, until: float, window: int):
+        def apply(row):
+            row.locked_until = until
+
+        self._update(key, window, apply)
+
+    def clear(self, key: str):
+        db = self._session()
+        try:
+            db.query(models.RateLimitEntry).filter(
+                models.RateLimitEntry.key == key
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+def create_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "database":
+        return DatabaseRateLimitBackend()
+    if name != "memory":
+        logger.warning(f"Unknown RATE_LIMIT_BACKEND '{name}', using memory")
+    return MemoryRateLimitBackend()
+
+
+class RateLimiter:
+    """Failed login attempts per IP, counted in a sliding window."""
+
+    def __init__(self, backend=None, window_seconds: int = RATE_LIMIT_WINDOW_SECONDS):
+        self.backend = backend if backend is not None else create_backend()
+        self.window = window_seconds
+
+    @staticmethod
+    def _key(ip: str) -> str:
+        return f"login:{ip}"
 
     def record_failed_attempt(self, ip: str) -> int:
         """
         Record a failed login attempt for an IP.
         Returns the new attempt count.
         """
-        self._cleanup_old_entries()
-        now = time.time()
-
-        with self._lock:
-            if ip not in self._attempts:
-                self._attempts[ip] = AttemptRecord(
-                    count=1, first_attempt=now, last_attempt=now
-                )
-            else:
-                record = self._attempts[ip]
-                record.count += 1
-                record.last_attempt = now
-
-            logger.info(
-                f"Failed login attempt from {ip}: count={self._attempts[ip].count}"
-            )
-            return self._attempts[ip].count
+        count, _ = self.backend.hit(self._key(ip), self.window)
+        count = int(round(count))
+        logger.info(f"Failed login attempt from {ip}: count={count}")
+        return count
 
     def check_rate_limit(
         self, ip: str, threshold: int = 5, lockout_minutes: int = 10
@@ -81,45 +345,70 @@ class RateLimiter:
         Returns:
             (is_blocked, attempt_count, seconds_remaining)
         """
-        self._cleanup_old_entries()
-        now = time.time()
-
-        with self._lock:
-            if ip not in self._attempts:
-                return (False, 0, 0)
-
-            record = self._attempts[ip]
-
-            # Check if currently locked
-            if record.locked_until > now:
-                remaining = int(record.locked_until - now)
-                return (True, record.count, remaining)
-
-            # Check if should be locked (after threshold)
-            if record.count >= threshold:
-                # Lock the IP
-                record.locked_until = now + (lockout_minutes * 60)
-                remaining = lockout_minutes * 60
-                logger.warning(
-                    f"IP {ip} locked for {lockout_minutes} minutes after {record.count} failed attempts"
-                )
-                return (True, record.count, remaining)
+        count, locked_until = self.backend.peek(self._key(ip), self.window)
+        count = int(round(count))
+        now = self.backend.clock()
+
+        # Check if currently locked
+        if locked_until > now:
+            return (True, count, int(locked_until - now))
+
+        # Check if should be locked (after threshold)
+        if count >= threshold:
+            self.backend.lock(self._key(ip), now + lockout_minutes * 60, self.window)
+            logger.warning(
+                f"IP {ip} locked for {lockout_minutes} minutes after {count} failed attempts"
+            )
+            return (True, count, lockout_minutes * 60)
 
-            return (False, record.count, 0)
+        return (False, count, 0)
 
     def clear_attempts(self, ip: str):
         """Clear failed attempts for an IP (on successful login)."""
-        with self._lock:
-            if ip in self._attempts:
-                del self._attempts[ip]
-                logger.debug(f"Cleared rate limit for IP {ip}")
+        self.backend.clear(self._key(ip))
+        logger.debug(f"Cleared rate limit for IP {ip}")
 
     def get_attempt_count(self, ip: str) -> int:
         """Get current attempt count for an IP."""
-        with self._lock:
-            if ip in self._attempts:
-                return self._attempts[ip].count
-            return 0
+        count, _ = self.backend.peek(self._key(ip), self.window)
+        return int(round(count))
+
+
+@dataclass
+class TokenBucket:
+    """
+    Classic token bucket: `capacity` tokens allow short bursts, which refill
+    at `rate` tokens per second. Not thread-safe (meant for one event loop).
+    """
+
+    rate: float
+    capacity: float
+    tokens: Optional[float] = None
+    updated: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        if self.tokens is None:
+            self.tokens = self.capacity
+
+    def _refill(self, now: float):
+        elapsed = max(now - self.updated, 0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def consume(self, cost: float = 1.0) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def retry_after(self, cost: float = 1.0) -> float:
+        """Seconds until `cost` tokens are available."""
+        self._refill(time.monotonic())
+        missing = cost - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
 
 
 # Global rate limiter instance
@@ -4,6 +4,10 @@ import logging
 from app.core.config import PROJECT_NAME
 from app.core.database import SessionLocal
 from app.db import models
+from app.services.message_archive import run_message_archival
+from app.services.message_search import delete_message_tokens
+from app.services.presence import (PRESENCE_FLUSH_INTERVAL_SECONDS,
+                                   flush_presence)
 from app.services.utils import (create_html_email, get_setting,
                                 get_user_email_preferences, send_mail_sync)
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -32,6 +36,23 @@ def start_scheduler():
         cleanup_guest_data, 'interval', hours=1, id="guest_cleanup", replace_existing=True
     )
 
+    # Move old messages to the compressed archive (no-op unless enabled)
+    scheduler.add_job(
+        run_message_archival,
+        CronTrigger(hour=3, minute=30),
+        id="message_archival",
+        replace_existing=True,
+    )
+
+    # Buffered online/last-seen changes are written in batches
+    scheduler.add_job(
+        flush_presence,
+        'interval',
+        seconds=PRESENCE_FLUSH_INTERVAL_SECONDS,
+        id="presence_flush",
+        replace_existing=True,
+    )
+
     scheduler.start()
     logger.info("Scheduler started with daily summary job at 08:00.")
 
@@ -152,9 +173,11 @@ def cleanup_guest_data():
         ).count()
 
         if msg_count > 0:
-            db.query(models.Message).filter(
-                or_(models.Message.sender_id == guest_id, models.Message.receiver_id == guest_id)
-            ).delete(synchronize_session=False)
+            guest_messages = or_(
+                models.Message.sender_id == guest_id, models.Message.receiver_id == guest_id
+            )
+            delete_message_tokens(db, guest_messages)
+            db.query(models.Message).filter(guest_messages).delete(synchronize_session=False)
             logger.info(f"Deleted {msg_count} guest messages.")
 
         # 2. Reset Guest Profile Data (Optional, ensuring clean slate)
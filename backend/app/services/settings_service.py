@@ -1,23 +1,22 @@
 """
 Settings Service
-Centralized, typed access to system settings with caching.
+Centralized, typed access to system settings.
+Reads go through the shared, versioned settings cache in services/utils.py.
 """
-import json
 import logging
 from typing import Any, Dict, Optional, Type, TypeVar
 
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
-from app.db import models, schemas
+from app.db import schemas
+from app.services.utils import (SettingsSnapshot, get_setting, save_setting,
+                                settings_cache)
 
 logger = logging.getLogger(__name__)
 
 T = TypeVar("T", bound=BaseModel)
 
-# In-memory cache for settings (simple implementation)
-_settings_cache: Dict[str, Dict[str, Any]] = {}
-
 
 class SettingsService:
     """
@@ -36,29 +35,15 @@ class SettingsService:
             default: Default value if setting doesn't exist
 
         Returns:
-            Setting value as dictionary
+            Setting value as dictionary (a copy, safe to modify)
         """
-        # Check cache first
-        if key in _settings_cache:
-            return _settings_cache[key]
-
-        try:
-            record = db.query(models.SystemSetting).filter(models.SystemSetting.key == key).first()
-            if record:
-                value = json.loads(record.value) if isinstance(record.value, str) else record.value
-                _settings_cache[key] = value
-                return value
-        except Exception as e:
-            logger.error(f"Error loading setting '{key}': {e}")
-
-        # Return default as dict
         if default is None:
-            return {}
-        if isinstance(default, BaseModel):
-            return default.model_dump()
-        if isinstance(default, dict):
-            return default
-        return {}
+            default = {}
+        elif isinstance(default, BaseModel):
+            default = default.model_dump()
+        elif not isinstance(default, dict):
+            default = {}
+        return get_setting(db, key, default)
 
     @staticmethod
     def get_typed(db: Session, key: str, schema: Type[T]) -> T:
@@ -89,39 +74,17 @@ class SettingsService:
         Returns:
             True if successful
         """
-        try:
-            record = db.query(models.SystemSetting).filter(models.SystemSetting.key == key).first()
-            value_json = json.dumps(value)
-
-            if record:
-                record.value = value_json
-            else:
-                record = models.SystemSetting(key=key, value=value_json)
-                db.add(record)
-
-            db.commit()
-
-            # Update cache
-            _settings_cache[key] = value
-            return True
-
-        except Exception as e:
-            logger.error(f"Error saving setting '{key}': {e}")
-            db.rollback()
-            return False
+        return save_setting(db, key, value)
 
     @staticmethod
     def invalidate_cache(key: Optional[str] = None) -> None:
         """
-        Invalidate settings cache.
+        Invalidate the local settings cache.
 
         Args:
-            key: Specific key to invalidate, or None for all
+            key: Ignored, all keys are dropped
         """
-        if key:
-            _settings_cache.pop(key, None)
-        else:
-            _settings_cache.clear()
+        settings_cache.invalidate()
 
     # --- Convenience Methods for Common Settings ---
 
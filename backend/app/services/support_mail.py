@@ -0,0 +1,108 @@
+"""
+Support Mail Forwarding
+Forwards support chat messages to the configured support inbox without
+blocking the event loop. Messages of one user are coalesced into a single
+digest email per time window; SMTP delivery runs on a dedicated worker thread.
+"""
+import asyncio
+import html
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from app.services.utils import create_html_email, send_mail_sync
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIGEST_WINDOW_SECONDS = 60
+
+
+class SupportMailForwarder:
+    def __init__(self):
+        # user_id -> pending digest {"username", "target", "messages": [(timestamp, content)]}
+        self._pending: Dict[int, dict] = {}
+        self._timers: Dict[int, asyncio.Task] = {}
+        # One SMTP worker: deliveries are queued instead of competing for the shared threadpool
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="support-mail")
+
+    def enqueue(
+        self,
+        user_id: int,
+        username: str,
+        content: str,
+        target_email: str,
+        window_seconds: int = DEFAULT_DIGEST_WINDOW_SECONDS,
+    ):
+        """Queue a support message. The first message of a burst opens the digest window."""
+        entry = self._pending.setdefault(
+            user_id, {"username": username, "target": target_email, "messages": []}
+        )
+        entry["target"] = target_email
+        entry["messages"].append((datetime.utcnow(), content))
+
+        if user_id not in self._timers:
+            self._timers[user_id] = asyncio.create_task(
+                self._flush_later(user_id, max(window_seconds, 0))
+            )
+
+    async def _flush_later(self, user_id: int, delay: float):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+        await self.flush(user_id)
+
+    async def flush(self, user_id: int):
+        self._timers.pop(user_id, None)
+        entry = self._pending.pop(user_id, None)
+        if not entry:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._deliver, user_id, entry)
+        except Exception as e:
+            logger.error(f"Error forwarding support email: {e}")
+
+    async def flush_all(self):
+        """Deliver all pending digests immediately (e.g. on shutdown)."""
+        for task in list(self._timers.values()):
+            task.cancel()
+        for user_id in list(self._pending.keys()):
+            await self.flush(user_id)
+
+    @staticmethod
+    def build_digest(user_id: int, entry: dict) -> Tuple[str, str]:
+        username = html.escape(entry["username"])
+        messages: List[Tuple[datetime, str]] = entry["messages"]
+
+        items = "".join(
+            f"<p><b>{ts.strftime('%H:%M:%S')} UTC</b><br>{html.escape(content)}</p>"
+            for ts, content in messages
+        )
+        count = len(messages)
+        subject = f"Support Request: {entry['username']}"
+        if count > 1:
+            subject += f" ({count} messages)"
+
+        content = f"<p><b>User:</b> {username} (ID: {user_id})</p>{items}"
+        return subject, content
+
+    def _deliver(self, user_id: int, entry: dict):
+        # Runs on the worker thread with its own DB session
+        from app.core.database import SessionLocal
+
+        subject, content = self.build_digest(user_id, entry)
+        db = SessionLocal()
+        try:
+            html_body = create_html_email(
+                title=f"New Message from {html.escape(entry['username'])}",
+                content=content,
+                db=db,
+            )
+            send_mail_sync(entry["target"], subject, html_body, db)
+        finally:
+            db.close()
+
+
+support_mail_forwarder = SupportMailForwarder()
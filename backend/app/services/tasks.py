@@ -2,6 +2,8 @@ import asyncio
 import logging
 from datetime import datetime, timedelta
 
+from starlette.concurrency import run_in_threadpool
+
 from app.core.database import SessionLocal
 from app.db import models
 
@@ -44,3 +46,35 @@ async def periodic_cleanup_task():
     while True:
         await cleanup_unverified_users()
         await asyncio.sleep(86400)  # Run daily
+
+
+def _load_websocket_config():
+    from app.db import schemas
+    from app.services.utils import get_setting
+
+    db = SessionLocal()
+    try:
+        return schemas.WebSocketConfig(
+            **get_setting(db, "websocket", schemas.WebSocketConfig().dict())
+        )
+    except Exception as e:
+        logger.error(f"Error loading WebSocket config: {e}")
+        return schemas.WebSocketConfig()
+    finally:
+        db.close()
+
+
+async def websocket_heartbeat_task():
+    """Pings chat connections and reaps idle or dead ones."""
+    from app.services.websocket_manager import manager
+
+    while True:
+        # Settings reads hit the DB (version check), keep them off the event loop
+        config = await run_in_threadpool(_load_websocket_config)
+        try:
+            reaped = await manager.heartbeat(config.idle_timeout_seconds)
+            if reaped:
+                logger.info(f"Reaped {reaped} idle WebSocket connections.")
+        except Exception as e:
+            logger.error(f"Error during WebSocket heartbeat: {e}")
+        await asyncio.sleep(max(config.ping_interval_seconds, 1))
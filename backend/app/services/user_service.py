@@ -3,7 +3,9 @@ from sqlalchemy.orm import Session
 from sqlalchemy import or_
 from app.db import models, schemas
 from app.services.base import BaseService
-from app.core.security import hash_password
+from app.services.identity_cache import identity_cache
+from app.services.message_archive import delete_user_archives
+from app.services.message_search import delete_message_tokens
 from app.services.utils import generate_unique_username
 from datetime import datetime
 import json
@@ -17,8 +19,8 @@ class UserService(BaseService[models.User]):
     def get_by_username(self, db: Session, username: str) -> Optional[models.User]:
         return db.query(self.model).filter(self.model.username == username).first()
 
-    def create_user(self, db: Session, user_in: schemas.UserCreate, is_verified: bool = False) -> models.User:
-        hashed_pw = hash_password(user_in.password)
+    def create_user(self, db: Session, user_in: schemas.UserCreate, hashed_password: str, is_verified: bool = False) -> models.User:
+        # The caller hashes user_in.password (awaiting the hashing pool)
         secure_code = secrets.token_urlsafe(32)
         verification_code = secure_code if not is_verified else None
 
@@ -33,7 +35,7 @@ class UserService(BaseService[models.User]):
 
         db_obj = models.User(
             email=user_in.email,
-            hashed_password=hashed_pw,
+            hashed_password=hashed_password,
             real_name=user_in.real_name,
             username=generate_unique_username(db, user_in.real_name),
             intent=user_in.intent,
@@ -53,8 +55,8 @@ class UserService(BaseService[models.User]):
         """
         Efficiently fetch candidates for matching.
         """
-        # Base filters
-        query = db.query(self.model).filter(
+        # Base filters (match card columns only)
+        query = db.query(self.model).options(*models.USER_MATCH_CARD).filter(
             self.model.id != user.id,
             self.model.is_active == True,
             self.model.role != "admin",
@@ -76,7 +78,7 @@ class UserService(BaseService[models.User]):
         return query.limit(100).all()
 
     def get_discover_candidates(self, db: Session, user: models.User, is_privileged: bool, limit: int = 50) -> List[models.User]:
-        query = db.query(self.model).filter(
+        query = db.query(self.model).options(*models.USER_DISPLAY).filter(
             self.model.id != user.id,
             self.model.is_active == True,
             self.model.role != "admin",
@@ -101,10 +103,11 @@ class UserService(BaseService[models.User]):
         We do this manually because we don't have database-level ON DELETE CASCADE for everything
         and we want to ensure complete cleanup.
         """
-        # 1. Delete Messages (Sent & Received)
-        db.query(models.Message).filter(
-            or_(models.Message.sender_id == user.id, models.Message.receiver_id == user.id)
-        ).delete(synchronize_session=False)
+        # 1. Delete Messages (Sent & Received) and their search index rows
+        user_messages = or_(models.Message.sender_id == user.id, models.Message.receiver_id == user.id)
+        delete_message_tokens(db, user_messages)
+        db.query(models.Message).filter(user_messages).delete(synchronize_session=False)
+        delete_user_archives(db, user.id)
 
         # 2. Delete Notifications
         db.query(models.Notification).filter(models.Notification.user_id == user.id).delete(synchronize_session=False)
@@ -115,7 +118,9 @@ class UserService(BaseService[models.User]):
         ).delete(synchronize_session=False)
 
         # 4. Delete User (LinkedAccounts handled by SQLAlchemy cascade)
+        user_id = user.id
         db.delete(user)
         db.commit()
+        identity_cache.invalidate(user_id)
 
 user_service = UserService(models.User)
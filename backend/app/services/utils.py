@@ -1,28 +1,141 @@
+import copy
 import json
 import logging
+import os
 import smtplib
+import threading
+import time
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr
+from typing import Any, Dict, Optional, Tuple
 
 from app.core.config import PROJECT_NAME
 from app.db import models, schemas
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
 
 
 # --- Settings Helpers ---
+# Bumped whenever the local settings cache is invalidated, so in-process
+# caches (e.g. the chat permission cache) can detect changes
+_settings_version = 0
+
+SETTINGS_CACHE_TTL_SECONDS = float(os.getenv("SETTINGS_CACHE_TTL_SECONDS", "300"))
+# How often a worker polls the shared settings version (max. staleness across workers)
+SETTINGS_VERSION_CHECK_SECONDS = float(os.getenv("SETTINGS_VERSION_CHECK_SECONDS", "2"))
+
+_MISSING = object()
+
+
+def get_settings_version() -> int:
+    return _settings_version
+
+
+def bump_settings_version():
+    global _settings_version
+    _settings_version += 1
+
+
+def read_shared_settings_version(db: Session) -> Optional[int]:
+    return (
+        db.query(models.SettingsVersion.version)
+        .filter(models.SettingsVersion.id == 1)
+        .scalar()
+    )
+
+
+def bump_shared_settings_version(db: Session):
+    """Bump the DB settings version (committed together with the caller's changes)."""
+    updated = (
+        db.query(models.SettingsVersion)
+        .filter(models.SettingsVersion.id == 1)
+        .update(
+            {models.SettingsVersion.version: models.SettingsVersion.version + 1},
+            synchronize_session=False,
+        )
+    )
+    if not updated:
+        db.add(models.SettingsVersion(id=1, version=1))
+
+
+class SettingsCache:
+    """
+    Process-wide cache for system settings.
+
+    Entries expire after `ttl` seconds. All entries are dropped as soon as the
+    shared settings version (settings_version table, bumped by save_setting in
+    any worker) changes; it is polled at most every `check_interval` seconds.
+    Values are handed out as deep copies because callers modify them.
+    """
+
+    def __init__(
+        self,
+        ttl: float = SETTINGS_CACHE_TTL_SECONDS,
+        check_interval: float = SETTINGS_VERSION_CHECK_SECONDS,
+    ):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self._shared_version: Optional[int] = None
+        self._next_check = 0.0
+        # Incremented on every clear, so loads racing with a write are not stored
+        self._generation = 0
+
+    def _check_shared_version(self, db: Session):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        version = read_shared_settings_version(db)
+        if version != self._shared_version:
+            self.clear()
+            self._shared_version = version
+
+    def get(self, db: Session, key: str):
+        """Cached setting value, or _MISSING if the key does not exist."""
+        self._check_shared_version(db)
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            value = entry[1]
+        else:
+            generation = self._generation
+            setting = (
+                db.query(models.SystemSetting)
+                .filter(models.SystemSetting.key == key)
+                .first()
+            )
+            value = json.loads(setting.value) if setting else _MISSING
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, value)
+        return value if value is _MISSING else copy.deepcopy(value)
+
+    def invalidate(self):
+        """Drop all entries after a local write."""
+        self.clear()
+        # Pick up the new shared version right away
+        self._next_check = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+        bump_settings_version()
+
+
+settings_cache = SettingsCache()
+
+
 def get_setting(db: Session, key: str, default):
     try:
-        setting = (
-            db.query(models.SystemSetting)
-            .filter(models.SystemSetting.key == key)
-            .first()
-        )
-        if setting:
-            return json.loads(setting.value)
+        value = settings_cache.get(db, key)
+        if value is not _MISSING:
+            return value
         if hasattr(default, "dict"):
             return default.dict()
         return default
@@ -31,7 +144,7 @@ def get_setting(db: Session, key: str, default):
         return default
 
 
-def save_setting(db: Session, key: str, value: dict):
+def save_setting(db: Session, key: str, value: dict) -> bool:
     try:
         setting = (
             db.query(models.SystemSetting)
@@ -43,10 +156,58 @@ def save_setting(db: Session, key: str, value: dict):
             db.add(setting)
         else:
             setting.value = json.dumps(value)
+        bump_shared_settings_version(db)
         db.commit()
+        settings_cache.invalidate()
+        return True
     except Exception as e:
         logger.error(f"DB Error in save_setting: {e}")
         db.rollback()
+        return False
+
+
+def get_job_progress(db: Session, key: str) -> dict:
+    """Stored progress of a background job ({} if none). Not cached."""
+    row = db.query(models.JobProgress).filter(models.JobProgress.key == key).first()
+    return json.loads(row.value) if row else {}
+
+
+def save_job_progress(db: Session, key: str, value: dict):
+    """Persist job progress and commit (together with the job's pending batch).
+    Unlike save_setting this does not bump the settings version."""
+    db.merge(models.JobProgress(key=key, value=json.dumps(value)))
+    db.commit()
+
+
+def invalidate_settings(db: Session):
+    """For settings rows changed without save_setting (deletes, restores)."""
+    bump_shared_settings_version(db)
+    db.commit()
+    settings_cache.invalidate()
+
+
+class SettingsSnapshot:
+    """
+    Typed, lazily loaded view of SystemSettings for one request (or task).
+    Each key is loaded at most once; e.g. `settings.registration` returns the
+    same RegistrationConfig for every caller sharing the snapshot.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._values: Dict[str, Any] = {}
+
+    def __getattr__(self, key: str):
+        field = schemas.SystemSettings.model_fields.get(key)
+        if field is None:
+            raise AttributeError(key)
+        if key not in self._values:
+            annotation = field.annotation
+            if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+                self._values[key] = annotation(**get_setting(self.db, key, {}))
+            else:
+                self._values[key] = get_setting(self.db, key, copy.deepcopy(field.default))
+        return self._values[key]
 
 
 # --- HTML Email Helper ---
@@ -57,6 +218,7 @@ def create_html_email(
     action_text: str = None,
     server_domain: str = "",
     db: Session = None,
+    settings: Optional[SettingsSnapshot] = None,
 ):
     if server_domain.endswith("/"):
         server_domain = server_domain[:-1]
@@ -67,24 +229,17 @@ def create_html_email(
     contact_email = None
     support_enabled = False
 
-    if db:
+    if db or settings:
+        settings = settings or SettingsSnapshot(db)
         try:
-            reg_config = get_setting(db, "registration", {})
             if not host_url:
-                host_url = reg_config.get("server_domain", "")
+                host_url = settings.registration.server_domain or ""
                 if host_url and host_url.endswith("/"):
                     host_url = host_url[:-1]
 
-            # Fetch Support & Legal Config
-            support_conf = get_setting(
-                db, "support_page", schemas.SupportPageConfig().dict()
-            )
-            if isinstance(support_conf, dict):
-                support_enabled = support_conf.get("enabled", True)
-
-            legal_conf = get_setting(db, "legal", schemas.LegalConfig().dict())
-            if isinstance(legal_conf, dict):
-                contact_email = legal_conf.get("contact_email", "")
+            # Support & Legal Config
+            support_enabled = settings.support_page.enabled
+            contact_email = settings.legal.contact_email
 
             if host_url and support_enabled:
                 support_url = f"{host_url}/support"
@@ -212,10 +367,15 @@ def create_html_email(
     return html
 
 
-def send_mail_sync(to_email: str, subject: str, html_body: str, db: Session):
+def send_mail_sync(
+    to_email: str,
+    subject: str,
+    html_body: str,
+    db: Session,
+    settings: Optional[SettingsSnapshot] = None,
+):
     try:
-        config_dict = get_setting(db, "mail", schemas.MailConfig())
-        config = schemas.MailConfig(**config_dict)
+        config = (settings or SettingsSnapshot(db)).mail
         if not config.enabled:
             logger.info(f"Mail sending disabled. To: {to_email}")
             return
@@ -277,20 +437,14 @@ def send_mail_sync(to_email: str, subject: str, html_body: str, db: Session):
 
 
 # Helper to get dynamic support phrase
-def get_support_contact_html(db: Session, server_domain: str = "") -> str:
+def get_support_contact_html(
+    db: Session, server_domain: str = "", settings: Optional[SettingsSnapshot] = None
+) -> str:
     support_phrase = "please contact support immediately"
     try:
-        support_conf = get_setting(
-            db, "support_page", schemas.SupportPageConfig().dict()
-        )
-        legal_conf = get_setting(db, "legal", schemas.LegalConfig().dict())
-
-        support_enabled = isinstance(support_conf, dict) and support_conf.get(
-            "enabled", True
-        )
-        contact_email = (
-            legal_conf.get("contact_email", "") if isinstance(legal_conf, dict) else ""
-        )
+        settings = settings or SettingsSnapshot(db)
+        support_enabled = settings.support_page.enabled
+        contact_email = settings.legal.contact_email
 
         if support_enabled and server_domain:
             return f'<a href="{server_domain}/support">contact support</a> immediately'
@@ -408,9 +562,9 @@ def send_login_notification(email: str, ip: str, user_agent: str, user=None):
                 return
 
         # Determine Support String
-        reg_config = get_setting(db, "registration", {})
-        server_domain = reg_config.get("server_domain", "")
-        support_link_html = get_support_contact_html(db, server_domain)
+        settings = SettingsSnapshot(db)
+        server_domain = settings.registration.server_domain or ""
+        support_link_html = get_support_contact_html(db, server_domain, settings)
 
         title = "New Login Detected"
         content = f"""
@@ -420,8 +574,10 @@ def send_login_notification(email: str, ip: str, user_agent: str, user=None):
         <b>Time:</b> {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}<br><br>
         If this was you, you can ignore this email. If you did not authorize this login, {support_link_html}.
         """
-        html = create_html_email(title, content, server_domain=server_domain, db=db)
-        send_mail_sync(email, title, html, db)
+        html = create_html_email(
+            title, content, server_domain=server_domain, db=db, settings=settings
+        )
+        send_mail_sync(email, title, html, db, settings)
     except Exception as e:
         logger.error(f"Error in send_login_notification: {e}")
     finally:
@@ -438,13 +594,11 @@ def send_registration_notification(new_user, db_session=None):
     db = db_session if db_session else SessionLocal()
     try:
         # Check if registration notifications are enabled
-        reg_notif_config = get_setting(
-            db, "registration_notification", {"enabled": False, "email_target": ""}
-        )
-        if not reg_notif_config.get("enabled", False):
+        settings = SettingsSnapshot(db)
+        if not settings.registration_notification.enabled:
             return
 
-        target_email = reg_notif_config.get("email_target", "")
+        target_email = settings.registration_notification.email_target
         if not target_email:
             return
 
@@ -478,8 +632,7 @@ def send_registration_notification(new_user, db_session=None):
         """
 
         # Get server domain for the "Open Solumati" link
-        reg_config = get_setting(db, "registration", {})
-        server_domain = reg_config.get("server_domain", "")
+        server_domain = settings.registration.server_domain or ""
         admin_url = f"{server_domain}/admin" if server_domain else None
 
         html = create_html_email(
@@ -489,9 +642,14 @@ def send_registration_notification(new_user, db_session=None):
             action_text="Open Admin Panel" if admin_url else None,
             server_domain=server_domain,
             db=db,
+            settings=settings,
         )
         send_mail_sync(
-            target_email, f"[{PROJECT_NAME}] New User: {new_user.username}", html, db
+            target_email,
+            f"[{PROJECT_NAME}] New User: {new_user.username}",
+            html,
+            db,
+            settings,
         )
         logger.info(
             f"Registration notification sent to {target_email} for user {new_user.username}"
@@ -550,9 +708,9 @@ def send_password_changed_notification(user, db_session=None):
             return
 
         # Determine Support String
-        reg_config = get_setting(db, "registration", {})
-        server_domain = reg_config.get("server_domain", "")
-        support_link_html = get_support_contact_html(db, server_domain)
+        settings = SettingsSnapshot(db)
+        server_domain = settings.registration.server_domain or ""
+        support_link_html = get_support_contact_html(db, server_domain, settings)
 
         title = "Password Changed"
         content = f"""
@@ -571,8 +729,9 @@ def send_password_changed_notification(user, db_session=None):
             action_text="Reset Password" if reset_url else None,
             server_domain=server_domain,
             db=db,
+            settings=settings,
         )
-        send_mail_sync(user.email, f"[{PROJECT_NAME}] {title}", html, db)
+        send_mail_sync(user.email, f"[{PROJECT_NAME}] {title}", html, db, settings)
         logger.info(f"Password changed notification sent to {user.email}")
     except Exception as e:
         logger.error(f"Error in send_password_changed_notification: {e}")
@@ -592,9 +751,9 @@ def send_email_changed_notification(old_email: str, new_email: str, db_session=N
     db = db_session if db_session else SessionLocal()
     try:
         # Determine Support String
-        reg_config = get_setting(db, "registration", {})
-        server_domain = reg_config.get("server_domain", "")
-        support_link_html = get_support_contact_html(db, server_domain)
+        settings = SettingsSnapshot(db)
+        server_domain = settings.registration.server_domain or ""
+        support_link_html = get_support_contact_html(db, server_domain, settings)
 
         title = "Email Address Changed"
         content = f"""
@@ -606,8 +765,10 @@ def send_email_changed_notification(old_email: str, new_email: str, db_session=N
         If you did not authorize this change, {support_link_html}.
         """
 
-        html = create_html_email(title, content, server_domain=server_domain, db=db)
-        send_mail_sync(old_email, f"[{PROJECT_NAME}] {title}", html, db)
+        html = create_html_email(
+            title, content, server_domain=server_domain, db=db, settings=settings
+        )
+        send_mail_sync(old_email, f"[{PROJECT_NAME}] {title}", html, db, settings)
         logger.info(f"Email changed notification sent to {old_email}")
     except Exception as e:
         logger.error(f"Error in send_email_changed_notification: {e}")
@@ -626,9 +787,9 @@ def send_account_deactivated_notification(user, reason: str = None, db_session=N
     db = db_session if db_session else SessionLocal()
     try:
         # Determine Support String
-        reg_config = get_setting(db, "registration", {})
-        server_domain = reg_config.get("server_domain", "")
-        support_link_html = get_support_contact_html(db, server_domain)
+        settings = SettingsSnapshot(db)
+        server_domain = settings.registration.server_domain or ""
+        support_link_html = get_support_contact_html(db, server_domain, settings)
 
         title = "Account Suspended"
         reason_text = f"<b>Reason:</b> {reason}<br>" if reason else ""
@@ -639,8 +800,10 @@ def send_account_deactivated_notification(user, reason: str = None, db_session=N
         If you believe this was a mistake, {support_link_html}.
         """
 
-        html = create_html_email(title, content, server_domain=server_domain, db=db)
-        send_mail_sync(user.email, f"[{PROJECT_NAME}] {title}", html, db)
+        html = create_html_email(
+            title, content, server_domain=server_domain, db=db, settings=settings
+        )
+        send_mail_sync(user.email, f"[{PROJECT_NAME}] {title}", html, db, settings)
         logger.info(f"Account deactivation notification sent to {user.email}")
     except Exception as e:
         logger.error(f"Error in send_account_deactivated_notification: {e}")
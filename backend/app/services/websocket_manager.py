@@ -1,44 +1,176 @@
-from typing import Dict, List
-from fastapi import WebSocket
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+
+from app.services.presence import presence_tracker
+from app.services.rate_limiter import TokenBucket
+from fastapi import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # Optional: without msgpack every client speaks JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Frame encodings negotiated via Sec-WebSocket-Protocol. JSON stays the default
+# for clients that do not offer a subprotocol. Compression (permessage-deflate)
+# is negotiated by the ASGI server independently of the encoding.
+JSON_SUBPROTOCOL = "solumati.json"
+MSGPACK_SUBPROTOCOL = "solumati.msgpack"
+
+
+def negotiate_subprotocol(websocket: WebSocket) -> Optional[str]:
+    """Pick the first supported encoding offered by the client (None = plain JSON)."""
+    for protocol in websocket.scope.get("subprotocols", []):
+        if protocol == MSGPACK_SUBPROTOCOL and msgpack is not None:
+            return protocol
+        if protocol == JSON_SUBPROTOCOL:
+            return protocol
+    return None
+
+
+def encode_frame(message: dict, subprotocol: Optional[str]) -> Union[str, bytes]:
+    if subprotocol == MSGPACK_SUBPROTOCOL:
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def decode_frame(data: Union[str, bytes]) -> dict:
+    """Decode an inbound frame. Binary frames are MessagePack, text frames JSON."""
+    if isinstance(data, bytes):
+        if msgpack is None:
+            raise ValueError("Binary frames are not supported")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+@dataclass
+class ConnectionInfo:
+    user_id: int
+    subprotocol: Optional[str] = None
+    # Monotonic time of the last inbound frame (any frame counts as a heartbeat)
+    last_activity: float = field(default_factory=time.monotonic)
+
 
 class ConnectionManager:
     def __init__(self):
-        # Store active connections: user_id -> List[WebSocket]
+        # Store active connections: user_id -> List[WebSocket] (oldest first)
         self.active_connections: Dict[int, List[WebSocket]] = {}
+        # Per connection state (owner, negotiated encoding, liveness)
+        self.connection_info: Dict[WebSocket, ConnectionInfo] = {}
+        # Inbound message budget shared by all connections of a user
+        self.user_buckets: Dict[int, TokenBucket] = {}
+
+    async def connect(self, websocket: WebSocket, user_id: int, max_connections: int = 0):
+        subprotocol = negotiate_subprotocol(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+
+        # Per-user cap: the oldest connection is usually a forgotten tab or a half-open socket
+        connections = self.active_connections.get(user_id, [])
+        while max_connections and len(connections) >= max_connections:
+            await self.reap(connections[0], code=4008)
 
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
+        self.connection_info[websocket] = ConnectionInfo(user_id, subprotocol)
         if user_id not in self.active_connections:
             self.active_connections[user_id] = []
+            presence_tracker.set_online(user_id)
         self.active_connections[user_id].append(websocket)
 
     def disconnect(self, websocket: WebSocket, user_id: int):
+        self.connection_info.pop(websocket, None)
         if user_id in self.active_connections:
             if websocket in self.active_connections[user_id]:
                 self.active_connections[user_id].remove(websocket)
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
+                self.user_buckets.pop(user_id, None)
+                presence_tracker.set_offline(user_id)
+
+    def user_bucket(self, user_id: int, rate: float, burst: int) -> TokenBucket:
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None or bucket.rate != rate or bucket.capacity != burst:
+            bucket = self.user_buckets[user_id] = TokenBucket(rate=rate, capacity=burst)
+        return bucket
+
+    async def reap(self, websocket: WebSocket, code: int = 1001):
+        """Drop a connection from the registry and close it (ignores already dead sockets)."""
+        info = self.connection_info.get(websocket)
+        if info:
+            self.disconnect(websocket, info.user_id)
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def receive(self, websocket: WebSocket) -> Union[str, bytes]:
+        """Receive the raw payload of the next text or binary frame."""
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        info = self.connection_info.get(websocket)
+        if info:
+            info.last_activity = time.monotonic()
+        if message.get("bytes") is not None:
+            return message["bytes"]
+        return message.get("text") or ""
+
+    async def _send_frame(self, websocket: WebSocket, frame: Union[str, bytes]):
+        if isinstance(frame, bytes):
+            await websocket.send_bytes(frame)
+        else:
+            await websocket.send_text(frame)
+
+    def _subprotocol(self, websocket: WebSocket) -> Optional[str]:
+        info = self.connection_info.get(websocket)
+        return info.subprotocol if info else None
+
+    async def send(self, websocket: WebSocket, message: dict):
+        """Send to a single connection using its negotiated encoding."""
+        await self._send_frame(websocket, encode_frame(message, self._subprotocol(websocket)))
+
+    async def _send_to_all(self, message: dict, connections: List[WebSocket]):
+        # Each payload is encoded once per encoding, not once per connection
+        frames: Dict[Optional[str], Union[str, bytes]] = {}
+        for connection in list(connections):
+            subprotocol = self._subprotocol(connection)
+            if subprotocol not in frames:
+                frames[subprotocol] = encode_frame(message, subprotocol)
+            try:
+                await self._send_frame(connection, frames[subprotocol])
+            except Exception:
+                # Dead socket: stop fanning out to it
+                await self.reap(connection)
 
     async def send_personal_message(self, message: dict, user_id: int):
         if user_id in self.active_connections:
-            # We iterate over a copy or use a safe method if needed, but list iteration is usually fine if not modifying async
-            # But disconnect might happen during send?
-            # For MVP it's usually okay.
-            for connection in self.active_connections[user_id]:
-                try:
-                    await connection.send_json(message)
-                except Exception:
-                    # If send fails, we might want to clean up, but simpler to let disconnect handle it
-                    pass
+            await self._send_to_all(message, self.active_connections[user_id])
 
     async def broadcast(self, message: dict):
         """Send a message to ALL connected users."""
-        for user_id, connections in self.active_connections.items():
-            for connection in connections:
-                try:
-                    await connection.send_json(message)
-                except Exception:
-                    pass
+        connections = [c for conns in list(self.active_connections.values()) for c in conns]
+        await self._send_to_all(message, connections)
+
+    async def heartbeat(self, idle_timeout: float) -> int:
+        """
+        Reaps connections without inbound traffic for `idle_timeout` seconds
+        and pings the rest. Returns the number of reaped connections.
+        """
+        now = time.monotonic()
+        reaped = 0
+        for websocket, info in list(self.connection_info.items()):
+            if now - info.last_activity > idle_timeout:
+                await self.reap(websocket)
+                reaped += 1
+                continue
+            try:
+                await self.send(websocket, {"type": "ping"})
+            except Exception:
+                await self.reap(websocket)
+                reaped += 1
+        return reaped
 
 # Global instance
 manager = ConnectionManager()
@@ -13,6 +13,8 @@ from unittest.mock import patch
 
 from app.core.database import Base, get_db
 from app.main import app
+from app.services.identity_cache import identity_cache
+from app.services.utils import settings_cache
 
 
 @pytest.fixture(scope="module")
@@ -37,10 +39,15 @@ def test_db():
 
         # Create tables
         Base.metadata.create_all(bind=engine)
+        # Settings cached from another module's database must not leak in
+        settings_cache.clear()
+        identity_cache.clear()
 
         yield TestingSessionLocal
 
         Base.metadata.drop_all(bind=engine)
+        settings_cache.clear()
+        identity_cache.clear()
 
 
 @pytest.fixture(scope="module")
@@ -0,0 +1,42 @@
+from app.db import schemas
+from app.middleware import rate_limit
+from app.middleware.rate_limit import ApiRateLimitState
+from app.services.rate_limiter import MemoryRateLimitBackend
+from app.services.utils import save_setting
+
+
+def test_route_costs_use_first_matching_pattern():
+    state = ApiRateLimitState()
+    assert state.cost("/users/5/export") == 30
+    assert state.cost("/chat/history/2/stream") == 10
+    assert state.cost("/chat/history/2") == 3
+    assert state.cost("/questions") == 1
+
+
+def test_expensive_routes_exhaust_user_budget(client, test_db, monkeypatch):
+    monkeypatch.setattr(rate_limit, "api_rate_limit_backend", MemoryRateLimitBackend())
+    db = test_db()
+    save_setting(
+        db,
+        "api_rate_limit",
+        {
+            "enabled": True,
+            "window_seconds": 60,
+            "per_user_limit": 10,
+            "per_ip_limit": 0,
+            "route_costs": {"/chat/history/*": 4},
+        },
+    )
+    headers = {"X-User-Id": "1"}
+    try:
+        assert client.get("/chat/history/3", headers=headers).status_code == 200
+        assert client.get("/chat/history/3", headers=headers).status_code == 200
+        response = client.get("/chat/history/3", headers=headers)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+        # Budgets are per user: others are unaffected
+        assert client.get("/chat/history/1", headers={"X-User-Id": "3"}).status_code == 200
+    finally:
+        save_setting(db, "api_rate_limit", schemas.ApiRateLimitConfig().dict())
+        db.close()
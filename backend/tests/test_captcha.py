@@ -0,0 +1,47 @@
+from unittest.mock import MagicMock
+
+from app.db import schemas
+from app.services import captcha
+from app.services.metrics import metrics
+from app.services.rate_limiter import rate_limiter
+from app.services.utils import save_setting
+
+
+def test_login_verifies_captcha_with_shared_client(client, test_db, monkeypatch):
+    posted = []
+
+    async def post(url, data=None, timeout=None):
+        posted.append((url, data, timeout))
+        return MagicMock(json=lambda: {"success": data["response"] == "good-token"})
+
+    monkeypatch.setattr(captcha, "get_http_client", lambda: MagicMock(post=post))
+    db = test_db()
+    save_setting(
+        db,
+        "captcha",
+        {
+            "enabled": True,
+            "provider": "cloudflare",
+            "secret_key": "secret",
+            "failed_attempts_threshold": 1,
+        },
+    )
+    rate_limiter.record_failed_attempt("testclient")
+    payload = {"login": "nobody@example.com", "password": "Wrong123!"}
+    try:
+        assert client.post("/login", json=payload).status_code == 428
+
+        response = client.post("/login", json={**payload, "captcha_token": "bad-token"})
+        assert response.status_code == 400
+        assert metrics.snapshot()["counters"]["captcha.cloudflare.rejected"] >= 1
+
+        # Valid CAPTCHA: the credentials are checked next
+        response = client.post("/login", json={**payload, "captcha_token": "good-token"})
+        assert response.status_code == 401
+        assert posted[-1][0] == captcha.VERIFY_URLS["cloudflare"]
+        assert posted[-1][2] is captcha.CAPTCHA_TIMEOUT
+        assert metrics.snapshot()["latency"]["captcha.cloudflare"]["count"] >= 2
+    finally:
+        save_setting(db, "captcha", schemas.CaptchaConfig().dict())
+        rate_limiter.clear_attempts("testclient")
+        db.close()
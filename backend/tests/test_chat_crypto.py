@@ -4,6 +4,9 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.api.routers.chat import decrypt_message, encrypt_message
+from app.db import models
+from app.services import message_crypto
+from app.services.utils import bump_shared_settings_version
 
 
 def test_encryption_correctness():
@@ -18,6 +21,119 @@ def test_encryption_correctness():
     print("Encryption/Decryption cycle: PASS")
 
 
+def test_keyring_rotation_keeps_old_messages_readable(tmp_path):
+    ring = message_crypto.MessageKeyring(str(tmp_path / "secret.key"))
+    old_token = ring.encrypt("before rotation")
+    old_primary = ring.primary_fingerprint
+
+    new_primary = ring.rotate()
+
+    assert new_primary != old_primary
+    assert ring.fingerprints == [new_primary, old_primary]
+    assert ring.decrypt(old_token) == "before rotation"
+
+    # Re-encrypted tokens survive pruning of the old key
+    new_token = ring.reencrypt(old_token)
+    assert ring.prune() == 1
+    assert ring.decrypt(new_token) == "before rotation"
+
+
+def test_reencryption_job_processes_all_messages(test_db, tmp_path, monkeypatch):
+    ring = message_crypto.MessageKeyring(str(tmp_path / "secret.key"))
+    monkeypatch.setattr(message_crypto, "keyring", ring)
+
+    db = test_db()
+    for i in range(5):
+        db.add(models.Message(sender_id=1, receiver_id=2, content=ring.encrypt(f"msg {i}")))
+    db.commit()
+
+    ring.rotate()
+    bump_shared_settings_version(db)
+    db.commit()
+    version = db.query(models.SettingsVersion.version).scalar()
+    message_crypto.ReencryptionJob().run(batch_size=2, pause_seconds=0)
+    # Per-batch progress must not invalidate the settings caches
+    assert db.query(models.SettingsVersion.version).scalar() == version
+
+    status = message_crypto.get_reencryption_status(db)
+    assert status["status"] == "completed"
+    assert status["processed"] == 5
+    assert status["failed"] == 0
+
+    ring.prune()
+    db.expire_all()
+    contents = [ring.decrypt(m.content) for m in db.query(models.Message).order_by(models.Message.id)]
+    assert contents == [f"msg {i}" for i in range(5)]
+    db.close()
+
+
+def test_reencryption_job_uses_key_rotated_by_another_worker(test_db, tmp_path, monkeypatch):
+    key_file = str(tmp_path / "secret.key")
+    worker = message_crypto.MessageKeyring(key_file)
+    monkeypatch.setattr(message_crypto, "keyring", worker)
+
+    db = test_db()
+    db.query(models.Message).delete()  # Encrypted with keys of other tests
+    db.add(models.Message(sender_id=1, receiver_id=2, content=worker.encrypt("hello")))
+    db.commit()
+
+    other_worker = message_crypto.MessageKeyring(key_file)
+    new_primary = other_worker.rotate()
+    assert worker.primary_fingerprint != new_primary  # Not reloaded yet
+
+    message_crypto.ReencryptionJob().run(batch_size=50, pause_seconds=0)
+    assert message_crypto.get_reencryption_status(db)["target_key"] == new_primary
+
+    other_worker.prune()
+    message = db.query(models.Message).one()
+    db.refresh(message)
+    assert other_worker.decrypt(message.content) == "hello"
+    db.close()
+
+
+def test_prune_waits_for_grace_period_and_reencrypts_late_messages(
+    client, test_db, tmp_path, monkeypatch
+):
+    from datetime import datetime, timedelta
+
+    from app.api.routers import admin
+    from app.services.utils import save_job_progress
+
+    db = test_db()
+    db.query(models.Message).delete()  # Encrypted with keys of other tests
+    db.commit()
+
+    key_file = str(tmp_path / "secret.key")
+    ring = message_crypto.MessageKeyring(key_file)
+    monkeypatch.setattr(message_crypto, "keyring", ring)
+    monkeypatch.setattr(admin, "keyring", ring)
+    # Another worker that has not reloaded the key file since the rotation
+    stale_worker = message_crypto.MessageKeyring(key_file)
+
+    ring.rotate()
+    message_crypto.ReencryptionJob().run(batch_size=50, pause_seconds=0)
+
+    late = models.Message(sender_id=1, receiver_id=2, content=stale_worker.encrypt("late"))
+    db.add(late)
+    db.commit()
+
+    headers = {"X-User-Id": "1"}
+    response = client.post("/admin/chat-keys/prune", headers=headers)
+    assert response.status_code == 409
+    assert len(ring.fingerprints) == 2
+
+    progress = message_crypto.get_reencryption_status(db)
+    progress["finished_at"] = (datetime.utcnow() - timedelta(seconds=60)).isoformat()
+    save_job_progress(db, message_crypto.REENCRYPTION_PROGRESS, progress)
+
+    response = client.post("/admin/chat-keys/prune", headers=headers)
+    assert response.status_code == 200
+    assert ring.fingerprints == [ring.primary_fingerprint]
+    db.refresh(late)
+    assert ring.decrypt(late.content) == "late"
+    db.close()
+
+
 if __name__ == "__main__":
     try:
         test_encryption_correctness()
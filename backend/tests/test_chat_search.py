@@ -0,0 +1,146 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import insert
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import models
+from app.services import message_search
+from app.services.message_search import BlindIndex, tokenize
+
+
+@pytest.fixture
+def search_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_search, "blind_index", BlindIndex(str(tmp_path / "search.key")))
+
+
+def test_tokenize_normalizes_and_deduplicates():
+    assert tokenize("Hallo Welt, hallo WELT! a 42") == ["hallo", "welt", "42"]
+
+
+def test_token_hash_is_keyed(tmp_path):
+    first = BlindIndex(str(tmp_path / "a.key"))
+    second = BlindIndex(str(tmp_path / "b.key"))
+    assert first.token_hash("coffee") == first.token_hash("coffee")
+    assert first.token_hash("coffee") != second.token_hash("coffee")
+    assert "coffee" not in first.token_hash("coffee")
+
+
+def test_search_backfill_and_indexing_on_insert(client, test_db, search_key):
+    from app.api.routers.chat import encrypt_message
+    from app.services.utils import save_setting
+
+    db = test_db()
+    old = models.Message(sender_id=3, receiver_id=1, content=encrypt_message("Coffee tomorrow?"))
+    other = models.Message(sender_id=3, receiver_id=2, content=encrypt_message("coffee for user 2"))
+    db.add_all([old, other])
+    db.commit()
+    old_id = old.id
+
+    headers = {"X-User-Id": "1"}
+    assert client.get("/chat/search?q=coffee", headers=headers).status_code == 403
+
+    save_setting(db, message_search.SEARCH_SETTING, {"enabled": True})
+    version = db.query(models.SettingsVersion.version).scalar()
+    message_search.SearchIndexBackfill().run(batch_size=1, pause_seconds=0)
+    assert message_search.get_backfill_status(db)["status"] == "completed"
+    # Per-batch progress must not invalidate the settings caches
+    assert db.query(models.SettingsVersion.version).scalar() == version
+
+    # New messages are indexed on insert
+    with client.websocket_connect("/ws/chat?token=1") as ws:
+        ws.send_json({"receiver_id": 3, "content": "Yes, coffee at nine"})
+        new_id = ws.receive_json()["id"]
+
+    results = client.get("/chat/search?q=COFFEE", headers=headers).json()
+    assert [r["id"] for r in results] == [new_id, old_id]
+    assert results[0]["partner_id"] == 3
+
+    results = client.get("/chat/search?q=coffee nine", headers=headers).json()
+    assert [r["content"] for r in results] == ["Yes, coffee at nine"]
+
+    save_setting(db, message_search.SEARCH_SETTING, {"enabled": False})
+    message_search.clear_search_index(db)
+    db.close()
+
+
+def test_deleting_a_user_removes_their_index_rows(client, test_db, search_key):
+    from app.api.routers.chat import encrypt_message
+    from app.services.user_service import user_service
+
+    db = test_db()
+    user = models.User(username="search_leaver", email="leaver@example.com", hashed_password="!")
+    db.add(user)
+    db.commit()
+    msg = models.Message(sender_id=user.id, receiver_id=1, content=encrypt_message("bye bye"))
+    db.add(msg)
+    db.commit()
+    msg_id = msg.id
+    db.execute(
+        insert(models.MessageSearchToken),
+        message_search.blind_index.rows_for(msg_id, user.id, 1, "bye bye"),
+    )
+    db.commit()
+
+    user_service.delete_user(db, user)
+    remaining = db.query(models.MessageSearchToken).filter_by(message_id=msg_id).count()
+    assert remaining == 0
+    db.close()
+
+
+def test_archived_messages_stay_searchable(client, test_db, search_key):
+    from datetime import datetime, timedelta
+
+    from app.api.routers.chat import encrypt_message
+    from app.services.message_archive import archive_old_messages
+    from app.services.user_service import user_service
+    from app.services.utils import save_setting
+
+    db = test_db()
+    user = models.User(username="archive_searcher", email="archive@example.com", hashed_password="!")
+    db.add(user)
+    db.commit()
+    old = models.Message(
+        sender_id=user.id,
+        receiver_id=1,
+        content=encrypt_message("Zeppelin ride?"),
+        timestamp=datetime.utcnow() - timedelta(days=400),
+        is_read=True,
+    )
+    hot = models.Message(sender_id=1, receiver_id=user.id, content=encrypt_message("Zeppelin!"))
+    db.add_all([old, hot])
+    db.commit()
+    old_id, hot_id = old.id, hot.id
+
+    save_setting(db, message_search.SEARCH_SETTING, {"enabled": True})
+    message_search.SearchIndexBackfill().run(batch_size=50, pause_seconds=0)
+    archive_old_messages(db, datetime.utcnow() - timedelta(days=180))
+    assert db.query(models.Message).filter_by(id=old_id).count() == 0
+
+    headers = {"X-User-Id": "1"}
+
+    def search():
+        results = client.get("/chat/search?q=zeppelin", headers=headers).json()
+        return [(r["id"], r["partner_id"], r["content"]) for r in results]
+
+    expected = [(hot_id, user.id, "Zeppelin!"), (old_id, user.id, "Zeppelin ride?")]
+    assert search() == expected
+
+    # A rebuilt index covers the archive as well
+    message_search.clear_search_index(db)
+    assert search() == []
+    message_search.SearchIndexBackfill().run(batch_size=50, pause_seconds=0)
+    status = message_search.get_backfill_status(db)
+    assert (status["status"], status["failed"]) == ("completed", 0)
+    assert search() == expected
+
+    user_service.delete_user(db, user)
+    assert db.query(models.MessageSearchToken).filter(
+        models.MessageSearchToken.message_id.in_([old_id, hot_id])
+    ).count() == 0
+
+    save_setting(db, message_search.SEARCH_SETTING, {"enabled": False})
+    message_search.clear_search_index(db)
+    db.close()
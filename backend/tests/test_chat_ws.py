@@ -0,0 +1,315 @@
+import asyncio
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.api.routers.chat import ConnectionPermissionCache
+from app.db import models
+from app.services.utils import bump_settings_version
+from app.services.websocket_manager import ConnectionManager
+
+
+def make_db(role="test", is_guest=False):
+    mock_db = MagicMock()
+    row = MagicMock(role=role, is_guest=is_guest)
+    mock_db.query.return_value.filter.return_value.first.return_value = row
+    return mock_db
+
+
+# --- PERMISSION CACHE ---
+def test_permission_cache_queries_receiver_once():
+    user = models.User(id=10, role="test", is_guest=False)
+    mock_db = make_db(role="test")
+    cache = ConnectionPermissionCache(user)
+
+    for _ in range(5):
+        decision = cache.resolve(mock_db, 11)
+
+    assert decision.exists
+    assert decision.error is None
+    assert mock_db.query.call_count == 1
+
+
+def test_permission_cache_denies_test_user_to_regular_user():
+    user = models.User(id=10, role="test", is_guest=False)
+    cache = ConnectionPermissionCache(user)
+
+    decision = cache.resolve(make_db(role="user"), 12)
+
+    assert decision.error == "Test users can only chat with other Test users."
+
+
+def test_permission_cache_invalidated_by_settings_change():
+    user = models.User(id=10, role="user", is_guest=False)
+    mock_db = make_db(role="moderator")
+    cache = ConnectionPermissionCache(user)
+
+    with patch(
+        "app.api.routers.chat.get_setting", return_value={"enabled": False}
+    ) as mock_setting:
+        assert cache.resolve(mock_db, 3).error == "Support chat is currently read-only."
+        cache.resolve(mock_db, 3)
+        assert mock_setting.call_count == 1
+
+        # Admin toggles support chat -> cached decision must be dropped
+        mock_setting.return_value = {"enabled": True}
+        bump_settings_version()
+        assert cache.resolve(mock_db, 3).error is None
+        assert mock_setting.call_count == 2
+
+
+# --- RECONNECT SYNC ---
+def test_reconnect_streams_only_missed_messages(client, test_db):
+    from app.api.routers.chat import encrypt_message
+
+    db = test_db()
+    msgs = [
+        models.Message(sender_id=3, receiver_id=1, content=encrypt_message(f"missed {i}"))
+        for i in range(3)
+    ]
+    db.add_all(msgs)
+    db.commit()
+    first_id, last_id = msgs[0].id, msgs[-1].id
+    db.close()
+
+    with client.websocket_connect(f"/ws/chat?token=1&last_seen_message_id={first_id}") as ws:
+        frame = ws.receive_json()
+        assert frame["type"] == "sync"
+        assert [m["content"] for m in frame["messages"]] == ["missed 1", "missed 2"]
+        assert frame["has_more"] is False
+
+        done = ws.receive_json()
+        assert done == {"type": "sync_complete", "last_message_id": last_id}
+
+
+# --- FRAME ENCODING ---
+def test_msgpack_subprotocol_roundtrip(client):
+    import msgpack
+
+    with client.websocket_connect("/ws/chat?token=1", subprotocols=["solumati.msgpack"]) as ws:
+        assert ws.accepted_subprotocol == "solumati.msgpack"
+        ws.send_bytes(msgpack.packb({"receiver_id": 3, "content": "packed"}))
+        frame = msgpack.unpackb(ws.receive_bytes())
+
+    assert frame["content"] == "packed"
+    assert frame["sender_id"] == 1
+
+
+def test_json_remains_default_encoding(client):
+    with client.websocket_connect("/ws/chat?token=1") as ws:
+        assert ws.accepted_subprotocol is None
+        ws.send_json({"receiver_id": 3, "content": "plain"})
+        assert ws.receive_json()["content"] == "plain"
+
+
+# --- HEARTBEAT / REAPING ---
+def make_socket():
+    socket = MagicMock()
+    socket.scope = {"subprotocols": []}
+    socket.accept = AsyncMock()
+    socket.close = AsyncMock()
+    socket.send_text = AsyncMock()
+    return socket
+
+
+def test_heartbeat_reaps_idle_and_pings_live_connections():
+    manager = ConnectionManager()
+    idle, live = make_socket(), make_socket()
+
+    async def scenario():
+        await manager.connect(idle, 1)
+        await manager.connect(live, 2)
+        manager.connection_info[idle].last_activity -= 120
+        return await manager.heartbeat(idle_timeout=60)
+
+    assert asyncio.run(scenario()) == 1
+    assert list(manager.active_connections) == [2]
+    idle.close.assert_awaited_once()
+    live.send_text.assert_awaited_once_with('{"type":"ping"}')
+
+
+def test_heartbeat_task_loads_config_off_the_event_loop():
+    import threading
+
+    from app.db.schemas import WebSocketConfig
+    from app.services import tasks
+
+    loader_threads = []
+
+    def load_config():
+        loader_threads.append(threading.get_ident())
+        return WebSocketConfig()
+
+    async def scenario():
+        task = asyncio.create_task(tasks.websocket_heartbeat_task())
+        while not loader_threads:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return threading.get_ident()
+
+    with patch.object(tasks, "_load_websocket_config", load_config):
+        loop_thread = asyncio.run(scenario())
+    assert loader_threads[0] != loop_thread
+
+
+def test_dead_connection_is_dropped_on_send():
+    manager = ConnectionManager()
+    dead = make_socket()
+    dead.send_text.side_effect = RuntimeError("connection lost")
+
+    async def scenario():
+        await manager.connect(dead, 1)
+        await manager.send_personal_message({"content": "hi"}, 1)
+
+    asyncio.run(scenario())
+    assert manager.active_connections == {}
+    assert manager.connection_info == {}
+
+
+def test_connection_cap_closes_oldest_connection():
+    manager = ConnectionManager()
+    sockets = [make_socket() for _ in range(3)]
+
+    async def scenario():
+        for socket in sockets:
+            await manager.connect(socket, 1, max_connections=2)
+
+    asyncio.run(scenario())
+    assert manager.active_connections[1] == sockets[1:]
+    sockets[0].close.assert_awaited_once_with(code=4008)
+
+
+# --- PRESENCE ---
+def test_presence_follows_connections_and_flushes_in_batches(test_db):
+    from app.services.presence import PresenceTracker
+
+    tracker = PresenceTracker()
+    manager = ConnectionManager()
+    first, second = make_socket(), make_socket()
+
+    async def scenario():
+        with patch("app.services.websocket_manager.presence_tracker", tracker):
+            await manager.connect(first, 1)
+            await manager.connect(second, 1)
+            assert tracker.is_online(1)
+            manager.disconnect(first, 1)
+            assert tracker.is_online(1)  # Still one tab open
+            manager.disconnect(second, 1)
+
+    asyncio.run(scenario())
+    assert not tracker.is_online(1)
+
+    db = test_db()
+    try:
+        assert db.query(models.User).filter(models.User.id == 1).first().last_seen is None
+        assert tracker.flush(db) == 1
+        db.expire_all()
+        assert db.query(models.User).filter(models.User.id == 1).first().last_seen is not None
+        assert tracker.flush(db) == 0  # Nothing changed since
+    finally:
+        db.close()
+
+
+def test_presence_flush_skips_deleted_users(test_db):
+    from app.services.presence import PresenceTracker
+
+    tracker = PresenceTracker()
+    tracker.set_offline(1)
+    tracker.set_offline(999999)  # e.g. a guest removed by the hourly cleanup
+
+    db = test_db()
+    try:
+        assert tracker.flush(db) == 2
+        db.expire_all()
+        assert db.query(models.User).filter(models.User.id == 1).first().last_seen is not None
+        assert tracker.flush(db) == 0  # Missing id is not re-queued
+    finally:
+        db.close()
+
+
+# --- INBOUND RATE LIMIT ---
+def test_message_budget_consumes_nothing_when_one_bucket_is_empty():
+    from app.api.routers.chat import consume_message_budget
+    from app.services.rate_limiter import TokenBucket
+
+    connection = TokenBucket(rate=1, capacity=5)
+    user = TokenBucket(rate=1, capacity=1)
+
+    assert consume_message_budget(connection, user) == 0
+    assert consume_message_budget(connection, user) > 0
+    assert connection.tokens == pytest.approx(4, abs=0.01)
+
+
+def test_websocket_config_rejects_rates_that_never_refill():
+    from pydantic import ValidationError
+
+    from app.db.schemas import WebSocketConfig
+
+    for field in ("messages_per_second_per_connection", "messages_per_second_per_user"):
+        with pytest.raises(ValidationError):
+            WebSocketConfig(**{field: 0})
+    with pytest.raises(ValidationError):
+        WebSocketConfig(message_burst_per_user=0)
+
+
+def test_flooding_client_gets_rate_limited_frame(client, test_db):
+    from app.services.utils import save_setting
+
+    db = test_db()
+    save_setting(
+        db,
+        "websocket",
+        {"messages_per_second_per_connection": 0.01, "message_burst_per_connection": 2},
+    )
+    try:
+        with client.websocket_connect("/ws/chat?token=1") as ws:
+            for i in range(2):
+                ws.send_json({"receiver_id": 3, "content": f"msg {i}"})
+                assert ws.receive_json()["content"] == f"msg {i}"
+
+            ws.send_json({"receiver_id": 3, "content": "one too many"})
+            frame = ws.receive_json()
+            assert frame["type"] == "rate_limited"
+            assert frame["retry_after"] > 0
+    finally:
+        save_setting(db, "websocket", {})
+        db.close()
+
+
+# --- STREAMING HISTORY ---
+def test_history_stream_yields_ndjson_and_marks_read(client, test_db):
+    import json
+
+    from app.api.routers.chat import encrypt_message
+
+    db = test_db()
+    db.query(models.Message).delete()
+    db.add_all(
+        [
+            models.Message(sender_id=3, receiver_id=1, content=encrypt_message("hello"), is_read=False),
+            models.Message(sender_id=1, receiver_id=3, content=encrypt_message("hi back")),
+            models.Message(sender_id=3, receiver_id=2, content=encrypt_message("other chat")),
+        ]
+    )
+    db.commit()
+
+    response = client.get("/chat/history/3/stream", headers={"X-User-Id": "1"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [m["content"] for m in lines] == ["hello", "hi back"]
+
+    db.expire_all()
+    unread = db.query(models.Message).filter(
+        models.Message.receiver_id == 1, models.Message.is_read == False
+    )
+    assert unread.count() == 0
+
+    # Moderation export of the same conversation is read-only
+    response = client.get("/chat/moderation/history/3/1/stream", headers={"X-User-Id": "1"})
+    assert len(response.text.splitlines()) == 2
+    db.close()
@@ -0,0 +1,89 @@
+from app.db import models
+from app.services import ephemeral_store as store_module
+from app.services.ephemeral_store import DatabaseEphemeralStore, MemoryEphemeralStore
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_entries_expire_and_pop_once():
+    clock = FakeClock()
+    store = MemoryEphemeralStore(clock=clock)
+    store.set("email_2fa:1", "123456", 600)
+    store.set("email_2fa:2", "654321", 60)
+
+    clock.now += 120
+    assert store.get("email_2fa:2") is None
+    assert len(store) == 1
+    assert store.pop("email_2fa:1") == "123456"
+    assert store.pop("email_2fa:1") is None
+
+    # Overwriting a key keeps only the newest TTL
+    store.set("webauthn:auth:1", "a", 10)
+    store.set("webauthn:auth:1", "b", 1000)
+    clock.now += 100
+    assert store.get("webauthn:auth:1") == "b"
+
+
+def test_memory_store_is_bounded():
+    store = MemoryEphemeralStore(maxsize=3, clock=FakeClock())
+    for i in range(10):
+        store.set(f"k{i}", i, 60 + i)
+    assert len(store) == 3
+    assert store.get("k9") == 9
+    assert store.get("k0") is None
+
+
+def test_database_store_is_shared(client, test_db):
+    clock = FakeClock()
+    worker_a = DatabaseEphemeralStore(test_db, clock=clock)
+    worker_b = DatabaseEphemeralStore(test_db, clock=clock)
+
+    worker_a.set("password_reset:abc", 42, 3600)
+    assert worker_b.get("password_reset:abc") == 42
+    assert worker_b.pop("password_reset:abc") == 42
+    assert worker_a.pop("password_reset:abc") is None
+
+    worker_a.set("email_2fa:7", "111111", 600)
+    clock.now += 601
+    assert worker_b.get("email_2fa:7") is None
+    worker_b.set("email_2fa:8", "222222", 600)  # Purges expired rows
+    db = test_db()
+    assert [e.key for e in db.query(models.EphemeralEntry).all()] == ["email_2fa:8"]
+    db.close()
+
+
+def test_password_reset_token_is_single_use(client, test_db, monkeypatch):
+    monkeypatch.setattr(store_module.ephemeral_store, "_entries", {})
+    db = test_db()
+    user = models.User(
+        username="reset_probe",
+        email="reset_probe@example.com",
+        hashed_password="!",
+        role="user",
+        is_active=True,
+    )
+    db.add(user)
+    db.commit()
+
+    response = client.post("/auth/password-reset/request", json={"email": "reset_probe"})
+    assert response.status_code == 200
+    (key,) = [k for k in store_module.ephemeral_store._entries if k.startswith("password_reset:")]
+    token = key.split(":", 1)[1]
+
+    body = {"token": token, "new_password": "weak"}
+    assert client.post("/auth/password-reset/confirm", json=body).status_code == 400
+
+    body["new_password"] = "N3w-Secret!"
+    assert client.post("/auth/password-reset/confirm", json=body).status_code == 200
+    assert client.post("/auth/password-reset/confirm", json=body).status_code == 400
+
+    db.refresh(user)
+    assert user.hashed_password != "!"
+    assert user.reset_token is None
+    db.close()
@@ -1,7 +1,7 @@
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, patch
 from app.main import app
-from app.api.dependencies import get_current_user_from_header, get_db
+from app.api.dependencies import get_current_identity, get_db
 from app.db import models
 
 client = TestClient(app)
@@ -33,7 +33,7 @@ def test_guest_discovery_route_shadowing(mock_user_service):
     """
     Verifies that /users/discover is NOT shadowed by /users/{user_id}.
     """
-    app.dependency_overrides[get_current_user_from_header] = mock_get_guest
+    app.dependency_overrides[get_current_identity] = mock_get_guest
     app.dependency_overrides[get_db] = mock_get_db
 
     # Mock the service response so it doesn't really check DB
@@ -54,8 +54,6 @@ def test_demo_mode_start_pydantic_fix(mock_start_demo):
     """
     Verifies that /api/demo/start?mode=local works with the new Pydantic pattern.
     """
-    app.dependency_overrides[get_current_user_from_header] = mock_get_current_admin
-
     # Param 'mode' must match ^(local|persistent)$
     # We mock the async call
     import asyncio
@@ -63,6 +61,8 @@ def test_demo_mode_start_pydantic_fix(mock_start_demo):
     f.set_result(None)
     mock_start_demo.return_value = f
 
+    app.dependency_overrides[get_current_identity] = mock_get_current_admin
+
     response = client.post("/demo/start?mode=local")
 
     app.dependency_overrides = {}
@@ -0,0 +1,133 @@
+from app.db import models
+from app.services.identity_cache import Identity, IdentityCache, identity_cache
+
+
+def test_identity_cache_is_bounded_and_rejects_stale_loads():
+    cache = IdentityCache(maxsize=2, ttl=60)
+    for user_id in (1, 2, 3):
+        cache.put(Identity(id=user_id, role="user", is_active=True, is_guest=False))
+    assert cache.get(1) is None  # Least recently used entry evicted
+    assert cache.get(3).role == "user"
+
+    # A load that started before an invalidation must not be stored
+    version = cache.version()
+    cache.invalidate(3)
+    cache.put(Identity(id=3, role="admin", is_active=True, is_guest=False, version=version))
+    assert cache.get(3) is None
+
+
+def test_ban_is_effective_immediately_for_cached_identity(client, test_db):
+    db = test_db()
+    user = models.User(
+        username="identity_probe",
+        email="identity_probe@example.com",
+        hashed_password="!",
+        role="user",
+        is_active=True,
+    )
+    db.add(user)
+    db.commit()
+    headers = {"X-User-Id": str(user.id)}
+
+    assert client.get("/chat/history/1", headers=headers).status_code == 200
+    assert identity_cache.get(user.id).is_active  # Now served from the cache
+
+    response = client.put(
+        f"/admin/users/{user.id}/punish",
+        json={"action": "silent_deactivate"},
+        headers={"X-User-Id": "1"},
+    )
+    assert response.status_code == 200
+    assert client.get("/chat/history/1", headers=headers).status_code == 403
+    db.close()
+
+
+def test_unknown_user_ids_leave_no_cache_state(client):
+    version = identity_cache.version()
+    for user_id in range(900000, 900050):
+        response = client.get("/users/1", headers={"X-User-Id": str(user_id)})
+        assert response.status_code == 401
+    assert identity_cache.version() == version
+
+
+def test_identity_endpoints_do_not_select_users_row(client, test_db):
+    from sqlalchemy import event
+
+    engine = test_db.kw["bind"]
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    headers = {"X-User-Id": "1"}
+    assert client.get("/notifications", headers=headers).status_code == 200  # Warm cache
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert client.get("/notifications", headers=headers).status_code == 200
+        assert client.get("/admin/metrics", headers=headers).status_code == 200
+        assert client.get("/auth/oauth/connections", headers=headers).status_code == 200
+        subscription = {"endpoint": "https://push.example/1", "keys": {"auth": "a"}}
+        response = client.post("/notifications/subscribe", json=subscription, headers=headers)
+        assert response.status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert not [s for s in statements if "FROM users" in s]
+
+
+def test_header_auth_rejects_banned_user_from_cache(client, test_db):
+    from sqlalchemy import event
+
+    engine = test_db.kw["bind"]
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    identity_cache.put(
+        Identity(
+            id=1, role="admin", is_active=False, is_guest=False, version=identity_cache.version()
+        )
+    )
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        # Endpoint that loads the full row: the ban is decided before any query
+        assert client.get("/users/1", headers={"X-User-Id": "1"}).status_code == 403
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+        identity_cache.invalidate(1)
+    assert not [s for s in statements if "FROM users" in s]
+
+
+def test_database_import_drops_cached_identities(client, test_db):
+    import json
+
+    db = test_db()
+    user = models.User(
+        username="restore_probe",
+        email="restore_probe@example.com",
+        hashed_password="!",
+        role="user",
+        is_active=True,
+    )
+    db.add(user)
+    db.commit()
+    headers = {"X-User-Id": str(user.id)}
+    admin = {"X-User-Id": "1"}
+
+    backup = client.get("/admin/backup/database/export", headers=admin).json()
+    for row in backup["tables"]["users"]:
+        if row["id"] == user.id:
+            row["role"] = "moderator"
+
+    assert client.get("/admin/reports", headers=headers).status_code == 403
+    assert identity_cache.get(user.id).role == "user"
+
+    response = client.post(
+        "/admin/backup/database/import",
+        files={"file": ("backup.json", json.dumps(backup), "application/json")},
+        headers=admin,
+    )
+    assert response.status_code == 200
+    assert identity_cache.get(user.id) is None
+    assert client.get("/admin/reports", headers=headers).status_code == 200
+    db.close()
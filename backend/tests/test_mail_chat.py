@@ -7,10 +7,11 @@ from unittest.mock import MagicMock, patch
 # Ensure backend path is in sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.api.dependencies import get_current_user_from_header, require_admin
+from app.api.dependencies import get_current_identity, require_admin
 from app.core.database import get_db
 from app.db import models
 from app.main import app
+from app.services.identity_cache import Identity
 
 # client = TestClient(app)
 
@@ -55,8 +56,8 @@ def test_get_conversations_mock_db(client):
     mock_db = MagicMock()
 
     # Mock Current User
-    current_user = models.User(id=1, username="me", role="user")
-    app.dependency_overrides[get_current_user_from_header] = lambda: current_user
+    current_user = Identity(id=1, role="user", is_active=True, is_guest=False, username="me")
+    app.dependency_overrides[get_current_identity] = lambda: current_user
     app.dependency_overrides[get_db] = lambda: mock_db
 
     # Setup Mock Data: Messages
@@ -88,10 +89,11 @@ def test_get_conversations_mock_db(client):
 
     # For the second query (Users), we need to handle that `query` satisfies both Message and User calls.
     # Side effect for `query(Model)`?
-    def query_side_effect(model):
-        if model == models.Message:
+    # Column queries (the message archive lookup) get an empty MagicMock chain
+    def query_side_effect(model, *columns):
+        if model is models.Message:
             return mock_query  # Return the chain starter for Messages
-        elif model == models.User:
+        elif model is models.User:
             # Create a new mock chain for User
             u_query = MagicMock()
             u_query.filter.return_value.all.return_value = [partner_user]
@@ -112,3 +114,33 @@ def test_get_conversations_mock_db(client):
     assert data[0]["unread_count"] == 1  # Since is_read=False and receiver=me
 
     app.dependency_overrides = {}
+
+
+# --- SUPPORT MAIL DIGEST ---
+def test_support_mail_burst_is_coalesced():
+    import asyncio
+
+    from app.services.support_mail import SupportMailForwarder
+
+    forwarder = SupportMailForwarder()
+    delivered = []
+
+    async def burst():
+        with patch.object(
+            forwarder, "_deliver", side_effect=lambda uid, entry: delivered.append((uid, entry))
+        ):
+            for i in range(3):
+                forwarder.enqueue(5, "alice", f"Help {i}", "support@example.com", 0.05)
+            assert delivered == []  # Nothing sent inline
+            await asyncio.sleep(0.2)
+
+    asyncio.run(burst())
+
+    assert len(delivered) == 1
+    user_id, entry = delivered[0]
+    assert user_id == 5
+    assert [content for _, content in entry["messages"]] == ["Help 0", "Help 1", "Help 2"]
+
+    subject, content = SupportMailForwarder.build_digest(user_id, entry)
+    assert subject == "Support Request: alice (3 messages)"
+    assert "Help 2" in content
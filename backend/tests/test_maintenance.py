@@ -0,0 +1,46 @@
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.services.utils import save_setting
+
+
+@pytest.fixture
+def maintenance(client, test_db):
+    db = test_db()
+    save_setting(db, "maintenance_mode", True)
+    try:
+        yield
+    finally:
+        save_setting(db, "maintenance_mode", False)
+        db.close()
+
+
+def test_maintenance_blocks_users_but_not_admins(client, maintenance):
+    assert client.get("/notifications", headers={"X-User-Id": "3"}).status_code == 503
+    assert client.get("/notifications", headers={"X-User-Id": "1"}).status_code == 200
+    # Whitelisted paths keep working
+    assert client.get("/public-config").status_code == 200
+
+
+def test_maintenance_rejects_websockets_of_non_admins(client, maintenance):
+    with pytest.raises(WebSocketDisconnect) as exc:
+        with client.websocket_connect("/ws/chat?token=3"):
+            pass
+    assert exc.value.code == 1013
+
+    with client.websocket_connect("/ws/chat?token=1") as ws:
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json()["type"] == "pong"
+
+
+def test_requests_pass_without_db_access_when_inactive(client, monkeypatch):
+    from app.middleware.maintenance import MaintenanceState, maintenance_state
+
+    client.get("/health")  # Warm the cached state
+
+    def fail_load():
+        raise AssertionError("maintenance state must come from memory")
+
+    monkeypatch.setattr(MaintenanceState, "_load", staticmethod(fail_load))
+    assert not maintenance_state.is_stale()
+    assert client.get("/health").status_code == 200
@@ -0,0 +1,215 @@
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import models
+from app.services import message_crypto
+from app.services.message_archive import (archive_old_messages,
+                                          load_archived_messages)
+
+
+def add_message(db, content, days_ago, sender_id=1, receiver_id=3, is_read=True):
+    from app.api.routers.chat import encrypt_message
+
+    msg = models.Message(
+        sender_id=sender_id,
+        receiver_id=receiver_id,
+        content=encrypt_message(content),
+        timestamp=datetime.utcnow() - timedelta(days=days_ago),
+        is_read=is_read,
+    )
+    db.add(msg)
+    db.commit()
+    return msg.id
+
+
+def test_old_messages_move_to_archive_and_stay_readable(client, test_db):
+    db = test_db()
+    db.query(models.Message).delete()
+    db.commit()
+    add_message(db, "very old", 400)
+    add_message(db, "old reply", 399, sender_id=3, receiver_id=1)
+    add_message(db, "recent", 1)
+
+    moved = archive_old_messages(db, datetime.utcnow() - timedelta(days=180), batch_size=1)
+    assert moved == 2
+    assert db.query(models.Message).count() == 1
+    archive = db.query(models.MessageArchive).one()
+    assert (archive.user_low, archive.user_high, archive.message_count) == (1, 3, 2)
+
+    headers = {"X-User-Id": "1"}
+    history = client.get("/chat/history/3", headers=headers).json()
+    assert [m["content"] for m in history] == ["very old", "old reply", "recent"]
+
+    stream = client.get("/chat/history/3/stream", headers=headers).text.splitlines()
+    assert [json.loads(line)["content"] for line in stream] == ["very old", "old reply", "recent"]
+
+    db.query(models.MessageArchive).delete()
+    db.commit()
+    db.close()
+
+
+def test_reencryption_covers_archived_messages(test_db, tmp_path, monkeypatch):
+    ring = message_crypto.MessageKeyring(str(tmp_path / "secret.key"))
+    monkeypatch.setattr(message_crypto, "keyring", ring)
+
+    db = test_db()
+    db.query(models.Message).delete()
+    for i in range(3):
+        db.add(
+            models.Message(
+                sender_id=1,
+                receiver_id=2,
+                content=ring.encrypt(f"archived {i}"),
+                timestamp=datetime.utcnow() - timedelta(days=365),
+                is_read=True,
+            )
+        )
+    db.commit()
+    archive_old_messages(db, datetime.utcnow() - timedelta(days=30))
+
+    ring.rotate()
+    message_crypto.ReencryptionJob().run(batch_size=2, pause_seconds=0, restart=True)
+    status = message_crypto.get_reencryption_status(db)
+    assert status["status"] == "completed"
+    assert status["archives_processed"] == 1
+
+    ring.prune()
+    contents = [ring.decrypt(m["content"]) for m in load_archived_messages(db, 1, 2)]
+    assert contents == [f"archived {i}" for i in range(3)]
+
+    db.query(models.MessageArchive).delete()
+    db.commit()
+    db.close()
+
+
+def test_full_backup_roundtrips_archive_payload(client, test_db):
+    db = test_db()
+    db.query(models.Message).delete()
+    db.commit()
+    add_message(db, "backed up", 400)
+    archive_old_messages(db, datetime.utcnow() - timedelta(days=180))
+    payload = db.query(models.MessageArchive).one().payload
+
+    headers = {"X-User-Id": "1"}
+    response = client.get("/admin/backup/database/export", headers=headers)
+    assert response.status_code == 200
+    backup = response.content
+
+    response = client.post(
+        "/admin/backup/database/import",
+        files={"file": ("backup.json", backup, "application/json")},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    db.expire_all()
+    assert db.query(models.MessageArchive).one().payload == payload
+    assert [m["content"] for m in client.get("/chat/history/3", headers=headers).json()] == [
+        "backed up"
+    ]
+
+    db.query(models.MessageArchive).delete()
+    db.commit()
+    db.close()
+
+
+def test_reencryption_does_not_overwrite_concurrent_merge(test_db, tmp_path, monkeypatch):
+    from app.services import message_archive
+
+    ring = message_crypto.MessageKeyring(str(tmp_path / "secret.key"))
+    monkeypatch.setattr(message_crypto, "keyring", ring)
+
+    db = test_db()
+    db.query(models.Message).delete()
+    db.commit()
+    month_start = datetime.utcnow().replace(day=1, hour=12) - timedelta(days=365)
+
+    def add(content, offset):
+        db.add(
+            models.Message(
+                sender_id=1,
+                receiver_id=3,
+                content=ring.encrypt(content),
+                timestamp=month_start + timedelta(days=offset),
+                is_read=True,
+            )
+        )
+        db.commit()
+
+    add("first", 0)
+    add("merged later", 1)
+    # Archive only the first message; the second one stays hot for now
+    archive_old_messages(db, month_start + timedelta(hours=1))
+
+    original = message_archive.reencrypt_payload
+    calls = []
+
+    def merge_in_between(payload, reencrypt):
+        if not calls:  # Nightly archival runs between the job's read and write
+            other = test_db()
+            archive_old_messages(other, datetime.utcnow() - timedelta(days=30))
+            other.close()
+        calls.append(1)
+        return original(payload, reencrypt)
+
+    monkeypatch.setattr(message_archive, "reencrypt_payload", merge_in_between)
+    ring.rotate()
+    message_crypto.ReencryptionJob().run(batch_size=50, pause_seconds=0, restart=True)
+    assert len(calls) == 2  # Conflicting write was retried
+
+    ring.prune()
+    contents = [ring.decrypt(m["content"]) for m in load_archived_messages(db, 1, 3)]
+    assert contents == ["first", "merged later"]
+
+    db.query(models.MessageArchive).delete()
+    db.commit()
+    db.close()
+
+
+def test_fully_archived_conversation_stays_in_inbox(client, test_db):
+    db = test_db()
+    db.query(models.Message).delete()
+    db.commit()
+    add_message(db, "long ago", 400, sender_id=3, receiver_id=1)
+    archive_old_messages(db, datetime.utcnow() - timedelta(days=180))
+    assert db.query(models.Message).count() == 0
+
+    conversations = client.get("/chat/conversations", headers={"X-User-Id": "1"}).json()
+    assert [(c["partner_id"], c["last_message"], c["unread_count"]) for c in conversations] == [
+        (3, "long ago", 0)
+    ]
+
+    db.query(models.MessageArchive).delete()
+    db.commit()
+    db.close()
+
+
+def test_unread_messages_stay_hot_until_read(client, test_db):
+    db = test_db()
+    db.query(models.Message).delete()
+    db.commit()
+    add_message(db, "read", 400, sender_id=3, receiver_id=1)
+    add_message(db, "unread", 399, sender_id=3, receiver_id=1, is_read=False)
+    cutoff = datetime.utcnow() - timedelta(days=180)
+
+    assert archive_old_messages(db, cutoff) == 1
+    headers = {"X-User-Id": "1"}
+    conversations = client.get("/chat/conversations", headers=headers).json()
+    assert [(c["last_message"], c["unread_count"]) for c in conversations] == [("unread", 1)]
+
+    # Opening the history marks it read; the next run archives it
+    history = client.get("/chat/history/3", headers=headers).json()
+    assert [m["content"] for m in history] == ["read", "unread"]
+    assert archive_old_messages(db, cutoff) == 1
+    assert db.query(models.Message).count() == 0
+    conversations = client.get("/chat/conversations", headers=headers).json()
+    assert [(c["last_message"], c["unread_count"]) for c in conversations] == [("unread", 0)]
+    history = client.get("/chat/history/3", headers=headers).json()
+    assert all(m["is_read"] for m in history)
+
+    db.query(models.MessageArchive).delete()
+    db.commit()
+    db.close()
@@ -5,22 +5,23 @@ from unittest.mock import MagicMock
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.api.dependencies import get_current_user_from_header
+from app.api.dependencies import get_current_identity
 from app.core.database import get_db
 from app.db import models
 from app.main import app
+from app.services.identity_cache import Identity
 
 # client = TestClient(app)
 
 
-def mock_user_dep(id=1, email="notif@test.com"):
-    user = models.User(id=id, email=email, role="user", is_active=True)
+def mock_user_dep(id=1):
+    user = Identity(id=id, role="user", is_active=True, is_guest=False)
     return lambda: user
 
 
 def test_get_notifications_empty(client):
     mock_db = MagicMock()
-    app.dependency_overrides[get_current_user_from_header] = mock_user_dep()
+    app.dependency_overrides[get_current_identity] = mock_user_dep()
     app.dependency_overrides[get_db] = lambda: mock_db
 
     # Mock query returning empty list
@@ -52,13 +53,13 @@ def test_get_notifications_empty(client):
     assert response.status_code == 200  # If 404, path is wrong.
     assert response.json() == []
 
-    del app.dependency_overrides[get_current_user_from_header]
+    del app.dependency_overrides[get_current_identity]
     del app.dependency_overrides[get_db]
 
 
 def test_mark_notification_read(client):
     mock_db = MagicMock()
-    app.dependency_overrides[get_current_user_from_header] = mock_user_dep()
+    app.dependency_overrides[get_current_identity] = mock_user_dep()
     app.dependency_overrides[get_db] = lambda: mock_db
 
     # Mock finding the notification
@@ -71,5 +72,5 @@ def test_mark_notification_read(client):
     assert mock_notif.is_read == True
     mock_db.commit.assert_called_once()
 
-    del app.dependency_overrides[get_current_user_from_header]
+    del app.dependency_overrides[get_current_identity]
     del app.dependency_overrides[get_db]
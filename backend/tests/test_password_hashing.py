@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+from app.core import security
+from app.core.exceptions import ServiceBusyError
+from app.core.security import HashingExecutor, hash_password, needs_rehash
+from app.db import models
+from app.services.metrics import metrics
+
+
+def test_hashing_executor_rejects_when_saturated():
+    executor = HashingExecutor(workers=1, queue_limit=0)
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    worker = threading.Thread(target=executor.run_sync, args=(slow,))
+    worker.start()
+    assert started.wait(5)
+
+    rejected_before = metrics.snapshot()["counters"].get("password_hash.rejected", 0)
+    with pytest.raises(ServiceBusyError):
+        executor.run_sync(slow)
+    assert metrics.snapshot()["counters"]["password_hash.rejected"] == rejected_before + 1
+
+    release.set()
+    worker.join(5)
+    assert executor.in_flight == 0
+    assert executor.run_sync(lambda: "ok") == "ok"
+
+
+def test_needs_rehash_compares_cost():
+    hashed = hash_password("Secret123!", rounds=4)
+    assert needs_rehash(hashed, rounds=5)
+    assert not needs_rehash(hashed, rounds=4)
+    assert not needs_rehash("!", rounds=4)  # Unusable placeholder hashes
+
+
+def test_login_upgrades_hash_cost(client, test_db, monkeypatch):
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 5)
+    db = test_db()
+    user = models.User(
+        username="rehash_probe",
+        email="rehash_probe@example.com",
+        hashed_password=hash_password("Secret123!", rounds=4),
+        role="user",
+        is_active=True,
+        is_verified=True,
+        two_factor_method="none",
+    )
+    db.add(user)
+    db.commit()
+
+    response = client.post(
+        "/login", json={"login": "rehash_probe", "password": "Secret123!"}
+    )
+    assert response.status_code == 200
+
+    db.refresh(user)
+    assert user.hashed_password.startswith("$2b$05$")
+    assert security.verify_password("Secret123!", user.hashed_password)
+    assert "password_hash.verify_password" in metrics.snapshot()["latency"]
+
+    stats = client.get("/admin/metrics", headers={"X-User-Id": "1"}).json()
+    assert stats["latency"]["password_hash.hash_password"]["count"] >= 1
+    db.close()
+
+
+def test_service_busy_sets_retry_after(client, monkeypatch):
+    async def busy(*args):
+        raise ServiceBusyError(retry_after=2)
+
+    monkeypatch.setattr(security.hashing_executor, "run", busy)
+    response = client.post(
+        "/login", json={"login": "rehash_probe", "password": "Secret123!"}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+    assert response.json()["error"]["code"] == "SERVICE_BUSY"
+
+
+def test_endpoints_hash_on_the_pool_without_blocking_a_worker(client, test_db, monkeypatch):
+    from app.services.ephemeral_store import ephemeral_store
+
+    def blocking(*args):
+        raise AssertionError("endpoint waited for bcrypt on a threadpool worker")
+
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 4)
+    monkeypatch.setattr(security.hashing_executor, "run_sync", blocking)
+    admin = {"X-User-Id": "1"}
+
+    response = client.post(
+        "/admin/users",
+        json={
+            "username": "pool_probe",
+            "email": "pool_probe@example.com",
+            "password": "Secret123!",
+            "role": "user",
+        },
+        headers=admin,
+    )
+    assert response.status_code == 200
+    db = test_db()
+    user = db.query(models.User).filter_by(username="pool_probe").one()
+    assert security.verify_password("Secret123!", user.hashed_password)
+
+    response = client.put(f"/admin/users/{user.id}", json={"password": "Secret456!"}, headers=admin)
+    assert response.status_code == 200
+    db.refresh(user)
+    assert security.verify_password("Secret456!", user.hashed_password)
+
+    ephemeral_store.set("password_reset:pool-token", user.id, 60)
+    response = client.post(
+        "/auth/password-reset/confirm",
+        json={"token": "pool-token", "new_password": "Secret789!"},
+    )
+    assert response.status_code == 200
+    db.refresh(user)
+    assert security.verify_password("Secret789!", user.hashed_password)
+    db.close()
@@ -1,7 +1,8 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
-from app.services.password_validation import (check_pwned_password,
+from app.services.password_validation import (check_pwned_password_async,
                                               validate_password_complexity)
 
 
@@ -37,48 +38,137 @@ def test_password_complexity_missing_special():
 
 
 # --- LEAK CHECK TESTS ---
-@patch("app.services.password_validation.httpx.Client")
-def test_pwned_check_clean(mock_client_cls):
-    # Mock Response: No leak
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.text = "ABC12:1\nDEF34:5"  # Suffixes that don't match
+@pytest.fixture
+def hibp_response(monkeypatch):
+    """Serves the given response from a fake shared client, with an empty range cache."""
+    from app.services import password_validation
+
+    client = MagicMock()
+    client.get = AsyncMock()
+    monkeypatch.setattr(password_validation, "get_http_client", lambda: client)
+    monkeypatch.setattr(password_validation, "range_cache", password_validation.RangeCache())
+
+    def respond(status_code, text=""):
+        client.get.return_value = MagicMock(status_code=status_code, text=text)
+        return client
 
-    # Setup Context Manager
-    mock_client = mock_client_cls.return_value
-    mock_client.__enter__.return_value.get.return_value = mock_response
+    return respond
 
-    check_pwned_password("CleanPassword123!")
 
+def test_pwned_check_clean(hibp_response):
+    # Mock Response: No leak
+    hibp_response(200, "ABC12:1\nDEF34:5")  # Suffixes that don't match
+
+    asyncio.run(check_pwned_password_async("CleanPassword123!"))
 
-@patch("app.services.password_validation.httpx.Client")
-def test_pwned_check_leaked(mock_client_cls):
+
+def test_pwned_check_leaked(hibp_response):
     # Mock Leaked: "password" -> SHA1: 5BAA61E4C9B93F3F0682250B6CF8331B7EE68FD8
     # Prefix: 5BAA6
     # Suffix: 1E4C9B93F3F0682250B6CF8331B7EE68FD8
 
-    mock_response = MagicMock()
-    mock_response.status_code = 200
     # Simulate API returning the matching suffix
-    mock_response.text = "1E4C9B93F3F0682250B6CF8331B7EE68FD8:99999\nOTHERHASH:1"
-
-    mock_client = mock_client_cls.return_value
-    mock_client.__enter__.return_value.get.return_value = mock_response
+    client = hibp_response(200, "1E4C9B93F3F0682250B6CF8331B7EE68FD8:99999\nOTHERHASH:1")
 
     with pytest.raises(ValueError, match="exposed in a data breach"):
-        check_pwned_password(
-            "password"
-        )  # Real password doesn't matter as we mock the hash logic essentially via API response simulation
+        asyncio.run(check_pwned_password_async("password"))
+    # Only the hash prefix leaves the server
+    assert client.get.await_args.args[0].endswith("/range/5BAA6")
 
 
-@patch("app.services.password_validation.httpx.Client")
-def test_pwned_check_api_fail_fails_open(mock_client_cls):
+def test_pwned_check_api_fail_fails_open(hibp_response):
     # Ensure if API is down (503), we DO NOT raise exception (Fail Open)
-    mock_response = MagicMock()
-    mock_response.status_code = 503
-
-    mock_client = mock_client_cls.return_value
-    mock_client.__enter__.return_value.get.return_value = mock_response
+    hibp_response(503)
 
     # Should NOT raise
-    check_pwned_password("AnyPassword")
+    asyncio.run(check_pwned_password_async("AnyPassword"))
+
+
+# --- OFFLINE FILTER TESTS ---
+def test_pwned_check_offline_filter(hibp_response, tmp_path, monkeypatch):
+    from app.scripts.build_pwned_filter import iter_hashes
+    from app.services import pwned_filter
+
+    client = hibp_response(503)
+    # Range file layout of the HIBP downloader: <prefix>.txt with SUFFIX:COUNT
+    dump = tmp_path / "ranges"
+    dump.mkdir()
+    (dump / "5BAA6.txt").write_text("1E4C9B93F3F0682250B6CF8331B7EE68FD8:99999\r\n")
+    (dump / "00000.txt").write_text("0005AD76BD555C1D6D771DE417A4B87E4B4:10\r\n")
+    path = str(tmp_path / "pwned.bloom")
+    digests = (bytes.fromhex(h) for h, _ in iter_hashes(str(dump)))
+    assert pwned_filter.build_filter(path, digests, items=2) == 2
+
+    monkeypatch.setattr(pwned_filter, "PWNED_PASSWORDS_FILTER", path)
+    monkeypatch.setattr(pwned_filter, "_filter", None)
+    with pytest.raises(ValueError, match="exposed in a data breach"):
+        asyncio.run(check_pwned_password_async("password"))
+    asyncio.run(check_pwned_password_async("CleanPassword123!"))
+    client.get.assert_not_called()
+    pwned_filter.get_pwned_filter().close()
+
+
+# --- ASYNC / CACHED RANGE TESTS ---
+def test_pwned_check_async_caches_ranges(monkeypatch):
+    from app.services import password_validation
+
+    responses = [
+        MagicMock(status_code=503),
+        MagicMock(status_code=200, text="1E4C9B93F3F0682250B6CF8331B7EE68FD8:99999"),
+    ]
+    client = MagicMock()
+
+    async def get(url, **kwargs):
+        assert url.endswith("/range/5BAA6")
+        return responses.pop(0)
+
+    client.get = get
+    monkeypatch.setattr(password_validation, "get_http_client", lambda: client)
+    monkeypatch.setattr(password_validation, "range_cache", password_validation.RangeCache())
+
+    # Failures are not cached: the next lookup asks the API again
+    asyncio.run(password_validation.check_pwned_password_async("password"))
+    for _ in range(2):  # Second lookup is served from the cache
+        with pytest.raises(ValueError, match="seen 99999 times"):
+            asyncio.run(password_validation.check_pwned_password_async("password"))
+    assert responses == []
+
+
+def test_account_password_change_uses_cached_range_check(client, test_db, monkeypatch):
+    from app.api.routers import users
+    from app.db import models
+    from app.services import password_validation
+
+    range_requests = []
+
+    async def get(url, **kwargs):
+        range_requests.append(url)
+        return MagicMock(status_code=200, text="0000000000000000000000000000000000:1")
+
+    monkeypatch.setattr(password_validation, "get_http_client", lambda: MagicMock(get=get))
+    monkeypatch.setattr(password_validation, "range_cache", password_validation.RangeCache())
+    monkeypatch.setattr(users, "send_password_changed_notification", lambda *args: None)
+
+    db = test_db()
+    user = models.User(
+        username="account_probe",
+        email="account_probe@example.com",
+        hashed_password="!",
+        role="user",
+        is_active=True,
+    )
+    db.add(user)
+    db.commit()
+
+    for _ in range(2):
+        response = client.put(
+            f"/users/{user.id}/account",
+            json={"password": "N3w-Secret!"},
+            headers={"X-User-Id": str(user.id)},
+        )
+        assert response.status_code == 200
+    assert len(range_requests) == 1  # Second change is served from the cache
+
+    db.refresh(user)
+    assert user.hashed_password != "!"
+    db.close()
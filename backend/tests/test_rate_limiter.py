@@ -0,0 +1,82 @@
+from app.db import models
+from app.services.rate_limiter import (DatabaseRateLimitBackend,
+                                       MemoryRateLimitBackend, RateLimiter)
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_attempts_decay_over_sliding_window():
+    clock = FakeClock()
+    limiter = RateLimiter(MemoryRateLimitBackend(clock=clock), window_seconds=100)
+    for _ in range(4):
+        limiter.record_failed_attempt("1.2.3.4")
+    assert limiter.get_attempt_count("1.2.3.4") == 4
+
+    clock.now += 150  # Half of the previous window still overlaps
+    assert limiter.get_attempt_count("1.2.3.4") == 2
+    clock.now += 100
+    assert limiter.get_attempt_count("1.2.3.4") == 0
+
+
+def test_lockout_and_clear():
+    clock = FakeClock()
+    limiter = RateLimiter(MemoryRateLimitBackend(clock=clock), window_seconds=3600)
+    for _ in range(5):
+        limiter.record_failed_attempt("10.0.0.1")
+
+    assert limiter.check_rate_limit("10.0.0.1", threshold=5, lockout_minutes=10) == (True, 5, 600)
+    clock.now += 60
+    assert limiter.check_rate_limit("10.0.0.1", threshold=5, lockout_minutes=10) == (True, 5, 540)
+    assert limiter.check_rate_limit("10.0.0.2", threshold=5) == (False, 0, 0)
+
+    limiter.clear_attempts("10.0.0.1")
+    assert limiter.check_rate_limit("10.0.0.1", threshold=5) == (False, 0, 0)
+
+
+def test_timing_wheel_expires_rotating_ips():
+    clock = FakeClock()
+    backend = MemoryRateLimitBackend(stripes=16, resolution=10, clock=clock)
+    limiter = RateLimiter(backend, window_seconds=60)
+    for i in range(1000):
+        limiter.record_failed_attempt(f"192.168.{i // 256}.{i % 256}")
+    assert len(backend) == 1000
+    assert all(stripe.entries for stripe in backend._stripes)
+
+    clock.now += 200
+    # The first access in a new slot expires the passed slots of every stripe,
+    # not only of the stripe the key hashes to
+    limiter.record_failed_attempt("172.16.0.1")
+    assert len(backend) == 1
+    assert sum(len(stripe.wheel) for stripe in backend._stripes) == 1
+
+
+def test_database_backend_is_shared(client, test_db):
+    clock = FakeClock()
+    worker_a = RateLimiter(DatabaseRateLimitBackend(test_db, clock=clock), 3600)
+    worker_b = RateLimiter(DatabaseRateLimitBackend(test_db, clock=clock), 3600)
+
+    worker_a.record_failed_attempt("203.0.113.7")
+    assert worker_b.record_failed_attempt("203.0.113.7") == 2
+    assert worker_b.check_rate_limit("203.0.113.7", threshold=2, lockout_minutes=1)[0]
+    assert worker_a.check_rate_limit("203.0.113.7", threshold=2, lockout_minutes=1) == (
+        True,
+        2,
+        60,
+    )
+
+    # Expired rows are purged by the next access
+    clock.now += 3 * 3600
+    worker_a.get_attempt_count("198.51.100.1")
+    db = test_db()
+    assert db.query(models.RateLimitEntry).count() == 0
+    db.close()
+
+    worker_a.record_failed_attempt("203.0.113.7")
+    worker_b.clear_attempts("203.0.113.7")
+    assert worker_a.get_attempt_count("203.0.113.7") == 0
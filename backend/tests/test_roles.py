@@ -5,22 +5,17 @@ import sys
 # Ensure backend path is in sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.api.dependencies import (get_current_user_from_header, require_admin)
+from app.api.dependencies import get_current_identity, require_admin
 from app.db import models
 from app.main import app
+from app.services.identity_cache import Identity
 
 # client = TestClient(app)
 
 
 # Helper to mock user
 def mock_user_dep(role="user", id=1):
-    user = models.User(
-        id=id,
-        username=f"mock_{role}",
-        role=role,
-        email=f"{role}@test.com",
-        is_active=True,
-    )
+    user = Identity(id=id, role=role, is_active=True, is_guest=False, username=f"mock_{role}")
     return lambda: user
 
 
@@ -32,9 +27,9 @@ def test_guest_access_denied(client):
     # We need to override the dependency that *calls* require_admin?
     # No, require_admin IS the dependency. If we return a guest user from it, the *endpoint* thinks we are admin IF the dependency logic was "return user".
     # BUT `require_admin` implementation checks role.
-    # WE MUST OVERRIDE `get_current_user_from_header` to return a guest, and let `require_admin` do its check.
+    # WE MUST OVERRIDE `get_current_identity` to return a guest, and let `require_admin` do its check.
 
-    app.dependency_overrides[get_current_user_from_header] = mock_user_dep(role="guest")
+    app.dependency_overrides[get_current_identity] = mock_user_dep(role="guest")
     # We must CLEAR require_admin override if it was set elsewhere, but here we just set get_current_user
 
     response = client.get("/admin/users", headers={"X-User-ID": "1"})
@@ -43,14 +38,14 @@ def test_guest_access_denied(client):
     response = client.get("/admin/reports", headers={"X-User-ID": "1"})
     assert response.status_code == 403
 
-    del app.dependency_overrides[get_current_user_from_header]
+    del app.dependency_overrides[get_current_identity]
     if require_admin in app.dependency_overrides:
         del app.dependency_overrides[require_admin]
 
 
 # --- TEST USER TESTS ---
 def test_test_user_access_denied(client):
-    app.dependency_overrides[get_current_user_from_header] = mock_user_dep(role="test")
+    app.dependency_overrides[get_current_identity] = mock_user_dep(role="test")
 
     response = client.get("/admin/users", headers={"X-User-ID": "1"})
     assert response.status_code == 403
@@ -58,14 +53,14 @@ def test_test_user_access_denied(client):
     response = client.get("/admin/reports", headers={"X-User-ID": "1"})
     assert response.status_code == 403
 
-    del app.dependency_overrides[get_current_user_from_header]
+    del app.dependency_overrides[get_current_identity]
     if require_admin in app.dependency_overrides:
         del app.dependency_overrides[require_admin]
 
 
 # --- USER TESTS ---
 def test_standard_user_access_denied(client):
-    app.dependency_overrides[get_current_user_from_header] = mock_user_dep(role="user")
+    app.dependency_overrides[get_current_identity] = mock_user_dep(role="user")
 
     response = client.get("/admin/users", headers={"X-User-ID": "1"})
     assert response.status_code == 403
@@ -73,14 +68,14 @@ def test_standard_user_access_denied(client):
     response = client.get("/admin/reports", headers={"X-User-ID": "1"})
     assert response.status_code == 403
 
-    del app.dependency_overrides[get_current_user_from_header]
+    del app.dependency_overrides[get_current_identity]
     if require_admin in app.dependency_overrides:
         del app.dependency_overrides[require_admin]
 
 
 # --- MODERATOR TESTS ---
 def test_moderator_access(client):
-    app.dependency_overrides[get_current_user_from_header] = mock_user_dep(
+    app.dependency_overrides[get_current_identity] = mock_user_dep(
         role="moderator"
     )
 
@@ -95,14 +90,14 @@ def test_moderator_access(client):
     response = client.get("/admin/reports", headers={"X-User-ID": "1"})
     assert response.status_code == 200
 
-    del app.dependency_overrides[get_current_user_from_header]
+    del app.dependency_overrides[get_current_identity]
     if require_admin in app.dependency_overrides:
         del app.dependency_overrides[require_admin]
 
 
 # --- ADMIN TESTS ---
 def test_admin_access(client):
-    app.dependency_overrides[get_current_user_from_header] = mock_user_dep(role="admin")
+    app.dependency_overrides[get_current_identity] = mock_user_dep(role="admin")
 
     # Admin CAN access users
     response = client.get("/admin/users", headers={"X-User-ID": "1"})
@@ -112,7 +107,7 @@ def test_admin_access(client):
     response = client.get("/admin/reports", headers={"X-User-ID": "1"})
     assert response.status_code == 200
 
-    del app.dependency_overrides[get_current_user_from_header]
+    del app.dependency_overrides[get_current_identity]
     if require_admin in app.dependency_overrides:
         del app.dependency_overrides[require_admin]
 
@@ -132,7 +127,7 @@ def test_guest_match_visibility(client):
 
     # Better: Override `get_db` to generic mocked session? No, `client` uses `TestingSessionLocal`.
     # Let's use `client` to create users as admin first?
-    app.dependency_overrides[get_current_user_from_header] = mock_user_dep(role="admin")
+    app.dependency_overrides[get_current_identity] = mock_user_dep(role="admin")
 
     # Create Dummy
     # We can't easily create a 'test' role user via API unless we are admin and use SQL?
@@ -150,6 +145,8 @@ def test_guest_match_visibility(client):
     # Let's write a targeted test that mocks the DB session result!
     # That validates the logic in `get_matches`.
 
+    del app.dependency_overrides[get_current_identity]
+
 
 from unittest.mock import MagicMock, patch
 
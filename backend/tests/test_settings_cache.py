@@ -0,0 +1,61 @@
+from unittest.mock import patch
+
+from app.db import models, schemas
+from app.services.utils import (SettingsCache, SettingsSnapshot,
+                                bump_shared_settings_version,
+                                create_html_email, get_setting, save_setting)
+
+
+def test_get_setting_is_cached_and_returns_copies(test_db):
+    db = test_db()
+    save_setting(db, "cache_probe", {"nested": {"flag": True}})
+
+    first = get_setting(db, "cache_probe", {})
+    first["nested"]["flag"] = False  # Callers (admin) mutate returned dicts
+
+    with patch.object(db, "query", wraps=db.query) as query:
+        assert get_setting(db, "cache_probe", {}) == {"nested": {"flag": True}}
+        assert query.call_count == 0
+
+    # Missing keys are cached as well and still return the default
+    assert get_setting(db, "cache_probe_missing", {"a": 1}) == {"a": 1}
+    db.close()
+
+
+def test_shared_version_invalidates_other_workers(test_db):
+    db = test_db()
+    save_setting(db, "cache_shared", {"value": 1})
+
+    # A second worker with its own cache
+    other = SettingsCache(ttl=300, check_interval=0)
+    assert other.get(db, "cache_shared") == {"value": 1}
+
+    # Another worker changes the row
+    row = db.query(models.SystemSetting).filter_by(key="cache_shared").first()
+    row.value = '{"value": 2}'
+    assert other.get(db, "cache_shared") == {"value": 1}  # No version change yet
+
+    bump_shared_settings_version(db)
+    db.commit()
+    assert other.get(db, "cache_shared") == {"value": 2}
+    db.close()
+
+
+def test_settings_snapshot_loads_each_key_once(test_db):
+    db = test_db()
+    save_setting(db, "registration", {"server_domain": "https://example.org"})
+    settings = SettingsSnapshot(db)
+
+    with patch("app.services.utils.get_setting", wraps=get_setting) as loader:
+        assert isinstance(settings.registration, schemas.RegistrationConfig)
+        assert settings.registration.server_domain == "https://example.org"
+        assert settings.maintenance_mode is False
+
+        # Email helpers share the snapshot instead of re-reading settings
+        html = create_html_email("Title", "Body", db=db, settings=settings)
+        create_html_email("Title", "Body", db=db, settings=settings)
+
+    assert "https://example.org/support" in html
+    keys = [call.args[1] for call in loader.call_args_list]
+    assert sorted(keys) == ["legal", "maintenance_mode", "registration", "support_page"]
+    db.close()
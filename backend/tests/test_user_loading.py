@@ -0,0 +1,33 @@
+from sqlalchemy import inspect
+
+from app.db import models
+
+
+def test_heavy_user_columns_are_deferred_unless_profiled(client, test_db):
+    db = test_db()
+    heavy = {"about_me", "answers", "app_settings", "webauthn_credentials", "push_subscription"}
+
+    user = db.query(models.User).filter(models.User.id == 1).first()
+    assert heavy <= inspect(user).unloaded
+    assert user.role == "admin"
+    db.close()
+
+    db = test_db()
+    card = (
+        db.query(models.User)
+        .options(*models.USER_MATCH_CARD)
+        .filter(models.User.id == 1)
+        .first()
+    )
+    assert not {"about_me", "answers"} & inspect(card).unloaded
+    assert {"app_settings", "webauthn_credentials", "push_subscription"} <= inspect(card).unloaded
+    db.close()
+
+    # Accessing a deferred column loads its whole group
+    db = test_db()
+    user = db.query(models.User).filter(models.User.id == 1).first()
+    user.app_settings
+    unloaded = inspect(user).unloaded
+    assert not {"app_settings", "webauthn_credentials", "push_subscription"} & unloaded
+    assert {"about_me", "answers"} <= unloaded
+    db.close()
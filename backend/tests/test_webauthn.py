@@ -0,0 +1,92 @@
+import base64
+import json
+from types import SimpleNamespace
+
+from app.api.routers import auth
+from app.db import models
+from app.scripts.init_data import migrate_webauthn_credentials
+from app.services.ephemeral_store import ephemeral_store
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _assertion(credential_id: str, challenge: str) -> dict:
+    client_data = json.dumps({"type": "webauthn.get", "challenge": challenge}).encode()
+    return {"id": credential_id, "response": {"clientDataJSON": _b64(client_data)}}
+
+
+def test_legacy_passkeys_are_migrated(client, test_db):
+    db = test_db()
+    user = models.User(
+        username="passkey_legacy",
+        email="passkey_legacy@example.com",
+        hashed_password="!",
+        webauthn_credentials=json.dumps(
+            [{"id": "bGVnYWN5", "public_key": "cGs", "sign_count": 3, "transports": ["usb"]}]
+        ),
+    )
+    db.add(user)
+    db.commit()
+
+    migrate_webauthn_credentials(db)
+    migrate_webauthn_credentials(db)  # Idempotent
+
+    db.expire_all()
+    passkeys = db.query(models.WebAuthnCredential).filter_by(user_id=user.id).all()
+    assert [(p.credential_id, p.sign_count, p.get_transports()) for p in passkeys] == [
+        ("bGVnYWN5", 3, ["usb"])
+    ]
+    assert user.webauthn_credentials == "[]"
+    assert user.has_passkeys
+    db.close()
+
+
+def test_usernameless_passkey_login(client, test_db, monkeypatch):
+    db = test_db()
+    user = models.User(
+        username="passkey_owner",
+        email="passkey_owner@example.com",
+        hashed_password="!",
+        is_active=True,
+    )
+    user.passkeys.append(
+        models.WebAuthnCredential(credential_id="Y3JlZA", public_key="cGs", sign_count=1)
+    )
+    db.add(user)
+    db.commit()
+
+    verified = []
+
+    def fake_verify(**kwargs):
+        verified.append(kwargs)
+        return SimpleNamespace(new_sign_count=kwargs["credential_current_sign_count"] + 1)
+
+    monkeypatch.setattr(auth, "verify_authentication_response", fake_verify)
+
+    options = client.post("/auth/2fa/webauthn/options", json={}).json()
+    assert options["user_id"] is None
+    assert options["options"]["allowCredentials"] == []
+    challenge = options["options"]["challenge"]
+
+    body = {"credential": _assertion("Y3JlZA", challenge)}
+    headers = {"Origin": "http://testserver"}
+    response = client.post("/auth/2fa/webauthn/verify", json=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["user_id"] == user.id
+    assert verified[0]["require_user_verification"] is True
+
+    db.expire_all()
+    assert user.passkeys[0].sign_count == 2
+
+    # Challenges are single use
+    response = client.post("/auth/2fa/webauthn/verify", json=body, headers=headers)
+    assert response.status_code == 400
+
+    # With a user_id, the credential has to belong to that user
+    ephemeral_store.set("webauthn:auth:1", challenge, 300)
+    body = {"credential": _assertion("Y3JlZA", challenge), "user_id": 1}
+    response = client.post("/auth/2fa/webauthn/verify", json=body, headers=headers)
+    assert response.status_code == 400
+    db.close()
@@ -0,0 +1,78 @@
+import asyncio
+
+import websockets
+
+from app.scripts.ws_load_test import (LoadStats, build_report, percentile,
+                                      reader)
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile([], 99) == 0.0
+    assert percentile([0.25], 50) == 0.25
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 50) == 51.0  # index round(49.5) -> 50
+    assert percentile(values, 90) == 90.0
+    assert percentile(values, 100) == 100.0
+    assert percentile(list(reversed(values)), 99) == 99.0
+
+
+def test_build_report_excludes_rate_limited_from_drops():
+    stats = LoadStats(sent=100, delivered=85, rate_limited=10, latencies=[0.01, 0.02, 0.5])
+    # Rate-limited messages never arrive, so they stay in flight with the drops
+    stats.in_flight = {f"lt|1:{i}": 0.0 for i in range(15)}
+    stats.rss_samples = [102400, 204800, 153600]
+
+    report = build_report(stats, duration=10)
+    assert report["drop_rate"] == round(5 / 90, 4)
+    assert report["throughput_per_second"] == 8.5
+    assert report["latency_ms"] == {"p50": 20.0, "p90": 500.0, "p95": 500.0, "p99": 500.0, "max": 500.0}
+    assert report["server_rss_mb"] == {"start": 100.0, "peak": 200.0, "end": 150.0}
+
+
+def test_build_report_without_traffic():
+    report = build_report(LoadStats(), duration=0)
+    assert report["drop_rate"] == 0.0
+    assert report["throughput_per_second"] == 0.0
+    assert report["latency_ms"]["max"] == 0.0
+    assert report["server_rss_mb"] is None
+
+
+class ClosingSocket:
+    """Delivers the given frames, then behaves like a socket the server closed."""
+
+    def __init__(self, frames, error=None):
+        self.frames = list(frames)
+        self.error = error
+        self.sent = []
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.frames:
+            return self.frames.pop(0)
+        if self.error:
+            raise self.error
+        raise StopAsyncIteration
+
+    async def send(self, data):
+        self.sent.append(data)
+
+
+def test_reader_counts_server_side_disconnects():
+    stats = LoadStats()
+    stats.in_flight["lt|2:0"] = 0.0
+    frame = '{"sender_id": 2, "receiver_id": 1, "content": "lt|2:0"}'
+
+    asyncio.run(reader(ClosingSocket([frame, '{"type": "ping"}']), 1, stats))
+    assert stats.delivered == 1
+    assert stats.disconnects == 1
+
+    error = websockets.ConnectionClosedError(None, None)
+    asyncio.run(reader(ClosingSocket([], error=error), 2, stats))
+    assert stats.disconnects == 2
+
+    # The sender noticing the same closed socket does not count it twice
+    stats.record_disconnect(2)
+    assert stats.disconnects == 2
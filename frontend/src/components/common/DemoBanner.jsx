@@ -10,6 +10,7 @@ const DemoBanner = () => {
     const [memberCount, setMemberCount] = useState(10000);
     const [lastEvent, setLastEvent] = useState(null);
     const ws = useRef(null);
+    const reconnectTimeout = useRef(null);
 
     const WS_URL = API_URL.replace("http", "ws");
 
@@ -44,21 +45,35 @@ const DemoBanner = () => {
             return;
         }
 
+        // Set on cleanup so the close we trigger ourselves does not reconnect
+        let closed = false;
+
         const connect = () => {
             // Prevent multiple connections
             if (ws.current && ws.current.readyState === WebSocket.OPEN) return;
 
             // Using user token (ID)
             const token = user.user_id || localStorage.getItem('token');
-            ws.current = new WebSocket(`${WS_URL}/ws/chat?token=${token}`);
-
-            ws.current.onopen = () => setIsConnected(true);
-            ws.current.onclose = () => setIsConnected(false);
+            const socket = new WebSocket(`${WS_URL}/ws/chat?token=${token}`);
+
+            socket.onopen = () => setIsConnected(true);
+            socket.onclose = () => {
+                setIsConnected(false);
+                if (closed) return;
+                if (reconnectTimeout.current) clearTimeout(reconnectTimeout.current);
+                reconnectTimeout.current = setTimeout(connect, 3000);
+            };
 
-            ws.current.onmessage = (event) => {
+            socket.onmessage = (event) => {
                 try {
                     const data = JSON.parse(event.data);
 
+                    // Server heartbeat: answer so the connection is not reaped as idle
+                    if (data.type === 'ping') {
+                        socket.send(JSON.stringify({ type: 'pong' }));
+                        return;
+                    }
+
                     // Handle Demo Events
                     if (data.type === 'demo_message') {
                         setLastEvent({
@@ -85,11 +100,15 @@ const DemoBanner = () => {
                     // Silently ignore malformed JSON
                 }
             };
+
+            ws.current = socket;
         };
 
         connect();
 
         return () => {
+            closed = true;
+            if (reconnectTimeout.current) clearTimeout(reconnectTimeout.current);
             if (ws.current) ws.current.close();
         };
     }, [status, user, WS_URL]);
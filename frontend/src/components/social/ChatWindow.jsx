@@ -5,6 +5,12 @@ import { Button } from '../ui/Button';
 import { Input } from '../ui/Input';
 import { Card } from '../ui/Card';
 
+// Highest persisted (non-transient) message ID in a list
+const maxPersistedId = (msgs, current) => msgs.reduce(
+    (max, m) => (!m.is_transient && (max === null || m.id > max) ? m.id : max),
+    current
+);
+
 const ChatWindow = ({ currentUser, chatPartner, token, onClose, supportChatEnabled = false, t }) => {
     const [messages, setMessages] = useState([]);
     const [input, setInput] = useState("");
@@ -13,6 +19,8 @@ const ChatWindow = ({ currentUser, chatPartner, token, onClose, supportChatEnabl
     const ws = useRef(null);
     const messagesEndRef = useRef(null);
     const reconnectTimeout = useRef(null);
+    // Highest persisted message ID seen, used to only sync missed messages on reconnect
+    const lastSeenId = useRef(null);
 
     const WS_URL = API_URL.replace("http", "ws");
 
@@ -22,15 +30,32 @@ const ChatWindow = ({ currentUser, chatPartner, token, onClose, supportChatEnabl
 
     const fetchHistory = useCallback(async () => {
         try {
-            const res = await fetch(`${API_URL}/chat/history/${chatPartner.id}`, {
+            // NDJSON stream: long histories render progressively
+            const res = await fetch(`${API_URL}/chat/history/${chatPartner.id}/stream`, {
                 headers: {
                     'Authorization': `Bearer ${token}`,
                     'X-User-Id': token
                 }
             });
             if (res.ok) {
-                const data = await res.json();
+                const reader = res.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = "";
+                let data = [];
+                for (;;) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split("\n");
+                    buffer = lines.pop();
+                    const batch = lines.filter(Boolean).map(line => JSON.parse(line));
+                    if (batch.length) {
+                        data = data.concat(batch);
+                        setMessages(data);
+                    }
+                }
                 setMessages(data);
+                lastSeenId.current = maxPersistedId(data, lastSeenId.current);
                 scrollToBottom();
             }
         } catch {
@@ -41,10 +66,23 @@ const ChatWindow = ({ currentUser, chatPartner, token, onClose, supportChatEnabl
     useEffect(() => {
         const t = setTimeout(() => fetchHistory(), 0);
 
+        const appendMessages = (incoming) => {
+            lastSeenId.current = maxPersistedId(incoming, lastSeenId.current);
+            const relevant = incoming.filter(m => m.sender_id === chatPartner.id || m.receiver_id === chatPartner.id);
+            if (!relevant.length) return;
+            setMessages(prev => {
+                const known = new Set(prev.map(m => m.id));
+                const fresh = relevant.filter(m => !known.has(m.id));
+                return fresh.length ? [...prev, ...fresh] : prev;
+            });
+            scrollToBottom();
+        };
+
         const connectWebSocket = () => {
             if (ws.current && ws.current.readyState === WebSocket.OPEN) return;
 
-            const socket = new WebSocket(`${WS_URL}/ws/chat?token=${token}`);
+            const syncParam = lastSeenId.current !== null ? `&last_seen_message_id=${lastSeenId.current}` : "";
+            const socket = new WebSocket(`${WS_URL}/ws/chat?token=${token}${syncParam}`);
 
             socket.onopen = () => {
                 setStatus("connected");
@@ -54,19 +92,34 @@ const ChatWindow = ({ currentUser, chatPartner, token, onClose, supportChatEnabl
                 try {
                     const msg = JSON.parse(event.data);
 
+                    // Sending too fast: show the hint, unlock input again after the wait
+                    if (msg.type === 'rate_limited') {
+                        setErrorMessage(msg.error);
+                        setStatus("error");
+                        setTimeout(() => setStatus("connected"), Math.ceil((msg.retry_after || 1) * 1000));
+                        return;
+                    }
+
                     if (msg.error) {
                         setErrorMessage(msg.error);
                         setStatus("error");
                         return;
                     }
 
-                    if (msg.sender_id === chatPartner.id || msg.receiver_id === chatPartner.id) {
-                        setMessages(prev => {
-                            if (prev.some(m => m.id === msg.id)) return prev;
-                            return [...prev, msg];
-                        });
-                        scrollToBottom();
+                    // Server heartbeat: answer so the connection is not reaped as idle
+                    if (msg.type === 'ping') {
+                        socket.send(JSON.stringify({ type: 'pong' }));
+                        return;
+                    }
+
+                    // Missed messages after a reconnect
+                    if (msg.type === 'sync') {
+                        appendMessages(msg.messages || []);
+                        return;
                     }
+                    if (msg.type) return;
+
+                    appendMessages([msg]);
                 } catch {
                     // Silently handle malformed messages
                 }
@@ -61,6 +61,12 @@ const Inbox = ({ onSelectChat }) => {
                                     alt={conv.partner_username}
                                     className="w-16 h-16 rounded-full object-cover border-2 border-pink-500"
                                 />
+                                {conv.partner_presence?.online && (
+                                    <span
+                                        className="absolute bottom-0 right-0 bg-green-500 w-4 h-4 rounded-full ring-2 ring-white"
+                                        title="Online"
+                                    />
+                                )}
                                 {conv.unread_count > 0 && (
                                     <span className="absolute -top-1 -right-1 bg-red-500 text-white w-6 h-6 flex items-center justify-center rounded-full text-xs font-bold ring-2 ring-white">
                                         {conv.unread_count}